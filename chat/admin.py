@@ -1,7 +1,10 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from .models import Product, ChatHistory
+from .models import Product, ChatHistory, ConversationSummary, AssistantThread, PrewarmedThread
 
 admin.site.register(Product)
-admin.site.register(ChatHistory)
\ No newline at end of file
+admin.site.register(ChatHistory)
+admin.site.register(ConversationSummary)
+admin.site.register(AssistantThread)
+admin.site.register(PrewarmedThread)
@@ -8,10 +8,13 @@ class ChatConfig(AppConfig):
     
 from django.apps import AppConfig
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.text_splitter import CharacterTextSplitter
+from django.conf import settings
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -20,29 +23,185 @@ class ChatConfig(AppConfig):
     llm = None
     embeddings = None
     retriever = None
+    product_index = None
+    index_version = None  # catalog version the product index was last synced to
+    _index_executor = None
+    _index_sync_queued = False
+    _index_lock = threading.Lock()
+    _index_sync_lock = threading.Lock()
+
+    # Readiness of the LLM/retriever: "idle" -> "warming" -> "ready" (or "failed")
+    startup_state = "idle"
+    startup_error = None
+    _init_lock = threading.Lock()
 
     def initialize_langchain_components(self):
-        if self.llm is None:
-            self.llm = ChatOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        if self.embeddings is None:
-            self.embeddings = OpenAIEmbeddings(api_key=os.environ.get("OPENAI_API_KEY"))
-        if self.retriever is None:
-            from .models import Product  # Import Product here
-            self.retriever = self.load_and_index_products(self.embeddings, Product)
+        with self._init_lock:
+            if self.startup_state == "ready":
+                return
+            self.startup_state = "warming"
+            try:
+                if self.llm is None:
+                    self.llm = ChatOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+                if self.embeddings is None:
+                    from .embeddings import CachedEmbeddings
+
+                    # One cache backs both the product index build and query embedding
+                    self.embeddings = CachedEmbeddings(
+                        OpenAIEmbeddings(api_key=os.environ.get("OPENAI_API_KEY")),
+                        memory_size=settings.CHAT_EMBEDDING_CACHE_SIZE,
+                        db_path=settings.CHAT_EMBEDDING_CACHE_PATH,
+                        batch_size=settings.CHAT_EMBEDDING_BATCH_SIZE,
+                    )
+                if self.retriever is None:
+                    from .models import Product  # Import Product here
+                    self.retriever = self.load_and_index_products(self.embeddings, Product)
+            except Exception as e:
+                self.startup_state = "failed"
+                self.startup_error = str(e)
+                print(f"ChatConfig: LangChain initialization failed: {e}")
+                raise
+            self.startup_state = "ready"
+            self.startup_error = None
+            print("ChatConfig: LangChain components ready.")
+
+    def get_llm(self):
+        """Return the LLM, building the LangChain components on first use if needed."""
+        if self.startup_state != "ready":
+            self.initialize_langchain_components()
+        return self.llm
+
+    def get_retriever(self):
+        """Return the product retriever, building the LangChain components on first use if needed."""
+        if self.startup_state != "ready":
+            self.initialize_langchain_components()
+        return self.retriever
+
+    async def aget_llm(self):
+        """get_llm() for async callers; waits for the warm-up off the event loop."""
+        if self.startup_state != "ready":
+            await sync_to_async(self.initialize_langchain_components, thread_sensitive=False)()
+        return self.llm
+
+    async def aget_retriever(self):
+        """get_retriever() for async callers; waits for the warm-up off the event loop."""
+        if self.startup_state != "ready":
+            await sync_to_async(self.initialize_langchain_components, thread_sensitive=False)()
+        return self.retriever
+
+    def start_warmup(self):
+        """Build the LangChain components on a background thread so startup isn't blocked."""
+        def warmup():
+            try:
+                self.initialize_langchain_components()
+            except Exception:
+                pass  # Already recorded in startup_state/startup_error; requests retry lazily
+
+        threading.Thread(target=warmup, name="chat-warmup", daemon=True).start()
 
     def load_and_index_products(self, embeddings, Product):
-        products = Product.objects.all()
-        documents = []
-        for product in products:
-            documents.append(f"Product Name: {product.name}\nCategory: {product.category}\nDescription: {product.description}")
+        backend = settings.CHAT_RETRIEVER_BACKEND
+        if backend == "numpy":
+            from .retrievers import NumpyProductIndex
 
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        texts = text_splitter.create_documents(documents)
+            # Exact in-memory search; vectors come from the embedding cache
+            self.product_index = NumpyProductIndex(embeddings)
+        elif backend == "hybrid":
+            from .retrievers import HybridProductIndex
 
-        db = Chroma.from_documents(texts, embeddings)
-        retriever = db.as_retriever(search_kwargs={"k": 2})
+            # BM25 + exact vectors with category/price prefiltering
+            self.product_index = HybridProductIndex(embeddings, alpha=settings.CHAT_HYBRID_ALPHA)
+        elif backend == "chroma":
+            from .vector_index import ChromaProductIndex
+
+            # Persistent index: only new or changed products are embedded on boot
+            self.product_index = ChromaProductIndex(embeddings, settings.CHAT_VECTOR_INDEX_DIR)
+        else:
+            raise ValueError(f"Unknown CHAT_RETRIEVER_BACKEND: {backend!r}")
+        self._sync_index(Product)
+        retriever = self.product_index.as_retriever(search_kwargs={"k": 2})
         return retriever
 
+    def _sync_index(self, Product, force=True):
+        from .catalog import product_catalog
+
+        with self._index_sync_lock:
+            # Version read first: products read after it are at least as new, a newer version just syncs again
+            version = product_catalog.snapshot().version
+            if not force and version == self.index_version:
+                return
+            self.product_index.sync(Product.objects.only('id', 'name', 'category', 'description', 'price').iterator())
+            self.index_version = version
+
+    def request_index_sync(self, snapshot=None):
+        """
+        Bring the product index up to date with the catalog on a background thread,
+        so Product saves never wait on the embedding API. Also registered as a
+        catalog reload listener: a snapshot whose version differs from the indexed
+        one means products changed (possibly in another process). Requests made
+        while a sync is queued are coalesced into it.
+        """
+        if self.product_index is None or (snapshot is not None and snapshot.version == self.index_version):
+            return
+        with self._index_lock:
+            if self._index_sync_queued:
+                return
+            self._index_sync_queued = True
+            if self._index_executor is None:
+                self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-index")
+        self._index_executor.submit(self._run_index_sync)
+
+    def _run_index_sync(self):
+        from django.db import close_old_connections
+
+        from .models import Product
+
+        self._index_sync_queued = False
+        try:
+            self._sync_index(Product, force=False)
+        except Exception as e:
+            # Index maintenance must never break anything else; the next catalog reload retries
+            print(f"ChatConfig: Error syncing product index: {e}")
+        finally:
+            close_old_connections()
+
+    def serves_traffic(self):
+        """
+        True only where the process was declared a server: the CHAT_WARMUP
+        environment variable ("1"/"0"; chatbot_project/asgi.py and wsgi.py set
+        it to "1"), or a manage.py command listed in CHAT_SERVING_COMMANDS
+        (not the runserver autoreloader's parent process). Scripts, shells,
+        tests and other management commands never warm up.
+        """
+        explicit = os.environ.get("CHAT_WARMUP")
+        if explicit is not None:
+            return explicit.strip().lower() in ("1", "true", "yes")
+        program = os.path.basename(sys.argv[0]) if sys.argv else ""
+        if program not in ("manage.py", "django-admin", "django-admin.py"):
+            return False
+        command = sys.argv[1] if len(sys.argv) > 1 else ""
+        if command not in settings.CHAT_SERVING_COMMANDS:
+            return False
+        if command == "runserver" and "--noreload" not in sys.argv and os.environ.get("RUN_MAIN") != "true":
+            return False
+        return True
+
     def ready(self):
         super().ready()
-        self.initialize_langchain_components()
\ No newline at end of file
+        from . import signals  # noqa: F401  Connect Product cache invalidation
+        from .catalog import product_catalog
+
+        product_catalog.add_reload_listener(self.request_index_sync)  # Picks up other processes' product changes
+
+        if self.serves_traffic():
+            from .threads import thread_pool
+
+            thread_pool.start()  # Keep pre-warmed Assistants threads ready for new users
+
+        mode = settings.CHAT_STARTUP_MODE
+        if mode == "lazy" or not self.serves_traffic():
+            print(f"ChatConfig: Skipping LangChain warm-up (mode={mode}, argv={sys.argv[:2]}).")
+        elif mode == "eager":
+            self.initialize_langchain_components()
+        else:
+            self.start_warmup()
\ No newline at end of file
@@ -0,0 +1,152 @@
+# chat/assistant_runs.py
+import asyncio
+import time
+
+from django.conf import settings
+
+print("--- Loading chat/assistant_runs.py ---")
+
+# Statuses after which a run makes no further progress on its own
+# ("requires_action" waits for tool outputs, which these endpoints never submit)
+FINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+
+
+def _poll_delays():
+    """Backoff between runs.retrieve calls: CHAT_ASSISTANT_POLL_INITIAL growing x1.5 up to CHAT_ASSISTANT_POLL_MAX."""
+    delay = settings.CHAT_ASSISTANT_POLL_INITIAL
+    while True:
+        yield delay
+        delay = min(delay * 1.5, settings.CHAT_ASSISTANT_POLL_MAX)
+
+
+def _run_from_event(event):
+    return event.data if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step.") else None
+
+
+def _started_run(page, started_at):
+    """The run our failed stream request created, if it got that far: newest run on the thread started since started_at."""
+    for run in page.data:
+        if run.created_at >= int(started_at) - 1:
+            return run
+    return None
+
+
+def _cancel(client, thread_id, run_id):
+    try:
+        return client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"assistant_runs: Could not cancel run {run_id}: {e}")
+        return None
+
+
+def run_and_wait(client, thread_id, assistant_id, timeout=None):
+    """
+    Start an assistant run and block until it reaches a final status.
+    Uses streamed run events when CHAT_ASSISTANT_RUN_STREAMING is on (the
+    stream ends exactly when the run does), otherwise polls with adaptive
+    backoff. Past the deadline the run is cancelled. Returns the last Run seen.
+    """
+    timeout = timeout or settings.CHAT_ASSISTANT_RUN_TIMEOUT
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
+    run = None
+    if settings.CHAT_ASSISTANT_RUN_STREAMING:
+        requested_at = time.time()
+        try:
+            # The request timeout bounds each read too, so a stalled stream can't outlive the deadline
+            with client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, stream=True,
+                                                 timeout=timeout) as stream:
+                for event in stream:
+                    run = _run_from_event(event) or run
+                    if run is not None and run.status in FINAL_STATUSES:
+                        break
+                    if run is not None and time.monotonic() > deadline:
+                        print(f"assistant_runs: Run {run.id} exceeded its deadline, cancelling.")
+                        return _cancel(client, thread_id, run.id) or run
+        except Exception as e:
+            if run is None:
+                # The run may exist even though no event arrived; polling it avoids a second run on the thread
+                try:
+                    run = _started_run(client.beta.threads.runs.list(thread_id=thread_id, order="desc", limit=1), requested_at)
+                except Exception as list_error:
+                    print(f"assistant_runs: Could not list runs: {list_error}")
+            if run is None:
+                print(f"assistant_runs: Streaming run failed to start, polling instead: {e}")
+            else:
+                print(f"assistant_runs: Run stream interrupted, polling run {run.id}: {e}")
+
+    if run is None:
+        run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    delays = _poll_delays()
+    while run.status not in FINAL_STATUSES:
+        if time.monotonic() > deadline:
+            print(f"assistant_runs: Run {run.id} exceeded its deadline, cancelling.")
+            return _cancel(client, thread_id, run.id) or run
+        time.sleep(next(delays))
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    print(f"assistant_runs: Run {run.id} finished with status {run.status} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return run
+
+
+async def _acancel(client, thread_id, run_id):
+    try:
+        return await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"assistant_runs: Could not cancel run {run_id}: {e}")
+        return None
+
+
+async def arun_and_wait(client, thread_id, assistant_id, timeout=None):
+    """
+    Async variant of run_and_wait() for AsyncOpenAI. The deadline is enforced
+    with asyncio.timeout, and if the caller is cancelled (client disconnected)
+    the run is cancelled on the API side too.
+    """
+    started = time.perf_counter()
+    run = None
+
+    async def wait():
+        nonlocal run
+        if settings.CHAT_ASSISTANT_RUN_STREAMING:
+            requested_at = time.time()
+            try:
+                stream = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, stream=True)
+                async with stream:
+                    async for event in stream:
+                        run = _run_from_event(event) or run
+                        if run is not None and run.status in FINAL_STATUSES:
+                            return
+            except Exception as e:
+                if run is None:
+                    try:
+                        run = _started_run(await client.beta.threads.runs.list(thread_id=thread_id, order="desc", limit=1),
+                                           requested_at)
+                    except Exception as list_error:
+                        print(f"assistant_runs: Could not list runs: {list_error}")
+                if run is None:
+                    print(f"assistant_runs: Streaming run failed to start, polling instead: {e}")
+                else:
+                    print(f"assistant_runs: Run stream interrupted, polling run {run.id}: {e}")
+
+        if run is None:
+            run = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+        delays = _poll_delays()
+        while run.status not in FINAL_STATUSES:
+            await asyncio.sleep(next(delays))
+            run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+    try:
+        async with asyncio.timeout(timeout or settings.CHAT_ASSISTANT_RUN_TIMEOUT):
+            await wait()
+    except TimeoutError:
+        if run is None:
+            raise
+        print(f"assistant_runs: Run {run.id} exceeded its deadline, cancelling.")
+        return await _acancel(client, thread_id, run.id) or run
+    except asyncio.CancelledError:
+        if run is not None and run.status not in FINAL_STATUSES:
+            print(f"assistant_runs: Caller went away, cancelling run {run.id}.")
+            await asyncio.shield(_acancel(client, thread_id, run.id))
+        raise
+    print(f"assistant_runs: Run {run.id} finished with status {run.status} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return run
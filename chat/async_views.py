@@ -0,0 +1,145 @@
+# chat/async_views.py
+import asyncio
+import json
+
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import chatbot_logic
+from .streaming import sse_event
+from .suggestions import suggestion_cache
+
+print("--- Loading chat/async_views.py ---")
+
+User = get_user_model()
+
+_jwt_authentication = JWTAuthentication()
+
+
+async def authenticate_jwt(request):
+    """
+    Async equivalent of DRF's JWTAuthentication for plain Django views: the
+    token is checked in-process and the user loaded with the async ORM.
+    Returns the active user or None.
+    """
+    header = _jwt_authentication.get_header(request)
+    if header is None:
+        return None
+    raw_token = _jwt_authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    try:
+        validated_token = _jwt_authentication.get_validated_token(raw_token)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        user = await User.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except (InvalidToken, TokenError, AuthenticationFailed, KeyError, User.DoesNotExist) as e:
+        print(f"async_views: JWT authentication failed: {e}")
+        return None
+    return user if user.is_active else None
+
+
+class AsyncChatAPIView(View):
+    """
+    Base for async-native chat endpoints (the ASGI handler runs them on the event
+    loop instead of a sync_to_async thread). Authenticates with the same JWTs as
+    the DRF views; if the client disconnects, Django cancels the handler and the
+    in-flight OpenAI request is cancelled with it.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated API, exempt from session CSRF like DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await authenticate_jwt(request)
+        if request.user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except asyncio.CancelledError:
+            print(f"async_views: {request.path} cancelled (client disconnected).")
+            raise
+
+    @staticmethod
+    def request_data(request):
+        if request.content_type == "application/json":
+            try:
+                return json.loads(request.body or b"{}")
+            except json.JSONDecodeError:
+                return {}
+        return request.POST
+
+
+class AsyncSuggestionView(AsyncChatAPIView):
+    """Async version of views.SuggestionView."""
+
+    async def get(self, request):
+        try:
+            suggestions = await suggestion_cache.aget(request.user.id)
+            return JsonResponse({"suggestions": suggestions}, status=status.HTTP_200_OK)
+        except Exception as e:
+            print(f"async_views: Error getting suggestions from OpenAI: {e}")
+            return JsonResponse({"suggestions": []}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncSendMessageView(AsyncChatAPIView):
+    """
+    Async version of views.SendMessageView (same request and response bodies).
+    With "Accept: text/event-stream" (or "stream": true) the reply is streamed
+    as Server-Sent Events instead.
+    """
+    retrieval_endpoint = "send"
+
+    async def post(self, request):
+        data = self.request_data(request)
+        user_message = data.get('message')
+        initial_suggestions = data.get('initial_suggestions') or []
+
+        print(f"User: {request.user.username}, Message Received: {user_message}")
+
+        if not user_message:
+            return JsonResponse({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if self.wants_stream(request, data):
+            response = StreamingHttpResponse(
+                self.event_stream(request.user, user_message, initial_suggestions),
+                content_type="text/event-stream",
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"  # Don't let nginx buffer the stream
+            return response
+
+        try:
+            result = await chatbot_logic.process_chat_turn(
+                request.user, user_message, endpoint=self.retrieval_endpoint, exclude=initial_suggestions,
+            )
+        except Exception as e:
+            print(f"async_views: Error getting response from OpenAI: {e}")
+            return JsonResponse({"error": "Failed to get response from OpenAI"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse(result, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def wants_stream(request, data):
+        return "text/event-stream" in request.headers.get("Accept", "") or str(data.get("stream", "")).lower() in ("1", "true")
+
+    async def event_stream(self, user, user_message, initial_suggestions):
+        """SSE body: "delta" events with answer text, then "done" with the parsed reply (or "error")."""
+        try:
+            async for kind, payload in chatbot_logic.stream_chat_turn(
+                user, user_message, endpoint=self.retrieval_endpoint, exclude=initial_suggestions,
+            ):
+                if kind == "delta":
+                    yield sse_event("delta", {"text": payload})
+                else:
+                    yield sse_event("done", payload)
+        except Exception as e:
+            print(f"async_views: Error streaming response from OpenAI: {e}")
+            yield sse_event("error", {"error": "Failed to get response from OpenAI"})
@@ -0,0 +1,54 @@
+# chat/audio_frames.py
+import struct
+import uuid
+
+print("--- Loading chat/audio_frames.py ---")
+
+# Binary WebSocket audio frame (all integers big-endian), followed by the audio bytes:
+#   version  u8   FRAME_VERSION
+#   flags    u8   FLAG_FINAL on the last frame of a tts chunk
+#   mime     u8   code from MIME_CODES (0 = unknown)
+#   (pad)    1 byte
+#   seq      u32  tts chunk sequence number within the session (same as JSON "seq")
+#   part     u16  index of this frame within the chunk
+#   session  16 bytes, the session UUID sent by the client
+FRAME_VERSION = 1
+FLAG_FINAL = 0x01
+HEADER = struct.Struct("!BBBxIH16s")
+
+MIME_CODES = {
+    "audio/mpeg": 1,
+    "audio/wav": 2,
+    "audio/ogg": 3,
+}
+
+
+def session_bytes(session_id):
+    """16-byte form of a UUID session id, or None if it isn't a UUID (use the JSON path then)."""
+    try:
+        return uuid.UUID(str(session_id)).bytes
+    except ValueError:
+        return None
+
+
+def encode_audio_frames(session, seq, audio, mime, chunk_size):
+    """Split audio into binary frames of at most chunk_size audio bytes each."""
+    chunk_size = max(1, chunk_size)
+    mime_code = MIME_CODES.get(mime, 0)
+    parts = range(0, len(audio), chunk_size) if audio else [0]
+    last = len(parts) - 1
+    view = memoryview(audio)
+    return [
+        HEADER.pack(FRAME_VERSION, FLAG_FINAL if index == last else 0, mime_code, seq, index, session)
+        + view[offset:offset + chunk_size].tobytes()
+        for index, offset in enumerate(parts)
+    ]
+
+
+def decode_audio_frame(frame):
+    """Inverse of encode_audio_frames() for one frame: (session_id, seq, part, final, mime, audio). Reference for clients (chat.js mirrors it) and the tests."""
+    version, flags, mime_code, seq, part, session = HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported audio frame version {version}")
+    mime = next((name for name, code in MIME_CODES.items() if code == mime_code), "")
+    return str(uuid.UUID(bytes=session)), seq, part, bool(flags & FLAG_FINAL), mime, frame[HEADER.size:]
@@ -0,0 +1,154 @@
+# chat/catalog.py
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+print("--- Loading chat/catalog.py ---")
+
+# Compact per-product record kept in memory instead of full model instances.
+CatalogEntry = namedtuple("CatalogEntry", ["id", "name", "category", "price"])
+
+
+def normalize_name(name):
+    """Case-folded, whitespace-collapsed key used for all name lookups."""
+    return " ".join(str(name).replace("\xa0", " ").split()).casefold()
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the product catalog at a given version (a hash of the
+    product rows, so reloading unchanged products keeps the same version).
+    Callers can hold on to a snapshot for the duration of a request and get
+    consistent answers even if the catalog is invalidated meanwhile.
+    loaded_at is when the rows were read: a snapshot loaded later (in any
+    process) reflects a catalog at least as new.
+    """
+
+    def __init__(self, version, entries, loaded_at=None):
+        self.version = version
+        self.loaded_at = loaded_at or timezone.now()
+        self.entries = tuple(entries)
+        self.by_id = {entry.id: entry for entry in self.entries}
+        self.by_name = {}
+        for entry in self.entries:
+            # First product wins if two names only differ by case/whitespace
+            self.by_name.setdefault(normalize_name(entry.name), entry)
+        self.names = tuple(entry.name for entry in self.entries)
+        self._matcher = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, name):
+        """Return the CatalogEntry for a product name (case-insensitive) or None."""
+        if not name:
+            return None
+        return self.by_name.get(normalize_name(name))
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    @property
+    def matcher(self):
+        """ProductNameMatcher for this catalog version, built on first use."""
+        if self._matcher is None:
+            from .matcher import ProductNameMatcher
+
+            self._matcher = ProductNameMatcher(self.entries)
+        return self._matcher
+
+
+class ProductCatalog:
+    """
+    Process-wide cache of the Product table.
+    Loaded once on first use and invalidated through Product post_save/post_delete
+    signals (see chat/signals.py). CHAT_CATALOG_TTL bounds how stale the cache can
+    get when another process changes products, since signals are process-local.
+    Reload listeners let per-process derived state (the product index) notice
+    changes made elsewhere by comparing snapshot versions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._listeners = []
+
+    def add_reload_listener(self, listener):
+        """Call listener(snapshot) after every reload from the DB; it must not block."""
+        self._listeners.append(listener)
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def _is_fresh(self):
+        if self._snapshot is None:
+            return False
+        ttl = getattr(settings, "CHAT_CATALOG_TTL", 300)
+        return not ttl or (time.monotonic() - self._loaded_at) < ttl
+
+    def _load(self):
+        from .models import Product  # Avoid importing models at module load
+
+        loaded_at = timezone.now()  # Taken before the read, so the rows are at least this new
+        rows = Product.objects.order_by("id").values_list("id", "name", "category", "price", "description")
+        entries = []
+        digest = hashlib.sha256()
+        for *fields, description in rows:
+            entry = CatalogEntry(*fields)
+            entries.append(entry)
+            # Descriptions aren't kept, but they feed retrieved context, so they count as a change
+            digest.update(repr((*entry, description)).encode("utf-8"))
+        return digest.hexdigest()[:16], entries, loaded_at
+
+    def _store(self, version, entries, loaded_at):
+        self._snapshot = CatalogSnapshot(version, entries, loaded_at)
+        self._loaded_at = time.monotonic()
+        print(f"catalog: Loaded {len(self._snapshot)} products (version {version}).")
+        for listener in self._listeners:
+            try:
+                listener(self._snapshot)
+            except Exception as e:
+                print(f"catalog: Error in reload listener: {e}")
+        return self._snapshot
+
+    def snapshot(self):
+        """Return the current CatalogSnapshot, loading it from the DB if needed."""
+        snapshot = self._snapshot
+        if self._is_fresh():
+            return snapshot
+        with self._lock:
+            if self._is_fresh():
+                return self._snapshot
+            return self._store(*self._load())
+
+    async def asnapshot(self):
+        """Async variant of snapshot(); only touches the DB on a cache miss."""
+        snapshot = self._snapshot
+        if self._is_fresh():
+            return snapshot
+        # Off the shared sync thread: a catalog reload shouldn't queue behind other ORM work (_lock guards the state)
+        return await sync_to_async(self._snapshot_in_worker, thread_sensitive=False)()
+
+    def _snapshot_in_worker(self):
+        try:
+            return self.snapshot()
+        finally:
+            connections.close_all()  # This executor thread's connection would otherwise stay open
+
+    def invalidate(self):
+        """Drop the cached snapshot; the next access reloads it."""
+        with self._lock:
+            self._snapshot = None
+        print("catalog: Invalidated.")
+
+
+product_catalog = ProductCatalog()
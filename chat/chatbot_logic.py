@@ -3,20 +3,24 @@ import os
 import time
 import asyncio # Import asyncio
 from openai import OpenAI
-from .models import ChatHistory, Product # Import your models
+from .models import ChatHistory # Import your models
+from .catalog import product_catalog
+from .retrieval import aretrieve_relevant_info, retrieval_mode
+from .response_cache import response_cache
+from .history import abuild_history_window
+from .history_writer import history_writer
+from .openai_clients import get_async_openai_client
+from .assistant_runs import arun_and_wait
+from .threads import thread_resolver
+from .streaming import ResponseStreamSplitter
 # from django.apps import apps # Might not be needed if you pass necessary data directly
 
 # --- UNIQUE PRINT STATEMENT TO VERIFY FILE LOADING ---
 print("--- Loading chat/chatbot_logic.py (Version 2) ---")
 # -----------------------------------------------------------------------
 
-# Initialize OpenAI client globally (or handle in consumer if per-connection needed)
-# For simplicity, let's assume env var is set and initialize globally or pass API key
-# It's generally better to initialize clients within async functions or consumers
-# as shown in google_cloud_voice.py for better async compatibility, but for
-# synchronous parts run via run_in_executor, a global client might be okay.
-# Let's stick to initializing within the async functions for consistency.
-# client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# OpenAI clients come from chat/openai_clients.py: one pooled AsyncOpenAI client per
+# event loop, shared by the coroutines below and awaited directly (no executor hops).
 # assistant_id = os.environ.get("OPENAI_ASSISTANT_ID")
 
 
@@ -24,101 +28,15 @@ print("--- Loading chat/chatbot_logic.py (Version 2) ---")
 async def load_or_create_openai_thread_async(user):
     """
     Loads an existing OpenAI Assistant thread ID for a user or creates a new one.
-    Handles synchronous database and OpenAI calls using run_in_executor.
+    Resolved through chat/threads.py: cached per user, and concurrent connects
+    from the same user share a single creation.
     """
-    # Get the current event loop
-    loop = asyncio.get_event_loop()
-    # Initialize OpenAI client here to ensure it's in an appropriate context
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY")) # Initialize here
-
     print(f"chatbot_logic: Attempting to load or create thread for user: {user.username}") # Add log
-
-    # Run synchronous DB query in a thread pool
     try:
-        chat_history_entry = await loop.run_in_executor(
-            None, # Use default thread pool
-            lambda: ChatHistory.objects.filter(user=user, thread_id__isnull=False).order_by('-timestamp').first() # Order by timestamp to get latest
-        )
-        thread_id = chat_history_entry.thread_id if chat_history_entry else None
-        print(f"chatbot_logic: Retrieved Thread ID from DB: {thread_id}") # Add log
-
+        return await thread_resolver.aresolve(user, get_async_openai_client())
     except Exception as e:
-        print(f"chatbot_logic: Error retrieving thread from DB: {e}") # Add log
-        thread_id = None # Ensure thread_id is None on DB error
-
-
-    if not thread_id:
-        print("chatbot_logic: No existing thread found. Creating new thread...") # Add log
-        try:
-            # Run synchronous OpenAI call in a thread pool
-            thread = await loop.run_in_executor(
-                None,
-                lambda: client.beta.threads.create()
-            )
-            thread_id = thread.id
-            print(f"chatbot_logic: New Thread Created: {thread_id}") # Add log
-
-            # Store the new thread_id in the database (sync DB call in thread pool)
-            await loop.run_in_executor(
-                None,
-                lambda: ChatHistory.objects.create(user=user, role="system", content="Initial context set", thread_id=thread_id)
-            )
-            print("chatbot_logic: New thread ID saved to database.") # Add log
-
-            # Fetch available products (sync DB call in thread pool)
-            available_products = await loop.run_in_executor(
-                None,
-                lambda: list(Product.objects.values_list('name', flat=True))
-            )
-            print(f"chatbot_logic: Available Products fetched: {list(available_products)}") # Add log
-
-            products_formatted = "\n".join([f"- {product}" for product in available_products])
-
-            # Prepare and send initial context message (sync OpenAI call in thread pool)
-            # Keep your augmented prompt structure
-            initial_context_message = f"""You are a helpful AI assistant for suggesting products. Your goal is to suggest relevant products from the following list: {', '.join(available_products)}. When the user asks for product suggestions, understand the category and suggest up to 3 products. Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. Remember the user's name if provided.\n\nAvailable Products:\n{products_formatted}"""
-            print(f"chatbot_logic: Initial Context Message:\n{initial_context_message}") # Add log
-
-            await loop.run_in_executor(
-                None,
-                lambda: client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="user",
-                    content=initial_context_message,
-                )
-            )
-            print("chatbot_logic: Initial Context Sent to Assistant.") # Add log
-
-        except Exception as e:
-            print(f"chatbot_logic: Error creating new thread or sending initial context: {e}") # Add log
-            # Depending on severity, you might want to raise the exception
-            raise # Re-raise to signal failure
-
-    else:
-        print("chatbot_logic: Using existing thread from database.") # Add log
-
-    return thread_id # Return the thread_id
-
-def retrieve_relevant_info(self, query, retriever, llm):
-        prompt_template = """Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-        Context:
-        {context}
-
-        Question: {question}"""
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        qa = RetrievalQA.from_chain_type(
-            llm=apps.get_app_config('chat').llm,
-            chain_type="stuff",
-            retriever=apps.get_app_config('chat').retriever,
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
-        result = qa({"query": query})
-        return result['result']
+        print(f"chatbot_logic: Error creating new thread or sending initial context: {e}") # Add log
+        raise # Re-raise to signal failure
 
 # This async function replaces the core logic inside SendMessageView.post
 async def process_voice_transcript1(user, user_message, thread_id):
@@ -126,12 +44,9 @@ async def process_voice_transcript1(user, user_message, thread_id):
     Processes a user's voice transcript using the OpenAI Assistant.
     Adds message to thread, runs the assistant, retrieves response,
     and parses for text and suggested products.
-    Handles synchronous database and OpenAI calls using run_in_executor.
+    Uses AsyncOpenAI and the async ORM, so no executor threads are held while waiting.
     """
-    # Get the current event loop
-    loop = asyncio.get_event_loop()
-    # Initialize OpenAI client here
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY")) # Initialize here
+    client = get_async_openai_client()  # Shared pooled client
     assistant_id = os.environ.get("OPENAI_ASSISTANT_ID") # Initialize here
 
     if not assistant_id:
@@ -140,65 +55,35 @@ async def process_voice_transcript1(user, user_message, thread_id):
 
     print(f"chatbot_logic: Processing message with Assistant: '{user_message}' for thread: {thread_id}") # Add log
 
-    # --- Add Current User Message (sync OpenAI call in thread pool) ---
+    # --- Add Current User Message ---
     # Use the augmented message structure you had in SendMessageView
     new_message_content = f"""users message : {user_message} note : if the user asks for product suggestions, understand the category and suggest up to 3 products else if not asked for product give info they needed but at end try ask if any product is requied. Format your response with **Response:** followed by your conversational answer, and then **Suggested Products:** followed by a bulleted list of product names, remember the format. if not asked for product act as general bot and tell what is asked for. After bulleted list of product names do not add any info and info in responce and maintain format"""
 
     try:
-        await loop.run_in_executor(
-             None,
-             lambda: client.beta.threads.messages.create(
-                  thread_id=thread_id,
-                  role="user",
-                  content=new_message_content,
-             )
+        await client.beta.threads.messages.create(
+             thread_id=thread_id,
+             role="user",
+             content=new_message_content,
         )
         print("chatbot_logic: User message added to thread.") # Add log
 
-        # Save user message to database (sync DB call in thread pool)
-        await loop.run_in_executor(
-             None,
-             lambda: ChatHistory.objects.create(
-                  user=user,
-                  role="user",
-                  content=user_message, # Save original user message
-                  thread_id=thread_id
-             )
-        )
-        print("chatbot_logic: User message saved to database.") # Add log
+        # Save user message to database (write-behind, in order with the other endpoints' turns)
+        history_writer.enqueue(user, "user", user_message, thread_id=thread_id) # Save original user message
+        print("chatbot_logic: User message queued for the database.") # Add log
 
-        # --- Run the Assistant (sync OpenAI call in thread pool) ---
+        # --- Run the Assistant (streamed run events, or adaptive polling; cancelled on timeout/disconnect) ---
         print("chatbot_logic: Running the Assistant...") # Add log
-        run = await loop.run_in_executor(
-            None,
-            lambda: client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=assistant_id,
-            )
-        )
+        run = await arun_and_wait(client, thread_id, assistant_id)
         print(f"chatbot_logic: Run ID: {run.id}, Status: {run.status}") # Add log
 
-        # --- Poll for Run Completion (sync OpenAI calls in thread pool) ---
-        print("chatbot_logic: Polling for run completion...") # Add log
-        while run.status not in ["completed", "failed", "cancelled", "expired"]:
-            await asyncio.sleep(1) # Use async sleep
-            run = await loop.run_in_executor(
-                None,
-                lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-            )
-            print(f"chatbot_logic: Run Status Updated: {run.status}") # Add log
-
         if run.status != "completed":
              print(f"chatbot_logic: Run did not complete successfully. Final status: {run.status}") # Add log
              return {"response": f"Sorry, the assistant run failed with status: {run.status}", "suggested_products": []}
 
 
-        # --- Retrieve Messages (sync OpenAI call in thread pool) ---
+        # --- Retrieve Messages ---
         print("chatbot_logic: Retrieving messages...") # Add log
-        assistant_messages = await loop.run_in_executor(
-            None,
-            lambda: client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
-        )
+        assistant_messages = await client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
         print("chatbot_logic: Messages retrieved.") # Add log
 
 
@@ -253,38 +138,9 @@ async def process_voice_transcript1(user, user_message, thread_id):
 
 
                     if suggestions_text:
-                        # Parse the suggested product list
-                        # Look for lines starting with '-'
-                        suggestion_lines = [line.strip().lstrip('- ').strip() for line in suggestions_text.split('\n') if line.strip().startswith('-')]
-                        print(f"chatbot_logic: Raw Suggestion Lines: {suggestion_lines}") # Add log
-
-                        # Need to retrieve available products list (sync DB call in thread pool)
-                        available_product_names = await loop.run_in_executor(
-                            None,
-                            lambda: list(Product.objects.values_list('name', flat=True))
-                        )
-                        print(f"chatbot_logic: Available Product Names from DB: {available_product_names}") # Add log
-
-                        # Filter suggestions against actual product names and fetch category
-                        suggested_products = []
-                        for name in suggestion_lines:
-                            cleaned_name = name.strip()
-                            # Case-insensitive comparison for robustness
-                            matching_product = next((p for p in available_product_names if p.lower() == cleaned_name.lower()), None)
-
-                            if matching_product:
-                                # Fetch category (sync DB call in thread pool)
-                                product_obj = await loop.run_in_executor(None, lambda: Product.objects.filter(name__iexact=cleaned_name).first()) # Use iexact for case-insensitivity
-                                suggested_products.append({
-                                    "name": product_obj.name if product_obj else cleaned_name, # Use actual name from DB if found
-                                    "category": product_obj.category if product_obj else None
-                                })
-                                print(f"chatbot_logic: Found matching product: {cleaned_name}") # Add log
-                                if len(suggested_products) >= 3: # Limit to 3
-                                    print("chatbot_logic: Reached limit of 3 suggested products.") # Add log
-                                    break
-                            else:
-                                print(f"chatbot_logic: No matching product found in DB for suggestion: {cleaned_name}") # Add log
+                        # Single pass over the suggestions text with the catalog's name matcher
+                        catalog = await product_catalog.asnapshot()
+                        suggested_products = catalog.matcher.suggested_products(suggestions_text, limit=3)
 
                         print(f"chatbot_logic: Final Filtered Suggested Products: {suggested_products}") # Add log
 
@@ -305,9 +161,7 @@ import os
 import asyncio
 from django.apps import apps  # <-- ADD THIS LINE
 from openai import OpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from chat.models import ChatHistory, Product  # Replace `yourapp` with actual app name
+from chat.models import ChatHistory  # Replace `yourapp` with actual app name
  
 async def process_voice_transcript(user, user_message, thread_id):
     """
@@ -315,48 +169,55 @@ async def process_voice_transcript(user, user_message, thread_id):
     Retrieves relevant info, formats a prompt, calls OpenAI chat completion,
     and extracts structured response and product suggestions.
     """
+    return await process_chat_turn(user, user_message, thread_id=thread_id, endpoint="voice")
+
+
+async def process_chat_turn(user, user_message, thread_id=None, endpoint="send", exclude=()):
+    """
+    One prompt-based chat turn, shared by the voice consumer and the async HTTP
+    views: history window, response cache / retrieval for endpoint, one chat
+    completion, suggestion parsing (skipping products in exclude) and
+    write-behind persistence. Returns {"response", "suggested_products"}.
+    """
+    result = None
+    async for kind, payload in stream_chat_turn(user, user_message, thread_id=thread_id, endpoint=endpoint, exclude=exclude):
+        if kind == "final":
+            result = payload
+    return result
+
+
+async def stream_chat_turn(user, user_message, thread_id=None, endpoint="send", exclude=()):
+    """
+    Streaming form of process_chat_turn(): yields ("delta", text) for the
+    visible answer as completion tokens arrive, then ("final", {"response",
+    "suggested_products"}) once the full reply is parsed. Closing the generator
+    early (client went away) closes the OpenAI stream.
+    """
     try:
-        loop = asyncio.get_running_loop()
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        llm = apps.get_app_config('chat').llm
-        retriever = apps.get_app_config('chat').retriever
-
-        # --- Retrieve relevant information using retriever ---
-        def get_retrieved_info():
-            prompt_template = """Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-Context:
-{context}
-
-Question: {question}"""
-            PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-            qa = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=False,
-                chain_type_kwargs={"prompt": PROMPT}
-            )
-            return qa({"query": user_message})["result"]
+        client = get_async_openai_client()
 
-        retrieved_info = await loop.run_in_executor(None, get_retrieved_info)
+        # --- Get conversation history (token-budgeted window + summary) and product list ---
+        formatted_history = await abuild_history_window(user)
+        # Without history the answer depends only on the query, so this user's earlier answer can be reused
+        response_user = user.id if not formatted_history else None
 
-        # --- Get conversation history and product list ---
-        conversation_history = await loop.run_in_executor(
-            None,
-            lambda: list(ChatHistory.objects.filter(user=user).order_by('timestamp').values_list('role', 'content'))
-        )
-        formatted_history = "\n".join([f"{role.capitalize()}: {content}" for role, content in conversation_history])
+        catalog = await product_catalog.asnapshot()
 
-        available_products = await loop.run_in_executor(
-            None,
-            lambda: list(Product.objects.values_list('name', flat=True))
-        )
+        # --- Retrieve relevant information (or reuse a cached near-duplicate turn) ---
+        mode = retrieval_mode(endpoint)
+        cache_hit = await response_cache.alookup(user_message, catalog.version, mode, response_user)
+        if cache_hit:
+            print(f"chatbot_logic: Response cache {cache_hit.tier} hit (response cached: {bool(cache_hit.response)})")
+            retrieved_info = cache_hit.context
+        else:
+            retrieved_info = await aretrieve_relevant_info(user_message, endpoint=endpoint, mode=mode)
+
+        available_products = catalog.names
         products_formatted = "\n".join([f"- {p}" for p in available_products])
 
         prompt_content = f"""You are a helpful AI assistant for suggesting products from the following list: {', '.join(available_products)}.
 
-You will be provided with relevant product information and the user's current message, along with the entire conversation history for context. Your goal is to respond to the user's query and suggest up to 3 relevant products.
+You will be provided with relevant product information and the user's current message, along with the recent conversation history (older turns summarized) for context. Your goal is to respond to the user's query and suggest up to 3 relevant products.
 
 Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. If no products are relevant, you can omit the "Suggested Products" section.
 
@@ -371,18 +232,37 @@ User: {user_message}
 
 **Response:** """
 
-        # --- Call OpenAI completion endpoint ---
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
+        # --- Call OpenAI completion endpoint (streamed) ---
+        splitter = ResponseStreamSplitter()
+        if cache_hit and cache_hit.response:
+            full_response = cache_hit.response
+            visible = splitter.feed(full_response) + splitter.flush()
+            if visible:
+                yield "delta", visible
+        else:
+            stream = await client.chat.completions.create(
                 model="gpt-4-turbo",
                 messages=[{"role": "user", "content": prompt_content}],
                 max_tokens=500,
                 n=1,
                 temperature=0.7,
+                stream=True,
             )
-        )
-        full_response = response.choices[0].message.content.strip()
+            async with stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    visible = splitter.feed(delta)
+                    if visible:
+                        yield "delta", visible
+            tail = splitter.flush()
+            if tail:
+                yield "delta", tail
+            full_response = splitter.text.strip()
+            if not cache_hit or response_user is not None:
+                await response_cache.astore(user_message, catalog.version, mode, retrieved_info,
+                                            full_response if response_user is not None else None, response_user)
         print(f"chatbot_logic: Full Chatbot Response: {full_response}")
 
         # --- Parse response and extract suggestions ---
@@ -395,37 +275,17 @@ User: {user_message}
             chatbot_response = parts[0].replace("**Response:**", "").strip()
             suggestions_text = parts[1].strip() if len(parts) > 1 else ""
 
-            suggestion_lines = [line.strip().lstrip('- ').strip() for line in suggestions_text.split('\n') if line.strip().startswith('-')]
-
-            for name in suggestion_lines:
-                if name.lower() in [p.lower() for p in available_products]:
-                    product_obj = await loop.run_in_executor(
-                        None,
-                        lambda: Product.objects.filter(name__iexact=name).first()
-                    )
-                    if product_obj:
-                        suggested_products.append({
-                            "name": product_obj.name,
-                            "category": product_obj.category
-                        })
-                    if len(suggested_products) >= 3:
-                        break
-
-        # --- Save messages to DB ---
-        await loop.run_in_executor(
-            None,
-            lambda: ChatHistory.objects.create(user=user, role="user", content=user_message, thread_id=thread_id)
-        )
-        await loop.run_in_executor(
-            None,
-            lambda: ChatHistory.objects.create(user=user, role="assistant", content=chatbot_response, thread_id=thread_id)
-        )
+            suggested_products = catalog.matcher.suggested_products(suggestions_text, exclude=exclude, limit=3)
+
+        # --- Save messages to DB (write-behind, flushed in batches and on disconnect) ---
+        history_writer.enqueue(user, "user", user_message, thread_id=thread_id)
+        history_writer.enqueue(user, "assistant", chatbot_response, thread_id=thread_id)
 
         print(f"chatbot_logic: Final Response: {chatbot_response}")
         print(f"chatbot_logic: Suggested Products: {suggested_products}")
 
-        return {"response": chatbot_response, "suggested_products": suggested_products}
+        yield "final", {"response": chatbot_response, "suggested_products": suggested_products}
 
     except Exception as e:
-        print(f"chatbot_logic: Error processing voice transcript: {e}")
+        print(f"chatbot_logic: Error processing chat turn ({endpoint}): {e}")
         raise
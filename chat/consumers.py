@@ -7,6 +7,10 @@ import base64 # Import base64 for encoding audio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from .services import google_cloud_voice
 from . import chatbot_logic # Assuming this handles interaction with OpenAI
+from .history_writer import history_writer
+from .services.tts_pipeline import SentenceTTSPipeline
+from .audio_frames import encode_audio_frames, session_bytes
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 
@@ -27,6 +31,7 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         # Removed audio_queue, stt_task, _audio_stream_ended as STT is client-side
         self.thread_id = None  # OpenAI Assistant Thread ID for this connection
         self.user = None  # Authenticated Django User instance
+        self.binary_audio = False  # Client negotiated binary audio frames (see chat/audio_frames.py)
         # REMOVED: self.flow_slug attribute is no longer needed
 
 
@@ -87,6 +92,8 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         """Handles WebSocket disconnection."""
         print(f"Voice WebSocket disconnected ({close_code}) for user: {self.user.username if self.user and not self.user.is_anonymous else 'Anonymous'})")
         # No backend STT tasks or queues to clean up here.
+        # Persist buffered chat turns (this user's included) now rather than on the next timed flush.
+        await history_writer.aflush()
         print("Voice WebSocket: Disconnect cleanup finished.")
 
     # --- Receiving Messages from Frontend ---
@@ -111,6 +118,16 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
                     # Process the user's text input in a separate handler
                     await self.handle_user_text(user_text, session_id)
 
+                elif message.get('type') == 'hello':
+                    # Transport negotiation: {"type": "hello", "binary_audio": true}
+                    self.binary_audio = bool(message.get('binary_audio'))
+                    await self.send(text_data=json.dumps({
+                        'type': 'hello',
+                        'binary_audio': self.binary_audio,
+                        'chunk_size': settings.CHAT_WS_AUDIO_CHUNK_BYTES,
+                    }))
+                    print(f"Receive: Client hello, binary audio frames: {self.binary_audio}")
+
                 elif message.get('type') == 'stop_recording':
                     # Frontend signals end of user's speech. Acknowledge if needed.
                     print("Receive: Frontend sent 'stop_recording' message.")
@@ -148,6 +165,36 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         else:
             print("Receive: Received empty message.")
 
+    # --- Sending Synthesized Audio ---
+
+    async def send_tts_chunk(self, session_id, seq, audio_bytes, mime_type):
+        """
+        Sends one audio chunk; seq orders chunks within a session (0 = first).
+        Binary frames if the client negotiated them, base64 in JSON otherwise.
+        """
+        if seq == 0:
+            await self.send(text_data=json.dumps({
+                'type': 'status',
+                'message': 'speaking',
+                'detail': 'Synthesizing response audio...'
+            }))
+        session = session_bytes(session_id) if self.binary_audio else None
+        if session:
+            frames = encode_audio_frames(session, seq, audio_bytes, mime_type, settings.CHAT_WS_AUDIO_CHUNK_BYTES)
+            for frame in frames:
+                await self.send(bytes_data=frame)
+            print(f"send_tts_chunk: Sent audio chunk {seq} as {len(frames)} binary frame(s) ({len(audio_bytes)} bytes).")
+            return
+        encoded_audio = base64.b64encode(audio_bytes).decode('utf-8')
+        await self.send(text_data=json.dumps({
+            'event': 'tts_chunk', # Match frontend expectation for audio playback
+            'session_id': session_id, # Use the session ID from the incoming message
+            'seq': seq,
+            'payload': encoded_audio, # Base64 encoded audio
+            'mime': mime_type # Audio MIME type from your TTS service
+        }))
+        print(f"send_tts_chunk: Sent audio chunk {seq} ({len(encoded_audio)} base64 bytes).")
+
     # --- Handler for User Text Input ---
 
     async def handle_user_text(self, user_text, session_id):
@@ -167,22 +214,43 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
             }))
             print("handle_user_text: Sent 'processing' status.")
 
-            # Call your chatbot logic function (assuming it's async)
-            print("handle_user_text: Calling chatbot_logic.process_voice_transcript...")
-            # Ensure your chatbot_logic.process_voice_transcript function does NOT require flow_slug if it's removed
-            response_data = await chatbot_logic.process_voice_transcript(
-                user=self.user,
-                user_message=user_text,
-                thread_id=self.thread_id
-                # REMOVED: , flow_slug=self.flow_slug # Argument should be removed if chatbot_logic doesn't use it
-            )
+            # Stream the chatbot reply: forward answer deltas as they arrive, then use the parsed final reply
+            # With CHAT_TTS_PIPELINE, sentences are synthesized as soon as they are complete
+            print("handle_user_text: Streaming chatbot_logic.stream_chat_turn...")
+            pipeline = None
+            if settings.CHAT_TTS_PIPELINE:
+                pipeline = SentenceTTSPipeline(
+                    google_cloud_voice.synthesize_text,
+                    lambda seq, audio, mime: self.send_tts_chunk(session_id, seq, audio, mime),
+                    max_parallel=settings.CHAT_TTS_MAX_PARALLEL,
+                    min_chars=settings.CHAT_TTS_MIN_SENTENCE_CHARS,
+                )
+            response_data = {}
+            try:
+                async for kind, payload in chatbot_logic.stream_chat_turn(
+                    self.user, user_text, thread_id=self.thread_id, endpoint="voice"
+                ):
+                    if kind == "delta":
+                        await self.send(text_data=json.dumps({
+                            'type': 'bot_response_delta',
+                            'session_id': session_id,
+                            'text': payload,
+                        }))
+                        if pipeline:
+                            pipeline.feed(payload)
+                    else:
+                        response_data = payload
+            except BaseException:
+                if pipeline:
+                    pipeline.cancel()
+                raise
             chatbot_text_response = response_data.get("response", "").strip()
             suggested_products = response_data.get("suggested_products", [])
 
             print(f"handle_user_text: Chatbot returned text response: '{chatbot_text_response}'")
 
             # --- Send Bot's Text Response and Suggestions to Frontend ---
-            # This message updates the log on the frontend.
+            # Final frame after the deltas: full parsed text plus suggestions.
             await self.send(text_data=json.dumps({
                 'type': 'bot_response',
                 'user_text': user_text, # Include the user's transcribed text
@@ -193,40 +261,27 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
 
             # --- Handle TTS if there is text to speak ---
             if chatbot_text_response:
-                await self.send(text_data=json.dumps({
-                    'type': 'status',
-                    'message': 'speaking',
-                    'detail': 'Synthesizing response audio...'
-                }))
-                print("handle_user_text: Sent 'speaking' status.")
-
-                # Call your TTS service (assuming google_cloud_voice.synthesize_text is async
-                # and returns audio bytes AND mime type).
-                print("handle_user_text: Calling google_cloud_voice.synthesize_text()...")
-                audio_bytes, audio_mime_type = await google_cloud_voice.synthesize_text(chatbot_text_response)
-
-                if audio_bytes:
-                    print(f"handle_user_text: Received {len(audio_bytes)} bytes of synthesized audio with MIME type {audio_mime_type}.")
-
-                    # --- Chunk and Send Audio as Base64 via WebSocket ---
-                    # Send as one chunk matching the original example is simplest here.
-                    # If you need smaller chunks, implement the loop from your old consumer.
-
-                    encoded_audio = base64.b64encode(audio_bytes).decode('utf-8')
-
-                    message = {
-                         'event': 'tts_chunk', # Match frontend expectation for audio playback
-                         'session_id': session_id, # Use the session ID from the incoming message
-                         'payload': encoded_audio, # Base64 encoded audio
-                         'mime': audio_mime_type # Audio MIME type from your TTS service
-                     }
-                    # Send the audio chunk
-                    print(f"handle_user_text: Sending audio chunk ({len(encoded_audio)} base64 bytes).")
-                    await self.send(text_data=json.dumps(message))
-                    print("handle_user_text: Finished sending audio chunk.")
-
-                    # Frontend's audio playback 'onended' handles the transition back to 'ready'.
-                    # No final status needed from backend unless TTS failed.
+                if pipeline:
+                    # Sentences were already being synthesized while the reply streamed in
+                    chunks_sent = await pipeline.finish()
+                else:
+                    print("handle_user_text: Calling google_cloud_voice.synthesize_text()...")
+                    audio_bytes, audio_mime_type = await google_cloud_voice.synthesize_text(chatbot_text_response)
+                    chunks_sent = 0
+                    if audio_bytes:
+                        print(f"handle_user_text: Received {len(audio_bytes)} bytes of synthesized audio with MIME type {audio_mime_type}.")
+                        await self.send_tts_chunk(session_id, 0, audio_bytes, audio_mime_type)
+                        chunks_sent = 1
+
+                if chunks_sent:
+                    # Tells the frontend no more chunks follow for this session.
+                    # Its audio playback 'onended' handles the transition back to 'ready'.
+                    await self.send(text_data=json.dumps({
+                        'event': 'tts_end',
+                        'session_id': session_id,
+                        'chunks': chunks_sent,
+                    }))
+                    print(f"handle_user_text: Finished sending {chunks_sent} audio chunk(s).")
 
                 else:
                     print("handle_user_text: TTS returned no audio bytes.")
@@ -239,6 +294,8 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
                     print("handle_user_text: Sent 'ready' status after TTS failure.")
 
             else:
+                 if pipeline:
+                     pipeline.cancel()
                  print("handle_user_text: Chatbot returned empty text response.")
                  await self.send(text_data=json.dumps({
                       'type': 'status',
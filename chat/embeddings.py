@@ -0,0 +1,176 @@
+# chat/embeddings.py
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from langchain_core.embeddings import Embeddings
+
+print("--- Loading chat/embeddings.py ---")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an Embeddings model (e.g. OpenAIEmbeddings).
+    Vectors are keyed by sha256(model + text) and looked up in an in-memory LRU,
+    then an optional SQLite file shared by every worker on the host. Only misses
+    reach the wrapped model, in batches of at most batch_size texts. The async
+    methods check the LRU inline and run the SQLite tier in an executor.
+    The same instance backs the product index build and query embedding.
+    """
+
+    def __init__(self, underlying, memory_size=10000, db_path=None, batch_size=256):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", "") or ""
+        self.memory_size = memory_size
+        self.batch_size = max(1, batch_size)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()  # In-memory LRU only; never held across disk I/O
+        self._db_lock = threading.Lock()
+        self._db = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if db_path:
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    # --- Cache tiers ---
+
+    def _remember(self, key, vector):
+        # Caller holds self._lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _from_memory(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats["memory_hits"] += len(found)
+        return found
+
+    def _from_disk(self, keys):
+        # Blocking SQLite I/O: async callers run this in an executor
+        found = {}
+        with self._db_lock:
+            for start in range(0, len(keys), 500):  # Stay under SQLite's bound-variable limit
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        with self._lock:
+            for key, vector in found.items():
+                self._remember(key, vector)
+            self.stats["disk_hits"] += len(found)
+        return found
+
+    def _lookup(self, keys):
+        """Return {key: vector} for every key found in memory or on disk."""
+        found = self._from_memory(keys)
+        missing = [key for key in keys if key not in found]
+        if self._db is not None and missing:
+            found.update(self._from_disk(missing))
+        return found
+
+    async def _alookup(self, keys):
+        """_lookup() that only checks the in-memory LRU on the event loop."""
+        found = self._from_memory(keys)
+        missing = [key for key in keys if key not in found]
+        if self._db is not None and missing:
+            found.update(await sync_to_async(self._from_disk, thread_sensitive=False)(missing))
+        return found
+
+    def _remember_computed(self, items):
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            self.stats["misses"] += len(items)
+
+    def _to_disk(self, items):
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+            self._db.commit()
+
+    def _store(self, items):
+        self._remember_computed(items)
+        if self._db is not None and items:
+            self._to_disk(items)
+
+    async def _astore(self, items):
+        self._remember_computed(items)
+        if self._db is not None and items:
+            await sync_to_async(self._to_disk, thread_sensitive=False)(items)
+
+    def _pending(self, keys, texts, found):
+        pending = OrderedDict()  # key -> text, de-duplicated
+        for key, text in zip(keys, texts):
+            if key not in found:
+                pending.setdefault(key, text)
+        return pending
+
+    def _misses(self, texts):
+        keys = [self.key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        return keys, found, self._pending(keys, texts, found)
+
+    async def _amisses(self, texts):
+        keys = [self.key(text) for text in texts]
+        found = await self._alookup(list(dict.fromkeys(keys)))
+        return keys, found, self._pending(keys, texts, found)
+
+    # --- Embeddings interface ---
+
+    def embed_documents(self, texts):
+        keys, found, pending = self._misses(texts)
+        pending_items = list(pending.items())
+        for start in range(0, len(pending_items), self.batch_size):
+            batch = pending_items[start:start + self.batch_size]
+            vectors = self.underlying.embed_documents([text for _, text in batch])
+            computed = [(key, list(vector)) for (key, _), vector in zip(batch, vectors)]
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        keys, found, pending = self._misses([text])
+        if pending:
+            vector = list(self.underlying.embed_query(text))
+            self._store([(keys[0], vector)])
+            return vector
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts):
+        keys, found, pending = await self._amisses(texts)
+        pending_items = list(pending.items())
+        for start in range(0, len(pending_items), self.batch_size):
+            batch = pending_items[start:start + self.batch_size]
+            vectors = await self.underlying.aembed_documents([text for _, text in batch])
+            computed = [(key, list(vector)) for (key, _), vector in zip(batch, vectors)]
+            await self._astore(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text):
+        keys, found, pending = await self._amisses([text])
+        if pending:
+            vector = list(await self.underlying.aembed_query(text))
+            await self._astore([(keys[0], vector)])
+            return vector
+        return found[keys[0]]
@@ -0,0 +1,181 @@
+# chat/history.py
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .history_writer import history_writer
+from .openai_clients import get_openai_client
+from .models import ChatHistory, ConversationSummary
+
+print("--- Loading chat/history.py ---")
+
+_encoding = None
+_folding_users = set()
+_folding_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Token count with tiktoken; falls back to a ~4 chars/token estimate if the encoding can't load."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.encoding_for_model("gpt-4-turbo")
+        except Exception as e:
+            print(f"history: tiktoken unavailable, estimating token counts: {e}")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+
+def _format_turn(role, content):
+    return f"{role.capitalize()}: {content}"
+
+
+def _recent_turns_query(user, summarized_until):
+    return (
+        ChatHistory.objects
+        .filter(user=user, role__in=("user", "assistant"), id__gt=summarized_until)
+        .order_by('-timestamp', '-id')
+        .values_list('id', 'role', 'content')[:settings.CHAT_HISTORY_MAX_ROWS]
+    )
+
+
+def _select_window(rows, budget):
+    """
+    rows are newest-first (id, role, content); rows still waiting in the
+    history writer have id None. Returns (turns, overflow_ids):
+    the newest turns that fit the token budget in chronological order, and the
+    ids of newer-than-summary turns that didn't fit.
+    """
+    turns = []
+    used = 0
+    for index, (row_id, role, content) in enumerate(rows):
+        line = _format_turn(role, content)
+        cost = count_tokens(line) + 1
+        if turns and used + cost > budget:
+            return list(reversed(turns)), [overflow_id for overflow_id, _, _ in rows[index:] if overflow_id is not None]
+        turns.append(line)
+        used += cost
+    return list(reversed(turns)), []
+
+
+def _render(summary_text, turns):
+    parts = []
+    if summary_text:
+        parts.append(f"Summary of earlier conversation:\n{summary_text}")
+    if turns:
+        parts.append("\n".join(turns))
+    return "\n\n".join(parts)
+
+
+def _window(user, summary, pending_rows, rows):
+    # Turns enqueued but not yet committed by the history writer are the newest ones.
+    # pending_rows was snapshotted before rows were read, so a turn flushed in between is
+    # in at least one of the two; one the query already returned is skipped by pk.
+    stored_ids = {row_id for row_id, _, _ in rows}
+    pending = [(None, row.role, row.content) for row in reversed(pending_rows)
+               if row.role in ("user", "assistant") and (row.pk is None or row.pk not in stored_ids)]
+    turns, overflow_ids = _select_window(pending + rows, settings.CHAT_HISTORY_TOKEN_BUDGET)
+    # Fold once enough turns fell out of the window for a batch, not on every turn
+    # (rows capped at CHAT_HISTORY_MAX_ROWS means the backlog is at least that big)
+    if len(overflow_ids) >= settings.CHAT_HISTORY_FOLD_THRESHOLD or len(rows) == settings.CHAT_HISTORY_MAX_ROWS:
+        # Oldest kept stored turn; None when every stored turn fell out of the window
+        kept_ids = [row_id for row_id, _, _ in (pending + rows)[:len(turns)] if row_id is not None]
+        schedule_fold(user.id, kept_ids[-1] if kept_ids else None)
+    return _render(summary.summary if summary else "", turns)
+
+
+def build_history_window(user):
+    """
+    Conversation history for the prompt: the most recent turns verbatim up to
+    CHAT_HISTORY_TOKEN_BUDGET tokens, preceded by the user's rolling summary of
+    older turns. Turns that fall out of the window are folded into the summary
+    in the background, so per-turn cost stays flat however long the user has chatted.
+    """
+    summary = ConversationSummary.objects.filter(user=user).first()
+    summarized_until = summary.summarized_until if summary else 0
+    pending_rows = history_writer.pending_for(user.id)  # Before the query, see _window()
+    rows = list(_recent_turns_query(user, summarized_until))
+    return _window(user, summary, pending_rows, rows)
+
+
+async def abuild_history_window(user):
+    """Async variant of build_history_window() using the async ORM."""
+    summary = await ConversationSummary.objects.filter(user=user).afirst()
+    summarized_until = summary.summarized_until if summary else 0
+    pending_rows = history_writer.pending_for(user.id)
+    rows = [row async for row in _recent_turns_query(user, summarized_until)]
+    return _window(user, summary, pending_rows, rows)
+
+
+def schedule_fold(user_id, before_id):
+    """Fold turns older than before_id into the user's summary on a background thread (one per user)."""
+    with _folding_lock:
+        if user_id in _folding_users:
+            return
+        _folding_users.add(user_id)
+
+    def run():
+        try:
+            fold_older_turns(user_id, before_id)
+        except Exception as e:
+            print(f"history: Error folding turns for user {user_id}: {e}")
+        finally:
+            with _folding_lock:
+                _folding_users.discard(user_id)
+
+    threading.Thread(target=run, name=f"history-fold-{user_id}", daemon=True).start()
+
+
+def fold_older_turns(user_id, before_id):
+    """
+    Summarize unsummarized turns older than before_id into ConversationSummary,
+    oldest first, CHAT_HISTORY_FOLD_BATCH turns per LLM call, so every turn
+    reaches the summary in order however long the backlog is.
+    """
+    summary, _ = ConversationSummary.objects.get_or_create(user_id=user_id)
+    while True:
+        rows = ChatHistory.objects.filter(user_id=user_id, role__in=("user", "assistant"), id__gt=summary.summarized_until)
+        if before_id is not None:
+            rows = rows.filter(id__lt=before_id)
+        rows = list(rows.order_by('id').values_list('id', 'role', 'content')[:settings.CHAT_HISTORY_FOLD_BATCH])
+        if not rows:
+            return
+        new_summary = _summarize(summary.summary, rows)
+
+        # Only advance if nobody else folded meanwhile (e.g. another worker process)
+        updated = ConversationSummary.objects.filter(pk=summary.pk, summarized_until=summary.summarized_until).update(
+            summary=new_summary, summarized_until=rows[-1][0], updated_at=timezone.now()
+        )
+        print(f"history: Folded {len(rows)} turns for user {user_id} into summary (updated={bool(updated)}).")
+        if not updated:
+            return
+        summary.summary, summary.summarized_until = new_summary, rows[-1][0]
+
+
+def _summarize(current_summary, rows):
+    transcript = "\n".join(_format_turn(role, content) for _, role, content in rows)
+
+    prompt_content = f"""You maintain a running summary of a conversation between a shopping assistant and a customer. Update the summary with the new conversation lines. Keep the customer's name, preferences, budget, products discussed and any open questions. Be concise.
+
+Current Summary:
+{current_summary or "(none)"}
+
+New Conversation Lines:
+{transcript}
+
+Updated Summary:"""
+
+    client = get_openai_client()
+    response = client.chat.completions.create(
+        model=settings.CHAT_HISTORY_SUMMARY_MODEL,
+        messages=[{"role": "user", "content": prompt_content}],
+        max_tokens=settings.CHAT_HISTORY_SUMMARY_MAX_TOKENS,
+        n=1,
+        temperature=0.2,
+    )
+    return response.choices[0].message.content.strip()
@@ -0,0 +1,167 @@
+# chat/history_writer.py
+import atexit
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections
+
+from .models import ChatHistory
+
+print("--- Loading chat/history_writer.py ---")
+
+
+class HistoryWriter:
+    """
+    Write-behind buffer for ChatHistory turns.
+    Request handlers enqueue rows and return immediately; a background thread
+    inserts them with bulk_create once batch_size rows are waiting or every
+    flush_interval seconds. Rows are written in enqueue order by a single
+    flusher at a time, so each user's turns keep their relative order (by id;
+    auto_now_add stamps timestamp at insert time).
+    If a batch insert fails, its rows are retried one by one. A row rejected by
+    the database itself (integrity/data errors, e.g. its user was deleted) is
+    retried on up to max_attempts flushes, then dropped into dead_letters so it
+    can't block the rows behind it. Connection-level errors put the rest of the
+    batch back at the front of the buffer. The buffer holds at most max_buffer
+    rows; beyond that the oldest are dropped.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=0.5, max_attempts=3, max_buffer=10000):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self.dead_letters = deque(maxlen=100)  # (row, error) of the last rows given up on
+        self._attempts = {}  # id(row) -> failed inserts so far
+        self._buffer = deque()
+        self._inflight = []  # Batch being inserted; still reported by pending_for() until committed
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One flusher at a time keeps inserts in FIFO order
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self.stats = {"enqueued": 0, "written": 0, "flushes": 0, "errors": 0, "dropped": 0}
+
+    def _ensure_thread(self):
+        # Caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"history_writer: Error in flusher thread: {e}")
+            finally:
+                close_old_connections()
+
+    def add_flush_listener(self, listener):
+        """Call listener(rows) with every batch once it is committed (rows have their pks)."""
+        self._listeners.append(listener)
+
+    def enqueue(self, user, role, content, thread_id=None):
+        """Queue one ChatHistory row for insertion."""
+        row = ChatHistory(user_id=user.id, role=role, content=content, thread_id=thread_id)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._drop(self._buffer.popleft(), "history buffer full")
+            self._buffer.append(row)
+            self.stats["enqueued"] += 1
+            self._ensure_thread()
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def pending_for(self, user_id):
+        """
+        ChatHistory rows for user_id not yet known to be committed, oldest first.
+        The instances themselves, so a caller can check .pk later: it is set once
+        the row has been inserted.
+        """
+        with self._lock:
+            return [row for row in (*self._inflight, *self._buffer) if row.user_id == user_id]
+
+    def _drop(self, row, error):
+        # Caller holds self._lock
+        self._attempts.pop(id(row), None)
+        self.dead_letters.append((row, str(error)))
+        self.stats["dropped"] += 1
+        print(f"history_writer: Dropped {row.role} row for user {row.user_id}: {error}")
+
+    def flush(self):
+        """Insert everything buffered so far. Returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                    self._inflight = batch
+                if not batch:
+                    return written
+                started = time.perf_counter()
+                try:
+                    ChatHistory.objects.bulk_create(batch)
+                    committed, stalled = batch, False
+                except Exception as e:
+                    print(f"history_writer: Batch of {len(batch)} rows failed, retrying row by row: {e}")
+                    committed, stalled = self._write_rows(batch)
+                written += len(committed)
+                with self._lock:
+                    self._inflight = []
+                    self.stats["written"] += len(committed)
+                    self.stats["flushes"] += 1
+                print(f"history_writer: Wrote {len(committed)} rows in {(time.perf_counter() - started) * 1000:.0f} ms")
+                if committed:
+                    for listener in self._listeners:
+                        try:
+                            listener(committed)
+                        except Exception as e:
+                            print(f"history_writer: Error in flush listener: {e}")
+                if stalled:
+                    return written
+
+    def _write_rows(self, batch):
+        """Insert rows one at a time. Returns (committed rows, stalled); stalled means the DB itself is failing."""
+        committed, retry = [], []
+        for index, row in enumerate(batch):
+            try:
+                ChatHistory.objects.bulk_create([row])
+                committed.append(row)
+                self._attempts.pop(id(row), None)
+            except (IntegrityError, DataError) as e:
+                # This row is the problem: retry it on later flushes, up to max_attempts
+                with self._lock:
+                    attempts = self._attempts[id(row)] = self._attempts.get(id(row), 0) + 1
+                    self.stats["errors"] += 1
+                    if attempts >= self.max_attempts:
+                        self._drop(row, e)
+                    else:
+                        retry.append(row)
+            except Exception as e:
+                # Connection-level failure: keep everything left for the next flush
+                with self._lock:
+                    self.stats["errors"] += 1
+                    self._buffer.extendleft(reversed(retry + batch[index:]))
+                print(f"history_writer: Error writing rows, will retry: {e}")
+                return committed, True
+        with self._lock:
+            self._buffer.extendleft(reversed(retry))
+        return committed, bool(retry)
+
+    async def aflush(self):
+        return await sync_to_async(self.flush, thread_sensitive=False)()
+
+
+history_writer = HistoryWriter(
+    batch_size=settings.CHAT_HISTORY_WRITE_BATCH_SIZE,
+    flush_interval=settings.CHAT_HISTORY_WRITE_INTERVAL,
+    max_attempts=settings.CHAT_HISTORY_WRITE_MAX_ATTEMPTS,
+    max_buffer=settings.CHAT_HISTORY_WRITE_MAX_BUFFER,
+)
+atexit.register(history_writer.flush)
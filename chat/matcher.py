@@ -0,0 +1,129 @@
+# chat/matcher.py
+from bisect import bisect_right
+from collections import deque
+
+from .catalog import normalize_name
+
+
+class ProductNameMatcher:
+    """
+    Aho-Corasick automaton over case-folded catalog product names.
+    Built once per CatalogSnapshot (see CatalogSnapshot.matcher) and used to find
+    product names in free-form assistant text in a single pass, instead of
+    comparing every suggested line against the whole catalog.
+    Matches must sit on word boundaries, so markdown bold ("**Name**"), list
+    markers ("- ", "1. ") and trailing " - description" fragments are tolerated.
+    """
+
+    def __init__(self, entries):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for entry in entries:
+            pattern = normalize_name(entry.name)
+            if pattern:
+                self._add(pattern, entry)
+        self._build_failure_links()
+
+    def _add(self, pattern, entry):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        if not self._out[state]:  # Keep the first product for duplicate names
+            self._out[state] = ((len(pattern), entry),)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def _scan(self, text):
+        """Yield (start, end, entry) for every boundary-aligned hit, in original text offsets."""
+        state = 0
+        fed_positions = []  # original index of every character fed to the automaton
+        previous_space = True
+        for index, raw in enumerate(text):
+            if raw.isspace() or raw == "\xa0":
+                if previous_space:
+                    continue
+                previous_space = True
+                chars = " "
+            else:
+                previous_space = False
+                chars = raw.casefold()
+            for ch in chars:
+                fed_positions.append(index)
+                while state and ch not in self._goto[state]:
+                    state = self._fail[state]
+                state = self._goto[state].get(ch, 0)
+                for length, entry in self._out[state]:
+                    start = fed_positions[len(fed_positions) - length]
+                    if _is_boundary(text, start - 1) and _is_boundary(text, index + 1):
+                        yield start, index + 1, entry
+
+    def find_all(self, text):
+        """
+        Return non-overlapping (start, end, entry) matches, leftmost-longest first,
+        in order of appearance.
+        """
+        if not text:
+            return []
+        hits = sorted(self._scan(text), key=lambda hit: (hit[0], hit[0] - hit[1]))
+        matches = []
+        last_end = -1
+        for start, end, entry in hits:
+            if start >= last_end:
+                matches.append((start, end, entry))
+                last_end = end
+        return matches
+
+    def match_lines(self, text):
+        """Return the first product mentioned on each line of text, in order, without duplicates."""
+        line_starts = [0] + [i + 1 for i, ch in enumerate(text or "") if ch == "\n"]
+        seen_lines = set()
+        seen_ids = set()
+        entries = []
+        for start, _end, entry in self.find_all(text):
+            line = bisect_right(line_starts, start)
+            if line in seen_lines or entry.id in seen_ids:
+                continue
+            seen_lines.add(line)
+            seen_ids.add(entry.id)
+            entries.append(entry)
+        return entries
+
+    def suggested_products(self, text, exclude=(), limit=3):
+        """
+        Parse an assistant "Suggested Products" section into
+        [{"name": ..., "category": ...}] using catalog names, skipping any in exclude.
+        """
+        excluded = {normalize_name(name) for name in exclude or ()}
+        suggested = []
+        for entry in self.match_lines(text):
+            if normalize_name(entry.name) in excluded:
+                continue
+            suggested.append({"name": entry.name, "category": entry.category})
+            if len(suggested) >= limit:
+                break
+        return suggested
+
+
+def _is_boundary(text, index):
+    if index < 0 or index >= len(text):
+        return True
+    return not text[index].isalnum()
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_conversationsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='chathistory_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user', 'role', 'timestamp'], name='chathistory_user_role_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(condition=models.Q(('thread_id__isnull', False)), fields=['user', 'timestamp'], name='chathistory_user_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_threads(apps, schema_editor):
+    """One AssistantThread per user from the latest thread_id recorded in ChatHistory."""
+    ChatHistory = apps.get_model('chat', 'ChatHistory')
+    AssistantThread = apps.get_model('chat', 'AssistantThread')
+    seen_users, seen_threads, rows = set(), set(), []
+    for user_id, thread_id in (ChatHistory.objects.filter(thread_id__isnull=False).exclude(thread_id='')
+                               .order_by('user_id', '-timestamp').values_list('user_id', 'thread_id')):
+        if user_id in seen_users or thread_id in seen_threads:
+            continue
+        seen_users.add(user_id)
+        seen_threads.add(thread_id)
+        rows.append(AssistantThread(user_id=user_id, thread_id=thread_id))
+    AssistantThread.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chathistory_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssistantThread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='assistant_thread', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+    ]
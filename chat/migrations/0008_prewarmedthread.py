@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_assistantthread'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrewarmedThread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=255, unique=True)),
+                ('context_version', models.CharField(db_index=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_prewarmedthread'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chathistory',
+            name='chathistory_user_thread_idx',
+        ),
+    ]
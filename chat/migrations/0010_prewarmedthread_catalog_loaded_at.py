@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_drop_chathistory_thread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prewarmedthread',
+            name='catalog_loaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
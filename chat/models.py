@@ -24,6 +24,48 @@ class ChatHistory(models.Model):
     ])
     content = models.TextField()
     thread_id = models.CharField(max_length=255, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # History window / keyset pagination: filter by user, order by (timestamp, id)
+            models.Index(fields=['user', 'timestamp', 'id'], name='chathistory_user_ts_idx'),
+            # Last-N messages of one role (SuggestionView)
+            models.Index(fields=['user', 'role', 'timestamp'], name='chathistory_user_role_ts_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.timestamp} - {self.role}"
\ No newline at end of file
+        return f"{self.user.username} - {self.timestamp} - {self.role}"
+
+
+class ConversationSummary(models.Model):
+    """Rolling summary of a user's older chat turns that no longer fit the prompt's history window."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='conversation_summary')
+    summary = models.TextField(blank=True, default='')
+    # Id of the newest ChatHistory row folded into the summary
+    summarized_until = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - summary until {self.summarized_until}"
+
+
+class AssistantThread(models.Model):
+    """The OpenAI Assistants thread a user's conversation runs in (at most one per user)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='assistant_thread')
+    thread_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.thread_id}"
+
+
+class PrewarmedThread(models.Model):
+    """An unclaimed Assistants thread already primed with the initial context identified by context_version."""
+    thread_id = models.CharField(max_length=255, unique=True)
+    context_version = models.CharField(max_length=64, db_index=True)
+    # When the catalog this context was built from was read; only older catalogs are retired
+    catalog_loaded_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.thread_id} ({self.context_version})"
@@ -0,0 +1,97 @@
+# chat/openai_clients.py
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+print("--- Loading chat/openai_clients.py ---")
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+
+
+def _http2_available():
+    if not settings.CHAT_OPENAI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx needs the "h2" package for HTTP/2)
+    except ImportError:
+        return False
+    return True
+
+
+def _http_options():
+    return {
+        "limits": httpx.Limits(
+            max_connections=settings.CHAT_OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.CHAT_OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=settings.CHAT_OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(settings.CHAT_OPENAI_TIMEOUT, connect=settings.CHAT_OPENAI_CONNECT_TIMEOUT),
+        "http2": _http2_available(),
+    }
+
+
+def _reset_after_fork():
+    # Pooled sockets and TLS sessions must not be shared with the parent process
+    global _client, _pid, _lock
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _client = None
+    _async_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _check_pid():
+    if os.getpid() != _pid:  # Forked on a platform without os.register_at_fork
+        _reset_after_fork()
+
+
+def get_openai_client():
+    """Process-wide OpenAI client sharing one keep-alive connection pool across requests and threads."""
+    global _client
+    _check_pid()
+    if _client is None:
+        with _lock:
+            if _client is None:
+                options = _http_options()
+                _client = OpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    max_retries=settings.CHAT_OPENAI_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(**options),
+                )
+                print(f"openai_clients: Created sync OpenAI client (http2={options['http2']}).")
+    return _client
+
+
+def get_async_openai_client():
+    """
+    AsyncOpenAI client for the running event loop. An httpx async pool can't be
+    used across event loops, so there is one per loop (normally exactly one per
+    process under ASGI); it is dropped together with its loop.
+    """
+    _check_pid()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                options = _http_options()
+                client = AsyncOpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    max_retries=settings.CHAT_OPENAI_MAX_RETRIES,
+                    http_client=DefaultAsyncHttpxClient(**options),
+                )
+                _async_clients[loop] = client
+                print(f"openai_clients: Created AsyncOpenAI client (http2={options['http2']}).")
+    return client
@@ -0,0 +1,217 @@
+# chat/response_cache.py
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+
+print("--- Loading chat/response_cache.py ---")
+
+CacheHit = namedtuple("CacheHit", ["tier", "context", "response"])
+
+_Entry = namedtuple("_Entry", ["catalog_version", "mode", "context", "response", "response_user", "vector", "expires_at"])
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_query(text):
+    """Case-folded, punctuation-free, whitespace-collapsed form used for the exact tier."""
+    return " ".join(_PUNCTUATION_RE.sub(" ", str(text).casefold()).split())
+
+
+class _VectorTable:
+    """
+    Stacked unit vectors of the semantic tier, grown in place: add() writes one
+    row (doubling the capacity when full) and remove() leaves a zeroed
+    tombstone, so inserts don't restack the whole matrix. Tombstones are
+    compacted away once they make up half of the rows.
+    """
+
+    def __init__(self):
+        self.matrix = None
+        self.keys = []  # Row -> cache key (None for tombstones)
+        self.rows = {}  # Cache key -> row
+        self.count = 0
+
+    def add(self, key, vector):
+        row = self.rows.get(key)
+        if row is None:
+            if self.matrix is None:
+                self.matrix = np.zeros((16, vector.shape[0]), dtype=np.float32)
+            elif self.count == len(self.matrix):
+                self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+            row = self.count
+            self.count += 1
+            self.keys.append(key)
+            self.rows[key] = row
+        self.matrix[row] = vector
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.matrix[row] = 0.0
+        self.keys[row] = None
+        if len(self.rows) * 2 < self.count:
+            self._compact()
+
+    def _compact(self):
+        live = [row for row, key in enumerate(self.keys) if key is not None]
+        self.matrix = np.array(self.matrix[live]) if live else None
+        self.keys = [self.keys[row] for row in live]
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.count = len(self.keys)
+
+    def similarities(self, query):
+        """(row keys, cosine similarity per row); tombstones score 0."""
+        if not self.count:
+            return self.keys, np.zeros(0, dtype=np.float32)
+        return self.keys, self.matrix[:self.count] @ query
+
+
+class ResponseCache:
+    """
+    Two-tier cache for chat turns.
+    Exact tier: normalized query text + catalog version + retrieval mode ->
+    retrieval context. Semantic tier: query embeddings compared by cosine
+    similarity (same catalog version and mode, above a threshold) -> retrieval
+    context of a near-duplicate query. The mode is part of every key, so
+    context summarized in "qa" mode is never served to a "context" endpoint.
+    Final responses are only stored for history-independent turns (the user
+    has no earlier conversation), since otherwise the answer depends on more
+    than the query, and only served back to the same user: a first message can
+    carry personal details ("I'm Alice, ...") that a near-duplicate query from
+    someone else must not receive. Retrieval context is shared. Entries expire after a TTL and the least recently
+    used are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries=2000, ttl=600, similarity_threshold=0.92):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._vectors = _VectorTable()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "response_hits": 0, "misses": 0}
+
+    # --- Internals ---
+
+    def _embeddings(self):
+        chat_config = apps.get_app_config('chat')
+        chat_config.get_retriever()  # Ensures embeddings are built
+        return chat_config.embeddings
+
+    def _hit(self, tier, entry, user_id):
+        # Caller holds self._lock
+        response = entry.response if user_id is not None and entry.response_user == user_id else None
+        self.counters[f"{tier}_hits"] += 1
+        if response:
+            self.counters["response_hits"] += 1
+        return CacheHit(tier, entry.context, response)
+
+    def _miss(self):
+        with self._lock:
+            self.counters["misses"] += 1
+
+    def _lookup_exact(self, key, user_id):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                del self._entries[key]
+                self._vectors.remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return self._hit("exact", entry, user_id)
+
+    def _lookup_semantic(self, vector, catalog_version, mode, user_id):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        query /= norm
+        with self._lock:
+            keys, similarities = self._vectors.similarities(query)
+            now = time.monotonic()
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity_threshold:
+                    break
+                entry = self._entries.get(keys[index])
+                if (entry is None or entry.expires_at < now
+                        or entry.catalog_version != catalog_version or entry.mode != mode):
+                    continue
+                self._entries.move_to_end(keys[index])
+                return self._hit("semantic", entry, user_id)
+        return None
+
+    # --- Public API ---
+
+    def lookup(self, query, catalog_version, mode, user_id=None):
+        """
+        Return a CacheHit for query in retrieval mode (exact tier first, then semantic) or None.
+        Pass user_id for history-independent turns to also get that user's cached final response.
+        """
+        key = (normalize_query(query), catalog_version, mode)
+        hit = self._lookup_exact(key, user_id)
+        if hit is None:
+            hit = self._lookup_semantic(self._embeddings().embed_query(query), catalog_version, mode, user_id)
+        if hit is None:
+            self._miss()
+        return hit
+
+    async def alookup(self, query, catalog_version, mode, user_id=None):
+        key = (normalize_query(query), catalog_version, mode)
+        hit = self._lookup_exact(key, user_id)
+        if hit is None:
+            await apps.get_app_config('chat').aget_retriever()  # Ensures embeddings are built
+            vector = await apps.get_app_config('chat').embeddings.aembed_query(query)
+            hit = self._lookup_semantic(vector, catalog_version, mode, user_id)
+        if hit is None:
+            self._miss()
+        return hit
+
+    def _store(self, query, catalog_version, mode, context, response, user_id, vector):
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else None
+        key = (normalize_query(query), catalog_version, mode)
+        entry = _Entry(catalog_version, mode, context, response, user_id if response else None,
+                       vector, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if vector is not None:
+                self._vectors.add(key, vector)
+            else:
+                self._vectors.remove(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._vectors.remove(evicted)
+
+    def store(self, query, catalog_version, mode, context, response=None, user_id=None):
+        """Cache the retrieval context and, for a history-independent turn, user_id's final response."""
+        self._store(query, catalog_version, mode, context, response, user_id, self._embeddings().embed_query(query))
+
+    async def astore(self, query, catalog_version, mode, context, response=None, user_id=None):
+        vector = await apps.get_app_config('chat').embeddings.aembed_query(query)
+        self._store(query, catalog_version, mode, context, response, user_id, vector)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            entries = len(self._entries)
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        hits = lookups - counters["misses"]
+        return dict(counters, entries=entries, hit_rate=round(hits / lookups, 3) if lookups else 0.0)
+
+
+response_cache = ResponseCache(
+    max_entries=settings.CHAT_RESPONSE_CACHE_SIZE,
+    ttl=settings.CHAT_RESPONSE_CACHE_TTL,
+    similarity_threshold=settings.CHAT_RESPONSE_CACHE_THRESHOLD,
+)
@@ -0,0 +1,82 @@
+# chat/retrieval.py
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from langchain.chains import RetrievalQA
+from langchain.prompts import PromptTemplate
+
+print("--- Loading chat/retrieval.py ---")
+
+QA_PROMPT = PromptTemplate(
+    template="""Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+Context:
+{context}
+
+Question: {question}""",
+    input_variables=["context", "question"],
+)
+
+_qa_chain = None
+_qa_chain_key = None
+_qa_chain_lock = threading.Lock()
+
+
+def retrieval_mode(endpoint=None):
+    """
+    How product information is gathered for an endpoint:
+      "context" - retrieved product documents are pasted into the main prompt (one LLM call per turn)
+      "qa"      - a RetrievalQA "stuff" chain summarizes them first (an extra LLM call per turn)
+    """
+    return settings.CHAT_RETRIEVAL_MODES.get(endpoint, settings.CHAT_RETRIEVAL_MODE)
+
+
+def format_product_context(documents):
+    return "\n\n".join(document.page_content for document in documents)
+
+
+def get_qa_chain(llm, retriever):
+    """RetrievalQA chain built once and reused until the LLM or retriever changes."""
+    global _qa_chain, _qa_chain_key
+    key = (id(llm), id(retriever))
+    with _qa_chain_lock:
+        if _qa_chain is None or _qa_chain_key != key:
+            _qa_chain = RetrievalQA.from_chain_type(
+                llm=llm,
+                chain_type="stuff",
+                retriever=retriever,
+                return_source_documents=False,
+                chain_type_kwargs={"prompt": QA_PROMPT},
+            )
+            _qa_chain_key = key
+        return _qa_chain
+
+
+def retrieve_relevant_info(query, endpoint=None, mode=None):
+    """Product information for query, gathered according to the endpoint's retrieval mode."""
+    mode = mode or retrieval_mode(endpoint)
+    chat_config = apps.get_app_config('chat')
+    started = time.perf_counter()
+    if mode == "context":
+        result = format_product_context(chat_config.get_retriever().invoke(query))
+    else:
+        result = get_qa_chain(chat_config.get_llm(), chat_config.get_retriever()).invoke({"query": query})["result"]
+    print(f"retrieval: endpoint={endpoint} mode={mode} took {(time.perf_counter() - started) * 1000:.0f} ms")
+    return result
+
+
+async def aretrieve_relevant_info(query, endpoint=None, mode=None):
+    """Async variant of retrieve_relevant_info()."""
+    mode = mode or retrieval_mode(endpoint)
+    chat_config = apps.get_app_config('chat')
+    retriever = await chat_config.aget_retriever()
+    started = time.perf_counter()
+    if mode == "context":
+        result = format_product_context(await retriever.ainvoke(query))
+    else:
+        chain = get_qa_chain(await chat_config.aget_llm(), retriever)
+        result = (await chain.ainvoke({"query": query}))["result"]
+    print(f"retrieval: endpoint={endpoint} mode={mode} took {(time.perf_counter() - started) * 1000:.0f} ms")
+    return result
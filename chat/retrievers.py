@@ -0,0 +1,410 @@
+# chat/retrievers.py
+import math
+import re
+import threading
+from collections import defaultdict, namedtuple
+from typing import Any
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+from .catalog import CatalogEntry
+from .matcher import ProductNameMatcher
+from .vector_index import product_document
+
+print("--- Loading chat/retrievers.py ---")
+
+# Immutable arrays swapped in as a whole, so searches never see a half-updated index
+_IndexArrays = namedtuple("_IndexArrays", ["matrix", "ids", "categories", "documents", "metadatas"])
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _product_metadata(product):
+    metadata = {"product_id": product.pk, "name": product.name, "category": product.category}
+    if product.price is not None:
+        metadata["price"] = float(product.price)
+    return metadata
+
+
+def _category_filter(filter):
+    """Accept Chroma-style {"category": "Shoes"} or {"category": {"$in": [...]}} filters."""
+    if not filter or "category" not in filter:
+        return None
+    category = filter["category"]
+    if isinstance(category, dict):
+        return list(category.get("$in", []))
+    return [category]
+
+
+def _price_filter(filter):
+    """Accept Chroma-style {"price": {"$gte": 10, "$lte": 50}} filters; returns (min_price, max_price)."""
+    price = (filter or {}).get("price")
+    if not isinstance(price, dict):
+        return None, None
+    min_price = price.get("$gte", price.get("$gt"))
+    max_price = price.get("$lte", price.get("$lt"))
+    return min_price, max_price
+
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[-_/.][0-9a-z]+)*")
+_SKU_TOKEN_RE = re.compile(r"(?=.*[0-9])(?=.*[a-z])")
+
+
+def tokenize(text):
+    """Lower-cased word tokens; SKU-like tokens ("ab-200") are kept whole and also split into parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).casefold()):
+        tokens.append(token)
+        parts = re.split(r"[-_/.]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class NumpyProductIndex:
+    """
+    Exact in-memory product index: one contiguous float32 matrix of L2-normalized
+    product embeddings with parallel id/category arrays. Search is a single
+    matrix-vector product plus argpartition top-k, optionally restricted by a
+    category mask. Same sync/upsert/delete/as_retriever interface as
+    ChromaProductIndex; vectors come from the (cached) embeddings, so rebuilding
+    on boot does not hit the embedding API for unchanged products.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        self._arrays = _IndexArrays(np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64),
+                                    np.zeros(0, dtype=object), [], [])
+
+    def __len__(self):
+        return len(self._arrays.ids)
+
+    @property
+    def arrays(self):
+        return self._arrays
+
+    def vector_arrays(self):
+        """(L2-normalized matrix, product ids, categories); same shape as ChromaProductIndex.vector_arrays()."""
+        arrays = self._arrays
+        return arrays.matrix, arrays.ids, arrays.categories
+
+    def _rows(self, products):
+        products = list(products)
+        documents = [product_document(product) for product in products]
+        vectors = self.embeddings.embed_documents(documents) if documents else []
+        return products, documents, vectors
+
+    def sync(self, products):
+        products, documents, vectors = self._rows(products)
+        if vectors:
+            matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        arrays = _IndexArrays(
+            matrix,
+            np.array([product.pk for product in products], dtype=np.int64),
+            np.array([product.category for product in products], dtype=object),
+            documents,
+            [_product_metadata(product) for product in products],
+        )
+        with self._lock:
+            self._arrays = arrays
+        print(f"retrievers: NumPy index built with {len(products)} products.")
+
+    def upsert(self, product):
+        _, documents, vectors = self._rows([product])
+        vector = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            current = self._arrays
+            rows = np.flatnonzero(current.ids == product.pk)
+            if rows.size:
+                row = int(rows[0])
+                matrix = current.matrix.copy()
+                matrix[row] = vector[0]
+                categories = current.categories.copy()
+                categories[row] = product.category
+                docs = list(current.documents)
+                docs[row] = documents[0]
+                metadatas = list(current.metadatas)
+                metadatas[row] = _product_metadata(product)
+                self._arrays = _IndexArrays(matrix, current.ids, categories, docs, metadatas)
+            else:
+                matrix = vector if current.matrix.size == 0 else np.vstack([current.matrix, vector])
+                self._arrays = _IndexArrays(
+                    matrix,
+                    np.append(current.ids, np.int64(product.pk)),
+                    np.append(current.categories, np.array([product.category], dtype=object)),
+                    current.documents + documents,
+                    current.metadatas + [_product_metadata(product)],
+                )
+        print(f"retrievers: Upserted product {product.pk} into NumPy index.")
+
+    def delete(self, product_id):
+        with self._lock:
+            current = self._arrays
+            keep = current.ids != product_id
+            if keep.all():
+                return
+            rows = np.flatnonzero(keep)
+            self._arrays = _IndexArrays(
+                current.matrix[keep],
+                current.ids[keep],
+                current.categories[keep],
+                [current.documents[row] for row in rows],
+                [current.metadatas[row] for row in rows],
+            )
+        print(f"retrievers: Deleted product {product_id} from NumPy index.")
+
+    def scores(self, query_vector, categories=None, arrays=None):
+        """Cosine similarity of every (optionally category-masked) product; returns (rows, scores)."""
+        arrays = arrays or self._arrays
+        if not len(arrays.ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if categories:
+            rows = np.flatnonzero(np.isin(arrays.categories, categories))
+            return rows, arrays.matrix[rows] @ query
+        return np.arange(len(arrays.ids)), arrays.matrix @ query
+
+    def search_by_vector(self, query_vector, k=4, filter=None):
+        """Return [(Document, score)] for the k most similar products."""
+        arrays = self._arrays
+        rows, scores = self.scores(query_vector, _category_filter(filter), arrays)
+        if not rows.size:
+            return []
+        k = min(k, rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (Document(page_content=arrays.documents[rows[i]], metadata=arrays.metadatas[rows[i]]), float(scores[i]))
+            for i in top
+        ]
+
+    def as_retriever(self, search_kwargs=None, **kwargs):
+        return NumpyProductRetriever(index=self, search_kwargs=search_kwargs or {})
+
+
+class NumpyProductRetriever(BaseRetriever):
+    """LangChain retriever over a NumpyProductIndex (drop-in for Chroma's as_retriever())."""
+
+    index: Any
+    search_kwargs: dict = Field(default_factory=dict)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        vector = self.index.embeddings.embed_query(query)
+        return [doc for doc, _ in self.index.search_by_vector(vector, **self.search_kwargs)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        vector = await self.index.embeddings.aembed_query(query)
+        return [doc for doc, _ in self.index.search_by_vector(vector, **self.search_kwargs)]
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index (token -> {row: term frequency})."""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        lengths = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for token in tokens:
+                self.postings[token][row] = self.postings[token].get(row, 0) + 1
+        self.size = len(lengths)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.avgdl = float(self.lengths.mean()) if self.size and self.lengths.mean() else 1.0
+        self.idf = {
+            token: math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            for token, rows in self.postings.items()
+        }
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in dict.fromkeys(tokenize(query)):
+            rows = self.postings.get(token)
+            if not rows:
+                continue
+            idf = self.idf[token]
+            for row, tf in rows.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row] / self.avgdl)
+                scores[row] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+# Lexical structures built from one _IndexArrays snapshot, swapped in together
+_LexicalIndex = namedtuple("_LexicalIndex", ["arrays", "bm25", "matcher", "prices", "rows_by_id", "category_terms"])
+
+
+class HybridProductIndex(NumpyProductIndex):
+    """
+    NumpyProductIndex plus a BM25 inverted index over product name and description.
+    Candidates are first prefiltered on category and price range. Queries that
+    contain an exact product name or an identifier-like token (SKU/model number)
+    are answered from the name matcher / inverted index without embedding;
+    otherwise BM25 and cosine scores are min-max normalized and blended with
+    weight alpha on the vector side. upsert()/delete() only swap the vector
+    arrays; the lexical structures are rebuilt once, by the first query that
+    finds them built from older arrays, so bulk edits don't rebuild per product.
+    """
+
+    def __init__(self, embeddings, alpha=0.5):
+        super().__init__(embeddings)
+        self.alpha = alpha
+        self._lexical_lock = threading.Lock()
+        self._lexical = None
+        self._rebuild_lexical()
+
+    def _current_lexical(self):
+        lexical = self._lexical
+        if lexical.arrays is self._arrays:
+            return lexical
+        with self._lexical_lock:
+            if self._lexical.arrays is not self._arrays:
+                self._rebuild_lexical()
+            return self._lexical
+
+    def _rebuild_lexical(self):
+        arrays = self._arrays
+        names = [metadata["name"] for metadata in arrays.metadatas]
+        # Name tokens are repeated so they outweigh description matches
+        bm25 = BM25Index([f"{name} {name} {document}" for name, document in zip(names, arrays.documents)])
+        matcher = ProductNameMatcher(
+            CatalogEntry(metadata["product_id"], metadata["name"], metadata["category"], metadata.get("price"))
+            for metadata in arrays.metadatas
+        )
+        prices = np.array([metadata.get("price", np.nan) for metadata in arrays.metadatas], dtype=np.float64)
+        category_terms = {}
+        for category in set(arrays.categories.tolist()):
+            folded = str(category).casefold()
+            for term in (folded, folded.rstrip("s"), folded + "s"):
+                category_terms[term] = category
+        self._lexical = _LexicalIndex(
+            arrays, bm25, matcher, prices,
+            {int(product_id): row for row, product_id in enumerate(arrays.ids)},
+            category_terms,
+        )
+
+    def sync(self, products):
+        super().sync(products)
+        self._current_lexical()  # Built eagerly so the first query doesn't pay for it
+
+    def infer_categories(self, query, lexical=None):
+        """Categories named in the query text ("any perfumes?" -> ["Perfumes"])."""
+        terms = (lexical or self._current_lexical()).category_terms
+        return list(dict.fromkeys(terms[token] for token in tokenize(query) if token in terms))
+
+    def _candidate_mask(self, lexical, categories=None, min_price=None, max_price=None):
+        mask = np.ones(len(lexical.arrays.ids), dtype=bool)
+        if categories:
+            mask &= np.isin(lexical.arrays.categories, categories)
+        if min_price is not None:
+            mask &= lexical.prices >= float(min_price)
+        if max_price is not None:
+            mask &= lexical.prices <= float(max_price)
+        return mask
+
+    def _exact_matches(self, lexical, query, mask):
+        rows = []
+        for _start, _end, entry in lexical.matcher.find_all(query):
+            row = lexical.rows_by_id.get(entry.id)
+            if row is not None and mask[row] and row not in rows:
+                rows.append(row)
+        return rows
+
+    def _sku_matches(self, lexical, query, mask, k):
+        """Rows containing an identifier-like query token (letters+digits, e.g. "xb-200"), ranked by BM25."""
+        skus = [token for token in tokenize(query) if len(token) >= 3 and _SKU_TOKEN_RE.search(token)]
+        rows = {row for token in skus for row in lexical.bm25.postings.get(token, ()) if mask[row]}
+        if not rows:
+            return [], []
+        rows = np.fromiter(rows, dtype=np.int64)
+        scores = lexical.bm25.scores(query)[rows]
+        order = np.argsort(-scores)[:k]
+        return rows[order], _min_max(scores)[order] if rows.size > 1 else np.ones(1, dtype=np.float32)
+
+    def _documents(self, lexical, rows, scores):
+        return [
+            (Document(page_content=lexical.arrays.documents[row], metadata=lexical.arrays.metadatas[row]), float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def _blend(self, lexical, query, query_vector, mask, k):
+        candidates = np.flatnonzero(mask)
+        if not candidates.size:
+            return []
+        lexical_scores = lexical.bm25.scores(query)[candidates]
+        _, vector_scores = self.scores(query_vector, arrays=lexical.arrays)
+        vector_scores = vector_scores[candidates]
+        blended = self.alpha * _min_max(vector_scores) + (1 - self.alpha) * _min_max(lexical_scores)
+        k = min(k, candidates.size)
+        top = np.argpartition(-blended, k - 1)[:k]
+        top = top[np.argsort(-blended[top])]
+        return self._documents(lexical, candidates[top], blended[top])
+
+    def _prepare(self, query, filter, infer_category):
+        lexical = self._current_lexical()
+        categories = _category_filter(filter)
+        if categories is None and infer_category:
+            categories = self.infer_categories(query, lexical) or None
+        min_price, max_price = _price_filter(filter)
+        mask = self._candidate_mask(lexical, categories, min_price, max_price)
+        return lexical, mask
+
+    def hybrid_search(self, query, k=4, filter=None, infer_category=True):
+        """Return [(Document, score)] for query; exact product names skip the embedding call."""
+        lexical, mask = self._prepare(query, filter, infer_category)
+        exact = self._exact_matches(lexical, query, mask)
+        if exact:
+            return self._documents(lexical, exact[:k], [1.0] * len(exact[:k]))
+        sku_rows, sku_scores = self._sku_matches(lexical, query, mask, k)
+        if len(sku_rows):
+            return self._documents(lexical, sku_rows, sku_scores)
+        return self._blend(lexical, query, self.embeddings.embed_query(query), mask, k)
+
+    async def ahybrid_search(self, query, k=4, filter=None, infer_category=True):
+        lexical, mask = self._prepare(query, filter, infer_category)
+        exact = self._exact_matches(lexical, query, mask)
+        if exact:
+            return self._documents(lexical, exact[:k], [1.0] * len(exact[:k]))
+        sku_rows, sku_scores = self._sku_matches(lexical, query, mask, k)
+        if len(sku_rows):
+            return self._documents(lexical, sku_rows, sku_scores)
+        return self._blend(lexical, query, await self.embeddings.aembed_query(query), mask, k)
+
+    def as_retriever(self, search_kwargs=None, **kwargs):
+        return HybridProductRetriever(index=self, search_kwargs=search_kwargs or {})
+
+
+def _min_max(scores):
+    if not scores.size:
+        return scores
+    low, high = float(scores.min()), float(scores.max())
+    if high - low < 1e-9:
+        return np.ones_like(scores) if high > 0 else np.zeros_like(scores)
+    return (scores - low) / (high - low)
+
+
+class HybridProductRetriever(BaseRetriever):
+    """LangChain retriever over a HybridProductIndex; search_kwargs: k, filter, infer_category."""
+
+    index: Any
+    search_kwargs: dict = Field(default_factory=dict)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [doc for doc, _ in self.index.hybrid_search(query, **self.search_kwargs)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return [doc for doc, _ in await self.index.ahybrid_search(query, **self.search_kwargs)]
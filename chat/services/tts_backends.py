@@ -0,0 +1,213 @@
+# chat/services/tts_backends.py
+import abc
+import asyncio
+import hashlib
+import io
+import math
+import os
+import wave
+import weakref
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+print("--- Loading chat/services/tts_backends.py ---")
+
+KEY_FILE_NAME = 'big-buttress-457415-v1-2a505cf38889.json'
+
+_GOOGLE_MIME_TYPES = {"MP3": "audio/mpeg", "LINEAR16": "audio/wav", "OGG_OPUS": "audio/ogg"}
+
+
+class TTSOverloaded(Exception):
+    """No synthesis slot became free within CHAT_TTS_QUEUE_TIMEOUT."""
+
+
+class TTSBackend(abc.ABC):
+    """Interface: synthesize(text) -> (audio bytes, mime type)."""
+    name = ""
+
+    def cache_params(self):
+        """Everything besides the text that changes the audio; part of the TTS cache key."""
+        return {"backend": self.name}
+
+    @abc.abstractmethod
+    async def synthesize(self, text):
+        """(audio bytes, mime type) for text."""
+
+
+def _credentials_path():
+    path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if path:
+        if not os.path.exists(path):
+            print(f"ERROR: Credentials file specified by GOOGLE_APPLICATION_CREDENTIALS not found: {path}")
+            return None
+        return path
+    path = os.path.join(settings.BASE_DIR, KEY_FILE_NAME)
+    if not os.path.exists(path):
+        print(f"WARNING: Credentials file not found: {path}")
+        return None
+    return path
+
+
+class GoogleTTSBackend(TTSBackend):
+    """
+    Google Cloud Text-to-Speech through TextToSpeechAsyncClient (gRPC asyncio),
+    so synthesis waits on the event loop instead of a thread-pool thread.
+    The client is bound to the event loop that created it, so there is one per loop.
+    """
+    name = "google"
+
+    def __init__(self, language_code="en-US", ssml_gender="NEUTRAL", audio_encoding="MP3"):
+        self.language_code = language_code
+        self.ssml_gender = ssml_gender
+        self.audio_encoding = audio_encoding
+        self._credentials = None
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> TextToSpeechAsyncClient
+
+    def cache_params(self):
+        return {
+            "backend": self.name,
+            "language_code": self.language_code,
+            "ssml_gender": self.ssml_gender,
+            "audio_encoding": self.audio_encoding,
+        }
+
+    async def _get_client(self):
+        from google.cloud import texttospeech
+        from google.oauth2 import service_account
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is not None:
+            return client
+        if self._credentials is None:
+            path = _credentials_path()
+            if not path:
+                raise RuntimeError("Google Cloud credentials are not configured")
+            self._credentials = await sync_to_async(
+                service_account.Credentials.from_service_account_file, thread_sensitive=False
+            )(path)
+            print("tts_backends: Google credentials loaded.")
+        client = texttospeech.TextToSpeechAsyncClient(credentials=self._credentials)
+        self._clients[loop] = client
+        print("tts_backends: TextToSpeechAsyncClient initialized.")
+        return client
+
+    async def synthesize(self, text):
+        from google.cloud import texttospeech
+
+        client = await self._get_client()
+        response = await client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=texttospeech.VoiceSelectionParams(
+                language_code=self.language_code,
+                ssml_gender=texttospeech.SsmlVoiceGender[self.ssml_gender],
+            ),
+            audio_config=texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding[self.audio_encoding],
+            ),
+        )
+        return response.audio_content, _GOOGLE_MIME_TYPES.get(self.audio_encoding, "")
+
+
+class LocalToneTTSBackend(TTSBackend):
+    """
+    Offline stand-in for benchmarks and CI: a deterministic 16-bit mono WAV whose
+    length grows with the text (ms_per_char) and whose pitch derives from the
+    text hash (tone=False gives silence). latency adds a simulated service delay.
+    """
+    name = "local"
+
+    def __init__(self, sample_rate=16000, ms_per_char=60, tone=True, latency=0.0):
+        self.sample_rate = sample_rate
+        self.ms_per_char = ms_per_char
+        self.tone = tone
+        self.latency = latency
+
+    def cache_params(self):
+        return {"backend": self.name, "sample_rate": self.sample_rate, "ms_per_char": self.ms_per_char, "tone": self.tone}
+
+    def render(self, text):
+        frames = int(self.sample_rate * self.ms_per_char * max(1, len(text)) / 1000)
+        if self.tone:
+            frequency = 220 + int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:4], 16) % 440
+            step = 2 * math.pi * frequency / self.sample_rate
+            samples = (np.sin(step * np.arange(frames)) * 3000).astype("<i2").tobytes()
+        else:
+            samples = bytes(2 * frames)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(samples)
+        return buffer.getvalue()
+
+    async def synthesize(self, text):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.render(text), "audio/wav"
+
+
+class TTSLimiter:
+    """
+    Process-wide cap on in-flight synthesis calls. Callers wait up to
+    queue_timeout for a slot (then TTSOverloaded) and each call is limited to
+    request_timeout. The semaphore is per event loop (asyncio primitives can't
+    cross loops); under ASGI that is one per process.
+    """
+
+    def __init__(self, max_concurrency=8, queue_timeout=5.0, request_timeout=15.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.counters = {"calls": 0, "rejected": 0, "timeouts": 0}
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def run(self, func, *args):
+        semaphore = self._semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected"] += 1
+            raise TTSOverloaded(f"No TTS slot free within {self.queue_timeout}s")
+        try:
+            self.counters["calls"] += 1
+            return await asyncio.wait_for(func(*args), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        finally:
+            semaphore.release()
+
+
+_backend = None
+
+
+def get_tts_backend():
+    """The backend selected by CHAT_TTS_BACKEND ("google" or "local"), built once."""
+    global _backend
+    if _backend is None:
+        if settings.CHAT_TTS_BACKEND == "google":
+            _backend = GoogleTTSBackend()
+        elif settings.CHAT_TTS_BACKEND == "local":
+            _backend = LocalToneTTSBackend(latency=settings.CHAT_TTS_LOCAL_LATENCY)
+        else:
+            raise ValueError(f"Unknown CHAT_TTS_BACKEND: {settings.CHAT_TTS_BACKEND!r}")
+        print(f"tts_backends: Using {_backend.name} TTS backend.")
+    return _backend
+
+
+tts_limiter = TTSLimiter(
+    max_concurrency=settings.CHAT_TTS_MAX_CONCURRENCY,
+    queue_timeout=settings.CHAT_TTS_QUEUE_TIMEOUT,
+    request_timeout=settings.CHAT_TTS_REQUEST_TIMEOUT,
+)
@@ -0,0 +1,131 @@
+# chat/services/tts_cache.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+print("--- Loading chat/services/tts_cache.py ---")
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized audio.
+    Keys hash the text together with everything that changes the audio (voice
+    parameters, encoding). Entries live in an in-memory LRU bounded by total
+    bytes and, optionally, a SQLite file bounded by size; the least recently
+    used rows are evicted first. Disk hits are promoted to memory.
+    """
+
+    def __init__(self, memory_bytes=32 * 1024 * 1024, db_path=None, disk_bytes=512 * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # key -> (audio, mime)
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        if db_path:
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tts_audio ("
+                "key TEXT PRIMARY KEY, mime TEXT NOT NULL, audio BLOB NOT NULL, "
+                "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS tts_audio_accessed_idx ON tts_audio (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def key(text, **params):
+        """Cache key for text synthesized with params (voice, language, encoding, ...)."""
+        payload = json.dumps({"text": text, **params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, audio, mime):
+        # Caller holds self._lock
+        if len(audio) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous:
+            self._memory_used -= len(previous[0])
+        self._memory[key] = (audio, mime)
+        self._memory_used += len(audio)
+        while self._memory_used > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def get(self, key):
+        """(audio, mime) for key, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry
+            if self._db is not None:
+                row = self._db.execute("SELECT audio, mime FROM tts_audio WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    audio, mime = bytes(row[0]), row[1]
+                    self._db.execute("UPDATE tts_audio SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, audio, mime)
+                    self.counters["disk_hits"] += 1
+                    return audio, mime
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, audio, mime):
+        if not audio:
+            return
+        with self._lock:
+            self._remember(key, audio, mime)
+            self.counters["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tts_audio (key, mime, audio, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, mime, audio, len(audio), time.time()),
+                )
+                self._evict_disk()
+                self._db.commit()
+
+    def _evict_disk(self):
+        # Caller holds self._lock
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tts_audio").fetchone()[0]
+        if total <= self.disk_bytes:
+            return
+        excess = total - self.disk_bytes
+        for key, size in self._db.execute("SELECT key, size FROM tts_audio ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM tts_audio WHERE key = ?", (key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+    async def aget(self, key):
+        if key in self._memory:
+            return self.get(key)  # No disk access needed
+        return await sync_to_async(self.get, thread_sensitive=False)(key)
+
+    async def aput(self, key, audio, mime):
+        await sync_to_async(self.put, thread_sensitive=False)(key, audio, mime)
+
+    def stats(self):
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return dict(
+            self.counters,
+            memory_entries=len(self._memory),
+            memory_bytes=self._memory_used,
+            hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+        )
+
+
+tts_cache = TTSCache(
+    memory_bytes=settings.CHAT_TTS_CACHE_MEMORY_BYTES,
+    db_path=settings.CHAT_TTS_CACHE_PATH,
+    disk_bytes=settings.CHAT_TTS_CACHE_DISK_BYTES,
+)
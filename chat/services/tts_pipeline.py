@@ -0,0 +1,79 @@
+# chat/services/tts_pipeline.py
+import asyncio
+import re
+
+print("--- Loading chat/services/tts_pipeline.py ---")
+
+# End of a sentence (terminal punctuation, optional closing quote/bracket, whitespace) or a line break
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+
+
+class SentenceTTSPipeline:
+    """
+    Synthesizes a streamed reply sentence by sentence while it is still being generated.
+    feed() takes text deltas; every complete sentence (merged with the following
+    ones until it has at least min_chars characters) is synthesized right away,
+    at most max_parallel at a time. Audio is handed to send_chunk(seq, audio, mime)
+    strictly in sentence order with consecutive seq numbers starting at 0, so
+    the client can start playing after the first sentence.
+    """
+
+    def __init__(self, synthesize, send_chunk, max_parallel=3, min_chars=20):
+        self.synthesize = synthesize
+        self.send_chunk = send_chunk
+        self.min_chars = min_chars
+        self.chunks_sent = 0
+        self._buffer = ""
+        self._semaphore = asyncio.Semaphore(max(1, max_parallel))
+        self._queue = asyncio.Queue()  # Synthesis tasks in sentence order, None when done
+        self._tasks = []
+        self._sender = asyncio.create_task(self._send_in_order())
+
+    async def _synthesize(self, sentence):
+        async with self._semaphore:
+            return await self.synthesize(sentence)
+
+    def _submit(self, sentence):
+        task = asyncio.create_task(self._synthesize(sentence))
+        self._tasks.append(task)
+        self._queue.put_nowait(task)
+
+    async def _send_in_order(self):
+        while True:
+            task = await self._queue.get()
+            if task is None:
+                return
+            try:
+                audio, mime = await task
+            except Exception as e:
+                print(f"tts_pipeline: Sentence synthesis failed: {e}")
+                continue
+            if audio:
+                await self.send_chunk(self.chunks_sent, audio, mime)
+                self.chunks_sent += 1
+
+    def feed(self, text):
+        """Add reply text; synthesis starts for each sentence it completes."""
+        self._buffer += text
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()]
+            if len(sentence.strip()) >= self.min_chars:
+                self._submit(sentence.strip())
+                start = match.end()
+        self._buffer = self._buffer[start:]
+
+    async def finish(self):
+        """Synthesize the remaining text and wait until every chunk is sent. Returns the chunk count."""
+        if self._buffer.strip():
+            self._submit(self._buffer.strip())
+        self._buffer = ""
+        self._queue.put_nowait(None)
+        await self._sender
+        return self.chunks_sent
+
+    def cancel(self):
+        """Drop pending synthesis (e.g. the socket closed mid-reply)."""
+        for task in self._tasks:
+            task.cancel()
+        self._sender.cancel()
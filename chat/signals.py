@@ -0,0 +1,37 @@
+# chat/signals.py
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import product_catalog
+from .history_writer import history_writer
+from .models import ChatHistory, Product
+from .suggestions import suggestion_cache
+from .threads import thread_pool
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    # After commit, so no other thread can reload (and cache) the pre-commit rows
+    transaction.on_commit(product_catalog.invalidate)
+    transaction.on_commit(apps.get_app_config('chat').request_index_sync)  # Embeds in the background
+    transaction.on_commit(thread_pool.request_refill)  # Retire threads primed with the old product list
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    transaction.on_commit(product_catalog.invalidate)
+    transaction.on_commit(apps.get_app_config('chat').request_index_sync)
+    transaction.on_commit(thread_pool.request_refill)
+
+
+@receiver(post_save, sender=ChatHistory)
+def chat_history_saved(sender, instance, created, **kwargs):
+    # Rows written one at a time; batched rows arrive through the history_writer listener below
+    if created and instance.role == "user":
+        user_id = instance.user_id
+        transaction.on_commit(lambda: suggestion_cache.refresh_later([user_id]))
+
+
+history_writer.add_flush_listener(suggestion_cache.history_flushed)
@@ -20,6 +20,13 @@ let isAudioPlaying = false;
 let currentAudioElement = null; // Reference to the currently playing Audio object
 let currentVoiceSessionId = null; // To link STT input to TTS output
 let isManualStop = false; // <-- Add this new flag to track manual stop
+let streamingBotBubble = null; // Bot bubble being filled by bot_response_delta frames
+let nextTtsSeq = 0; // Sequence number of the next TTS chunk to play for the current session
+let pendingTtsChunks = new Map(); // seq -> audio blob received ahead of its turn
+let ttsStreamEnded = true; // Backend sent tts_end (no more chunks) for the current session
+let binaryAudioParts = new Map(); // "session:seq" -> audio parts of a chunk arriving as binary frames
+const AUDIO_FRAME_HEADER_BYTES = 26; // Layout in chat/audio_frames.py
+const AUDIO_FRAME_MIME_TYPES = { 1: 'audio/mpeg', 2: 'audio/wav', 3: 'audio/ogg' };
 
 
 // >> IMPORTANT: REMOVE the VOICE_FLOW_SLUG constant from your HTML file's <script> block if it's defined there.
@@ -119,11 +126,67 @@ function displayMessage(message, sender) {
         messageContainer.appendChild(timestampSpan);
         chatMessages.appendChild(messageContainer); // Append to the chat messages container
         chatMessages.scrollTop = chatMessages.scrollHeight; // Auto-scroll to the latest message
+        return messageDiv; // Streaming replies keep appending to this bubble
     } else {
         console.warn("displayMessage: chatMessages element not found yet.");
+        return null;
     }
 }
 
+// --- Append streamed text to a bot bubble (created on first delta) ---
+function appendToBotBubble(bubble, text) {
+    if (!bubble) {
+        bubble = displayMessage('', 'bot');
+    }
+    if (bubble) {
+        bubble.textContent += text;
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+    return bubble;
+}
+
+
+// --- Read a Server-Sent Events reply from /api/chat/send/ ---
+// "delta" events are shown as they arrive; resolves with the "done" (or "error") payload.
+async function readChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let bubble = null;
+    let result = { error: 'Response stream ended unexpectedly' };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let dataText = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataText += line.slice(5).trim();
+                }
+            });
+            const payload = dataText ? JSON.parse(dataText) : {};
+
+            if (eventName === 'delta') {
+                bubble = appendToBotBubble(bubble, payload.text);
+            } else if (eventName === 'done' || eventName === 'error') {
+                result = payload;
+            }
+        }
+    }
+    result.streamedBubble = bubble;
+    return result;
+}
+
 
 // --- Function to load initial suggestions ---
 function loadInitialSuggestions() {
@@ -183,6 +246,7 @@ function sendTextMessage(message) {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream, application/json', // Stream the reply when the server supports it
                 'Authorization': `Bearer ${currentToken}`
             },
             body: JSON.stringify({ message: message })
@@ -196,11 +260,16 @@ function sendTextMessage(message) {
                 }
                 return Promise.reject('HTTP error');
             }
-            return response.json();
+            const contentType = response.headers.get('Content-Type') || '';
+            return contentType.includes('text/event-stream') ? readChatStream(response) : response.json();
         })
         .then(data => {
             if (data && data.response) {
-                displayMessage(data.response, 'bot');
+                if (data.streamedBubble) {
+                    data.streamedBubble.textContent = data.response; // Final parsed text replaces the streamed deltas
+                } else {
+                    displayMessage(data.response, 'bot');
+                }
             } else if (data && data.error) {
                 displayMessage(`Error: ${data.error}`, 'bot');
             }
@@ -374,6 +443,7 @@ function startVoiceChat() {
 
                     // Generate a new session ID for this user utterance
                     currentVoiceSessionId = crypto.randomUUID();
+                    resetTtsSequence();
                     updateVoiceStatus("Sending...");
 
                     // Send the recognized text to the WebSocket backend
@@ -481,6 +551,7 @@ function connectVoiceWebSocket() {
 
     try {
         voiceSocket = new WebSocket(voiceWsUrl);
+        voiceSocket.binaryType = 'arraybuffer'; // Audio may arrive as binary frames
 
         voiceSocket.onopen = (event) => {
             console.log('Voice WebSocket connection opened:', event);
@@ -489,6 +560,8 @@ function connectVoiceWebSocket() {
             // updateVoiceStatus("Connected. Click Start.");
             // Re-enable the button once WS is open (status will be updated by backend message)
             if(voiceToggleBtn) voiceToggleBtn.disabled = false;
+            // Ask for raw binary audio frames instead of base64 JSON
+            voiceSocket.send(JSON.stringify({ type: 'hello', binary_audio: true }));
         };
 
         voiceSocket.onclose = (event) => {
@@ -518,6 +591,10 @@ function connectVoiceWebSocket() {
         };
 
         voiceSocket.onmessage = (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                handleBinaryAudioFrame(event.data);
+                return;
+            }
             let msg;
             try {
                 msg = JSON.parse(event.data);
@@ -531,8 +608,10 @@ function connectVoiceWebSocket() {
             // Based on your consumer code, backend sends:
             // status: {'type': 'status', 'message': 'ready/processing/speaking', 'detail': '...'}
             // error: {'type': 'error', 'message': '...', 'detail': '...'}
+            // bot_response_delta: {'type': 'bot_response_delta', 'session_id': ..., 'text': ...} (streamed answer text)
             // bot_response: {'type': 'bot_response', 'user_text': ..., 'text': ..., 'suggested_products': [...]}
-            // tts_chunk: {'event': 'tts_chunk', 'session_id': ..., 'payload': ..., 'mime': ...}
+            // tts_chunk: {'event': 'tts_chunk', 'session_id': ..., 'seq': 0, 1, ..., 'payload': ..., 'mime': ...}
+            // tts_end: {'event': 'tts_end', 'session_id': ..., 'chunks': ...} (no more chunks for the session)
 
 
             if (msg.type === 'status') {
@@ -547,14 +626,23 @@ function connectVoiceWebSocket() {
                       voiceToggleBtn.disabled = true;
                  }
             } else if (msg.type === 'error') {
+                streamingBotBubble = null; // A failed turn's partial reply is not continued
                 console.error("Backend error message:", msg.detail);
                 updateVoiceStatus(`Backend Error: ${msg.message}`);
                 displayMessage(`Backend Error: ${msg.detail}`, 'bot');
                  // After an error, the backend typically sends a 'ready' status, handled above.
+            } else if (msg.type === 'bot_response_delta') {
+                // Streamed part of the bot's answer; shown as it arrives
+                streamingBotBubble = appendToBotBubble(streamingBotBubble, msg.text);
             } else if (msg.type === 'bot_response') {
                 // This message contains the bot's text response and suggestions
                 console.log("Received bot text response:", msg.text);
-                displayMessage(msg.text, 'bot'); // Display the bot's text
+                if (streamingBotBubble) {
+                    streamingBotBubble.textContent = msg.text; // Final parsed text replaces the streamed deltas
+                    streamingBotBubble = null;
+                } else {
+                    displayMessage(msg.text, 'bot'); // Display the bot's text
+                }
 
                  // Display user's text received back from backend if needed (optional, already displayed on recognition)
                  // if (msg.user_text) { console.log("User text received back:", msg.user_text); }
@@ -586,10 +674,10 @@ function connectVoiceWebSocket() {
                  try {
                      const bytes = Uint8Array.from(atob(msg.payload), c => c.charCodeAt(0));
                      const blob = new Blob([bytes], { type: msg.mime || 'audio/mpeg' }); // Default to mp3 if mime is missing
-                     console.log("Received and decoded TTS chunk for session:", msg.session_id);
+                     console.log(`Received and decoded TTS chunk ${msg.seq} for session:`, msg.session_id);
 
-                     // Enqueue the audio blob for playback
-                     enqueueAudio(blob);
+                     // Enqueue the audio blob for playback, in sequence order
+                     enqueueTtsChunk(msg.seq, blob);
 
                  } catch (e) {
                      console.error("Error decoding or processing audio chunk:", e);
@@ -601,6 +689,13 @@ function connectVoiceWebSocket() {
                           if (voiceToggleBtn) voiceToggleBtn.disabled = false;
                       }
                  }
+            } else if (msg.type === 'hello') {
+                console.log("Voice transport negotiated, binary audio:", msg.binary_audio);
+            } else if (msg.event === "tts_end" && msg.session_id) {
+                 if (msg.session_id === currentVoiceSessionId) {
+                     ttsStreamEnded = true;
+                     finishVoiceSessionIfDone();
+                 }
             } else {
                 // Received an unexpected message format
                 console.warn("Received unknown or incomplete message format:", msg);
@@ -618,6 +713,70 @@ function connectVoiceWebSocket() {
     }
 }
 
+// --- Ordered TTS Chunks ---
+// Sentence chunks of one reply arrive with seq 0, 1, 2...; play them strictly in that order.
+function resetTtsSequence() {
+    nextTtsSeq = 0;
+    pendingTtsChunks.clear();
+    binaryAudioParts.clear();
+    ttsStreamEnded = false;
+}
+
+function enqueueTtsChunk(seq, blob) {
+    if (seq === undefined || seq === null) {
+        enqueueAudio(blob); // Unsequenced chunk (older backend)
+        return;
+    }
+    pendingTtsChunks.set(seq, blob);
+    while (pendingTtsChunks.has(nextTtsSeq)) {
+        enqueueAudio(pendingTtsChunks.get(nextTtsSeq));
+        pendingTtsChunks.delete(nextTtsSeq);
+        nextTtsSeq++;
+    }
+}
+
+// --- Binary Audio Frames ---
+// Header: version u8, flags u8 (1 = last frame of the chunk), mime u8, pad, seq u32, part u16, session UUID (16 bytes)
+function uuidFromBytes(bytes) {
+    const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
+function handleBinaryAudioFrame(buffer) {
+    if (buffer.byteLength < AUDIO_FRAME_HEADER_BYTES) {
+        console.warn("Ignoring short binary frame:", buffer.byteLength);
+        return;
+    }
+    const view = new DataView(buffer);
+    const isFinal = (view.getUint8(1) & 1) === 1;
+    const mime = AUDIO_FRAME_MIME_TYPES[view.getUint8(2)] || 'audio/mpeg';
+    const seq = view.getUint32(4);
+    const sessionId = uuidFromBytes(new Uint8Array(buffer, 10, 16));
+
+    if (sessionId !== currentVoiceSessionId) {
+        console.log(`Ignoring binary TTS frame for old session: ${sessionId}. Expected: ${currentVoiceSessionId}`);
+        return;
+    }
+    const key = `${sessionId}:${seq}`;
+    const parts = binaryAudioParts.get(key) || [];
+    parts.push(buffer.slice(AUDIO_FRAME_HEADER_BYTES)); // Frames of one chunk arrive in order
+    if (!isFinal) {
+        binaryAudioParts.set(key, parts);
+        return;
+    }
+    binaryAudioParts.delete(key);
+    console.log(`Received binary TTS chunk ${seq} (${parts.length} frame(s)) for session:`, sessionId);
+    enqueueTtsChunk(seq, new Blob(parts, { type: mime }));
+}
+
+// Clear the session once the backend is done sending and everything has played
+function finishVoiceSessionIfDone() {
+    if (ttsStreamEnded && !isAudioPlaying && currentAudioQueue.length === 0) {
+        console.log("Finished playing all audio chunks for session:", currentVoiceSessionId);
+        currentVoiceSessionId = null;
+    }
+}
+
 // --- Audio Playback Queue ---
 function enqueueAudio(blob) {
     currentAudioQueue.push(blob);
@@ -647,11 +806,10 @@ function playNextAudioChunk() {
         if (currentAudioQueue.length > 0) {
             playNextAudioChunk();
         } else {
-            // If queue is empty, bot has finished speaking the response
-            console.log("Finished playing all audio chunks for session:", currentVoiceSessionId);
+            // If queue is empty, bot may have finished speaking the response
             // Status is updated by backend sending 'ready' status after response plays completely
-            // Don't clear currentVoiceSessionId here, wait for the *last* audio chunk's onended
-             currentVoiceSessionId = null; // <-- Clear here after the *last* chunk finishes playing
+            // Only clear currentVoiceSessionId after the *last* chunk (tts_end received) finishes playing
+            finishVoiceSessionIfDone();
         }
     };
 
@@ -667,7 +825,7 @@ function playNextAudioChunk() {
             playNextAudioChunk();
         } else {
              // If no more chunks, status is updated by backend sending 'ready' after response
-             currentVoiceSessionId = null;
+             finishVoiceSessionIfDone();
         }
         displayMessage("Audio playback error.", 'bot'); // Inform user in chat
     };
@@ -686,7 +844,7 @@ function playNextAudioChunk() {
              playNextAudioChunk();
          } else {
               // If no more chunks, status is updated by backend sending 'ready' after response
-              currentVoiceSessionId = null;
+              finishVoiceSessionIfDone();
          }
     });
 }
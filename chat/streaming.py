@@ -0,0 +1,79 @@
+# chat/streaming.py
+import json
+
+print("--- Loading chat/streaming.py ---")
+
+RESPONSE_HEADING = "**Response:**"
+SUGGESTIONS_HEADING = "**Suggested Products:**"
+
+
+class ResponseStreamSplitter:
+    """
+    Turns streamed completion deltas into the user-visible part of the reply.
+    Our prompts ask for "**Response:** <answer> **Suggested Products:** <list>",
+    so a leading response heading is dropped and nothing from the suggestions
+    heading on is emitted. Text that might be the start of a heading is held
+    back until the next delta shows it isn't.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.done = False  # Suggestions heading reached; the rest is parsed from the full text
+        self._start = None  # Where the visible answer starts in self.text
+        self._emitted = 0
+
+    def _find_start(self):
+        stripped = self.text.lstrip()
+        if not stripped or (RESPONSE_HEADING.startswith(stripped) and stripped != RESPONSE_HEADING):
+            return None  # Whitespace so far, or possibly a partial response heading
+        start = len(self.text) - len(stripped)
+        if stripped.startswith(RESPONSE_HEADING):
+            start += len(RESPONSE_HEADING)
+            rest = self.text[start:]
+            if not rest.strip():
+                return None
+            start += len(rest) - len(rest.lstrip())
+        return start
+
+    def feed(self, delta):
+        """Add a delta; returns the newly visible text ("" if none yet)."""
+        self.text += delta
+        if self.done:
+            return ""
+        if self._start is None:
+            self._start = self._find_start()
+            if self._start is None:
+                return ""
+            self._emitted = self._start
+
+        end = self.text.find(SUGGESTIONS_HEADING, self._start)
+        if end != -1:
+            self.done = True
+        else:
+            end = len(self.text)
+            for size in range(min(len(SUGGESTIONS_HEADING) - 1, end - self._emitted), 0, -1):
+                if SUGGESTIONS_HEADING.startswith(self.text[end - size:end]):
+                    end -= size
+                    break
+        return self._advance(end)
+
+    def flush(self):
+        """Visible text still held back once the stream has ended."""
+        if self.done:
+            return ""
+        if self._start is None:
+            self._start = self._emitted = len(self.text) - len(self.text.lstrip())
+        self.done = True
+        return self._advance(len(self.text))
+
+    def _advance(self, end):
+        if end <= self._emitted:
+            return ""
+        chunk = self.text[self._emitted:end]
+        self._emitted = end
+        return chunk
+
+
+def sse_event(event, data):
+    """One Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,97 @@
+# chat/suggestion_engine.py
+import time
+from collections import Counter
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.apps import apps
+
+print("--- Loading chat/suggestion_engine.py ---")
+
+
+class EmbeddingSuggestionEngine:
+    """
+    Suggests products without an LLM call: the user's recent messages are
+    embedded (through the shared embedding cache) and folded into one interest
+    vector, newest messages weighted most (decay per step back). Products are
+    scored against the vectors of the index ChatConfig built at startup, then
+    picked greedily with a per-category penalty, so the list spreads across
+    categories instead of repeating the closest one.
+    Returns None (callers fall back to the LLM) when the index isn't ready or
+    the match is weak: the best score must beat the catalog average by
+    min_margin.
+    """
+
+    def __init__(self, limit=4, min_margin=0.05, category_penalty=0.05, decay=0.8):
+        self.limit = limit
+        self.min_margin = min_margin
+        self.category_penalty = category_penalty
+        self.decay = decay
+
+    def _components(self):
+        """(embeddings, product index) once the LangChain warm-up is done; None before (never blocks a request)."""
+        app_config = apps.get_app_config('chat')
+        index = app_config.product_index
+        if app_config.startup_state != "ready" or app_config.embeddings is None or not hasattr(index, "vector_arrays"):
+            return None
+        return app_config.embeddings, index
+
+    def profile(self, vectors):
+        """Recency-weighted mean of L2-normalized message vectors (newest first), normalized."""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        weights = self.decay ** np.arange(len(matrix), dtype=np.float32)
+        profile = (matrix / norms * weights[:, None]).sum(axis=0)
+        norm = np.linalg.norm(profile)
+        return profile / norm if norm else profile
+
+    def rank(self, profile, vector_arrays, catalog):
+        """[{"name": ...}] for the best products in catalog, or None if the match is not confident."""
+        matrix, ids, categories = vector_arrays
+        if not len(ids) or matrix.shape[1] != profile.shape[0]:
+            return None
+        scores = matrix @ profile
+        margin = float(scores.max() - scores.mean())
+        if margin < self.min_margin:
+            print(f"suggestion_engine: Low confidence (margin {margin:.3f}), deferring to the LLM.")
+            return None
+
+        candidates = np.argsort(-scores)[: self.limit * 5]
+        used = Counter()
+        picked = []
+        while len(picked) < self.limit and len(candidates):
+            adjusted = scores[candidates] - self.category_penalty * np.array([used[categories[row]] for row in candidates])
+            best = int(np.argmax(adjusted))
+            row = candidates[best]
+            candidates = np.delete(candidates, best)
+            entry = catalog.by_id.get(int(ids[row]))
+            if entry is None:
+                continue  # Vector of a product that is gone from the current catalog
+            used[categories[row]] += 1
+            picked.append({"name": entry.name})
+        return picked or None
+
+    def suggest(self, history, catalog):
+        """Suggestions for history (user messages, newest first) or None to use the LLM instead."""
+        components = self._components()
+        if components is None or not history:
+            return None
+        embeddings, index = components
+        started = time.perf_counter()
+        suggestions = self.rank(self.profile(embeddings.embed_documents(history)), index.vector_arrays(), catalog)
+        print(f"suggestion_engine: Ranked products in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return suggestions
+
+    async def asuggest(self, history, catalog):
+        components = self._components()
+        if components is None or not history:
+            return None
+        embeddings, index = components
+        started = time.perf_counter()
+        vectors = await embeddings.aembed_documents(history)
+        # Off the loop: a Chroma index reads its vectors from disk after each product change
+        vector_arrays = await sync_to_async(index.vector_arrays, thread_sensitive=False)()
+        suggestions = self.rank(self.profile(vectors), vector_arrays, catalog)
+        print(f"suggestion_engine: Ranked products in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return suggestions
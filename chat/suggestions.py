@@ -0,0 +1,239 @@
+# chat/suggestions.py
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .catalog import product_catalog
+from .models import ChatHistory
+from .openai_clients import get_async_openai_client, get_openai_client
+from .suggestion_engine import EmbeddingSuggestionEngine
+
+print("--- Loading chat/suggestions.py ---")
+
+HISTORY_MESSAGES = 15
+
+
+def suggestion_prompt(available_products, history):
+    return f"""You are an AI assistant designed to suggest products to users based on their past chat history. Your goal is to provide up to 4 relevant product names from the following list of available products: {', '.join(available_products)}.
+
+Consider the user's past chat history to understand their interests and preferences. If the chat history does not provide clear product interests, suggest general popular products from the available list.
+
+Chat History:
+{history}
+
+Provide your suggestions as a numbered list of product names. If you cannot find any suitable products, return an empty list.
+Product Suggestions:"""
+
+
+def _completion_kwargs(prompt):
+    return dict(
+        model="gpt-4-turbo",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=150,
+        n=1,
+        stop=None,
+        temperature=0.6,
+    )
+
+
+def _user_messages(user_id):
+    return ChatHistory.objects.filter(user_id=user_id, role="user").order_by('-timestamp', '-id')
+
+
+class SuggestionCache:
+    """
+    Per-user product suggestions, valid for (id of the user's latest "user"
+    ChatHistory row, catalog version): as long as neither changes, page loads
+    are served from memory without calling the model. Concurrent requests for
+    the same key share one computation, sync and async callers alike. The
+    embedding engine (chat/suggestion_engine.py) answers when it is confident;
+    otherwise the model picks from the product list. When new
+    user turns are saved, users with cached suggestions get them recomputed in
+    the background (refresh_later), so the next page load is a cache read.
+    """
+
+    def __init__(self, engine=None, max_users=10000, refresh_workers=2):
+        self.engine = engine
+        self.max_users = max_users
+        self.refresh_workers = refresh_workers
+        self._entries = OrderedDict()  # user_id -> (key, suggestions)
+        self._inflight = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self._executor = None
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "errors": 0, "local": 0, "llm": 0}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key[0])
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(key[0])
+                self.counters["hits"] += 1
+                return entry[1]
+            return None
+
+    def _store(self, key, suggestions):
+        with self._lock:
+            current = self._entries.get(key[0])
+            if current is not None and current[0][1] > key[1]:
+                return  # A newer turn's suggestions landed first
+            self._entries[key[0]] = (key, suggestions)
+            self._entries.move_to_end(key[0])
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def _join(self, key):
+        """(future, owner): owner is True if the caller must compute key and resolve the future."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            self.counters["misses"] += 1
+            return future, True
+
+    def _finish(self, key, future, suggestions=None, error=None):
+        if error is None:
+            self._store(key, suggestions)
+            future.set_result(suggestions)
+        else:
+            with self._lock:
+                self.counters["errors"] += 1
+            future.set_exception(error)
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def get(self, user_id):
+        """Suggestions ([{"name": ...}]) for user_id; [] without chat history. Raises if the model call fails."""
+        catalog = product_catalog.snapshot()
+        latest_id = _user_messages(user_id).values_list('id', flat=True).first()
+        if latest_id is None:
+            return []
+        # catalog.version hashes the catalog content, so entries survive TTL reloads of an unchanged catalog
+        key = (user_id, latest_id, catalog.version)
+        suggestions = self._lookup(key)
+        if suggestions is not None:
+            return suggestions
+        future, owner = self._join(key)
+        if not owner:
+            return future.result()
+        try:
+            history = [message.content for message in _user_messages(user_id).only('content')[:HISTORY_MESSAGES]]
+            suggestions = self._local(history, catalog) if self.engine else None
+            if suggestions is None:
+                response = get_openai_client().chat.completions.create(**_completion_kwargs(suggestion_prompt(catalog.names, history)))
+                suggestions = self._parse(catalog, response)
+        except BaseException as e:
+            # Waiters on this key must not hang, whatever stopped the computation
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, suggestions)
+        return suggestions
+
+    async def aget(self, user_id):
+        """Async variant of get() using the async ORM and AsyncOpenAI."""
+        catalog = await product_catalog.asnapshot()
+        latest_id = await _user_messages(user_id).values_list('id', flat=True).afirst()
+        if latest_id is None:
+            return []
+        key = (user_id, latest_id, catalog.version)
+        suggestions = self._lookup(key)
+        if suggestions is not None:
+            return suggestions
+        future, owner = self._join(key)
+        if owner:
+            # A task of its own, so a waiter going away doesn't cancel the computation for the others
+            asyncio.get_running_loop().create_task(self._acompute(key, catalog, future))
+        # Shielded: cancelling this waiter must not cancel the future the other waiters share
+        waiter = asyncio.wrap_future(future)
+        waiter.add_done_callback(lambda done: done.cancelled() or done.exception())  # Retrieved even if we left
+        return await asyncio.shield(waiter)
+
+    async def _acompute(self, key, catalog, future):
+        try:
+            history = [message.content async for message in _user_messages(key[0]).only('content')[:HISTORY_MESSAGES]]
+            suggestions = await self._alocal(history, catalog) if self.engine else None
+            if suggestions is None:
+                response = await get_async_openai_client().chat.completions.create(
+                    **_completion_kwargs(suggestion_prompt(catalog.names, history))
+                )
+                suggestions = self._parse(catalog, response)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            return
+        except BaseException as e:
+            # Cancelled (e.g. at loop shutdown): fail the waiters instead of leaving them pending
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, suggestions)
+
+    def _local(self, history, catalog):
+        # Engine failures (e.g. the embedding API) only cost the fast path
+        try:
+            suggestions = self.engine.suggest(history, catalog)
+        except Exception as e:
+            print(f"suggestions: Embedding engine failed, using the LLM: {e}")
+            suggestions = None
+        self.counters["llm" if suggestions is None else "local"] += 1
+        return suggestions
+
+    async def _alocal(self, history, catalog):
+        try:
+            suggestions = await self.engine.asuggest(history, catalog)
+        except Exception as e:
+            print(f"suggestions: Embedding engine failed, using the LLM: {e}")
+            suggestions = None
+        self.counters["llm" if suggestions is None else "local"] += 1
+        return suggestions
+
+    @staticmethod
+    def _parse(catalog, response):
+        suggestion_text = response.choices[0].message.content.strip()
+        # Numbered list lines, markdown bold and " - description" tails are handled by the matcher
+        return [{"name": product["name"]} for product in catalog.matcher.suggested_products(suggestion_text, limit=4)]
+
+    def refresh_later(self, user_ids):
+        """Recompute suggestions in the background for those of user_ids that have cached suggestions."""
+        with self._lock:
+            user_ids = [user_id for user_id in set(user_ids) if user_id in self._entries]
+            if not user_ids or self.refresh_workers <= 0:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.refresh_workers, thread_name_prefix="chat-suggestions")
+            self.counters["refreshes"] += len(user_ids)
+        for user_id in user_ids:
+            self._executor.submit(self._refresh, user_id)
+
+    def _refresh(self, user_id):
+        try:
+            self.get(user_id)
+        except Exception as e:
+            print(f"suggestions: Background refresh failed for user {user_id}: {e}")
+        finally:
+            close_old_connections()
+
+    def history_flushed(self, rows):
+        """HistoryWriter flush listener: new user turns make cached suggestions stale."""
+        self.refresh_later(row.user_id for row in rows if row.role == "user")
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        return dict(
+            self.counters,
+            users=len(self._entries),
+            hit_rate=round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+        )
+
+
+suggestion_cache = SuggestionCache(
+    engine=EmbeddingSuggestionEngine(
+        min_margin=settings.CHAT_SUGGESTIONS_MIN_MARGIN,
+        category_penalty=settings.CHAT_SUGGESTIONS_CATEGORY_PENALTY,
+    ) if settings.CHAT_SUGGESTIONS_ENGINE == "embeddings" else None,
+    max_users=settings.CHAT_SUGGESTIONS_CACHE_USERS,
+    refresh_workers=settings.CHAT_SUGGESTIONS_REFRESH_WORKERS,
+)
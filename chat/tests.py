@@ -0,0 +1,479 @@
+import asyncio
+import struct
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from .assistant_runs import run_and_wait
+from .audio_frames import FLAG_FINAL, HEADER, decode_audio_frame, encode_audio_frames, session_bytes
+from .catalog import CatalogEntry, product_catalog
+from .history import _select_window
+from .history_writer import HistoryWriter
+from .matcher import ProductNameMatcher
+from .models import ChatHistory, Product
+from .response_cache import ResponseCache
+from .retrievers import BM25Index, HybridProductIndex
+from .services.tts_pipeline import SentenceTTSPipeline
+from .streaming import ResponseStreamSplitter
+from .suggestions import SuggestionCache
+from .threads import ThreadResolver
+from .views import encode_history_cursor
+
+
+class ChatHistoryIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='pw')
+        other = User.objects.create_user(username='bob', password='pw')
+        ChatHistory.objects.bulk_create(
+            [ChatHistory(user=cls.user, role='user', content=f'message {i}') for i in range(50)]
+            + [ChatHistory(user=other, role='user', content=f'message {i}') for i in range(50)]
+        )
+
+    def test_history_page_uses_user_timestamp_index(self):
+        queryset = ChatHistory.objects.filter(user=self.user).order_by('-timestamp', '-id')
+        if connection.vendor == 'postgresql':
+            # Tiny test tables make a sequential scan cheaper; ask which index the planner would use
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn('chathistory_user_ts_idx', plan)
+
+
+class ChatHistoryViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='pw')
+        ChatHistory.objects.bulk_create(
+            [ChatHistory(user=cls.user, role='user' if i % 2 else 'assistant', content=f'message {i}') for i in range(5)]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_backwards_with_cursor(self):
+        first = self.client.get('/api/chat/history/', {'limit': 3}).json()
+        self.assertEqual(len(first['results']), 3)
+        self.assertTrue(first['has_more'])
+        second = self.client.get('/api/chat/history/', {'limit': 3, 'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(second['results']), 2)
+        self.assertFalse(second['has_more'])
+        ids = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_since_returns_newer_rows_oldest_first(self):
+        rows = list(ChatHistory.objects.order_by('timestamp', 'id'))
+        response = self.client.get('/api/chat/history/', {'since': encode_history_cursor(rows[1].timestamp, rows[1].id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], [row.id for row in rows[2:]])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/chat/history/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_since_is_rejected(self):
+        response = self.client.get('/api/chat/history/', {'since': '%%%'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_limit_is_rejected(self):
+        self.assertEqual(self.client.get('/api/chat/history/', {'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/chat/history/', {'limit': 0}).status_code, 400)
+
+
+class AudioFrameTests(SimpleTestCase):
+    session_id = str(uuid.uuid4())
+
+    def test_header_layout(self):
+        self.assertEqual(HEADER.size, 26)
+        frame = encode_audio_frames(session_bytes(self.session_id), 7, b"abc", "audio/wav", 1024)[0]
+        version, flags, mime, pad, seq, part = struct.unpack_from("!BBBBIH", frame)
+        self.assertEqual((version, flags, mime, pad, seq, part), (1, FLAG_FINAL, 2, 0, 7, 0))
+        self.assertEqual(frame[10:26], uuid.UUID(self.session_id).bytes)
+        self.assertEqual(frame[26:], b"abc")
+
+    def test_round_trip_across_frames(self):
+        audio = bytes(range(256)) * 5
+        frames = encode_audio_frames(session_bytes(self.session_id), 3, audio, "audio/mpeg", 500)
+        self.assertEqual(len(frames), 3)
+        decoded = [decode_audio_frame(frame) for frame in frames]
+        self.assertEqual({(session, seq, mime) for session, seq, _, _, mime, _ in decoded}, {(self.session_id, 3, "audio/mpeg")})
+        self.assertEqual([part for _, _, part, _, _, _ in decoded], [0, 1, 2])
+        self.assertEqual([final for _, _, _, final, _, _ in decoded], [False, False, True])
+        self.assertEqual(b"".join(payload for *_, payload in decoded), audio)
+
+    def test_empty_audio_and_unknown_mime(self):
+        (frame,) = encode_audio_frames(session_bytes(self.session_id), 0, b"", "audio/flac", 500)
+        self.assertEqual(decode_audio_frame(frame)[3:], (True, "", b""))
+
+    def test_non_uuid_session_falls_back_to_json(self):
+        # The consumer sends base64 JSON tts_chunk events when there are no session bytes
+        self.assertIsNone(session_bytes("voice-session-1"))
+        self.assertEqual(session_bytes(uuid.UUID(self.session_id)), uuid.UUID(self.session_id).bytes)
+
+    def test_unknown_version_is_rejected(self):
+        frame = bytearray(encode_audio_frames(session_bytes(self.session_id), 0, b"x", "audio/wav", 10)[0])
+        frame[0] = 9
+        with self.assertRaises(ValueError):
+            decode_audio_frame(bytes(frame))
+
+
+class ProductNameMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.matcher = ProductNameMatcher([
+            CatalogEntry(1, "Pen", "Office", 2),
+            CatalogEntry(2, "Red Shoe", "Shoes", 50),
+            CatalogEntry(3, "Red Shoe Pro", "Shoes", 80),
+            CatalogEntry(4, "Blue Bag", "Bags", 30),
+        ])
+
+    def names(self, text):
+        return [entry.name for _, _, entry in self.matcher.find_all(text)]
+
+    def test_matches_only_on_word_boundaries(self):
+        self.assertEqual(self.names("A penguin will open the Pen."), ["Pen"])
+
+    def test_prefers_the_longest_name(self):
+        self.assertEqual(self.names("Try the red shoe pro today"), ["Red Shoe Pro"])
+
+    def test_markdown_and_list_lines(self):
+        text = "**Suggested Products:**\n1. **Red Shoe** - comfy\n- Blue\xa0Bag\n* blue   bag again"
+        self.assertEqual([entry.name for entry in self.matcher.match_lines(text)], ["Red Shoe", "Blue Bag"])
+
+    def test_suggested_products_excludes_and_limits(self):
+        text = "- Pen\n- Red Shoe\n- Blue Bag"
+        self.assertEqual(self.matcher.suggested_products(text, exclude=["pen"], limit=1),
+                         [{"name": "Red Shoe", "category": "Shoes"}])
+
+
+class _FakeEmbeddings:
+    """Two-dimensional vectors from text length; embed_query can be disabled to prove it isn't called."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        return [[len(text), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.queries += 1
+        return [len(text), 1.0]
+
+
+def _product(pk, name, category, description, price=10.0):
+    return SimpleNamespace(pk=pk, name=name, category=category, description=description, price=price)
+
+
+class HybridProductIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.embeddings = _FakeEmbeddings()
+        self.index = HybridProductIndex(self.embeddings, alpha=0.5)
+        self.index.sync([
+            _product(1, "Trail Runner", "Shoes", "Lightweight running shoe for trails"),
+            _product(2, "City Walker", "Shoes", "Casual shoe for walking in town"),
+            _product(3, "Travel Pack XB-200", "Bags", "Carry-on backpack with laptop sleeve", price=90.0),
+        ])
+
+    def names(self, results):
+        return [document.metadata["name"] for document, _ in results]
+
+    def test_bm25_ranks_term_matches_first(self):
+        bm25 = BM25Index(["running shoe running", "walking shoe", "backpack"])
+        scores = bm25.scores("running shoe")
+        self.assertEqual(list(scores.argsort()[::-1]), [0, 1, 2])
+        self.assertEqual(scores[2], 0)
+
+    def test_exact_name_skips_embedding(self):
+        self.assertEqual(self.names(self.index.hybrid_search("do you have the city walker?", k=2)), ["City Walker"])
+        self.assertEqual(self.embeddings.queries, 0)
+
+    def test_sku_token_skips_embedding(self):
+        self.assertEqual(self.names(self.index.hybrid_search("price of xb-200", k=2)), ["Travel Pack XB-200"])
+        self.assertEqual(self.embeddings.queries, 0)
+
+    def test_blended_search_respects_category_and_price(self):
+        results = self.index.hybrid_search("something for running", k=3, filter={"price": {"$lte": 50}})
+        self.assertEqual(self.names(results)[0], "Trail Runner")
+        self.assertNotIn("Travel Pack XB-200", self.names(results))
+        self.assertEqual(self.index.infer_categories("any bags?"), ["Bags"])
+
+    def test_lexical_index_follows_upserts_and_deletes(self):
+        self.index.upsert(_product(4, "Summit Boot", "Shoes", "Waterproof hiking boot"))
+        self.index.delete(1)
+        self.assertEqual(self.names(self.index.hybrid_search("summit boot", k=1)), ["Summit Boot"])
+        self.assertNotIn("Trail Runner", self.names(self.index.hybrid_search("running trails", k=3)))
+
+
+class ResponseCacheTests(SimpleTestCase):
+    vectors = {
+        "recommend a laptop": [1.0, 0.0],
+        "could you recommend a laptop": [0.99, 0.05],
+        "what about headphones": [0.0, 1.0],
+    }
+
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=10, ttl=60, similarity_threshold=0.92)
+        embeddings = SimpleNamespace(embed_query=lambda query: self.vectors[query.casefold().rstrip("?!. ")])
+        self.cache._embeddings = lambda: embeddings
+
+    def test_exact_tier_ignores_case_and_punctuation(self):
+        self.cache.store("Recommend a laptop", "v1", "qa", "laptop context")
+        hit = self.cache.lookup("recommend a LAPTOP!", "v1", "qa")
+        self.assertEqual((hit.tier, hit.context, hit.response), ("exact", "laptop context", None))
+
+    def test_semantic_tier_above_threshold_only(self):
+        self.cache.store("Recommend a laptop", "v1", "qa", "laptop context")
+        self.assertEqual(self.cache.lookup("Could you recommend a laptop?", "v1", "qa").tier, "semantic")
+        self.assertIsNone(self.cache.lookup("What about headphones?", "v1", "qa"))
+
+    def test_keyed_by_catalog_version_and_mode(self):
+        self.cache.store("Recommend a laptop", "v1", "qa", "summarized context")
+        self.assertIsNone(self.cache.lookup("Recommend a laptop", "v2", "qa"))
+        self.assertIsNone(self.cache.lookup("Recommend a laptop", "v1", "context"))
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_final_response_only_for_the_same_user(self):
+        self.cache.store("Recommend a laptop", "v1", "qa", "laptop context", "Hi Alice!", user_id=1)
+        self.assertEqual(self.cache.lookup("Recommend a laptop", "v1", "qa", user_id=1).response, "Hi Alice!")
+        other = self.cache.lookup("Could you recommend a laptop", "v1", "qa", user_id=2)
+        self.assertEqual((other.context, other.response), ("laptop context", None))
+
+
+@mock.patch("chat.history.count_tokens", lambda text: len(text.split()))
+class HistoryWindowTests(SimpleTestCase):
+    # Newest first; "User: d e" costs 3 + 1 tokens, "Assistant: a b c" 4 + 1
+    rows = [(3, "assistant", "a b c"), (2, "user", "d e"), (1, "user", "f g h i")]
+
+    def test_keeps_newest_turns_within_budget(self):
+        turns, overflow_ids = _select_window(self.rows, budget=10)
+        self.assertEqual(turns, ["User: d e", "Assistant: a b c"])
+        self.assertEqual(overflow_ids, [1])
+
+    def test_everything_fits(self):
+        self.assertEqual(_select_window(self.rows, budget=100), (["User: f g h i", "User: d e", "Assistant: a b c"], []))
+
+    def test_newest_turn_kept_even_over_budget(self):
+        self.assertEqual(_select_window(self.rows, budget=1), (["Assistant: a b c"], [2, 1]))
+
+    def test_pending_rows_never_reported_as_overflow(self):
+        turns, overflow_ids = _select_window([(None, "user", "x y z")] + self.rows, budget=5)
+        self.assertEqual(turns, ["User: x y z"])
+        self.assertEqual(overflow_ids, [3, 2, 1])
+
+
+class HistoryWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pw')
+        self.writer = HistoryWriter(batch_size=2, flush_interval=60, max_attempts=2, max_buffer=4)
+        self.writer._ensure_thread = lambda: None  # Flush from the test instead of the background thread
+
+    def test_flush_writes_in_batches_and_order(self):
+        flushed = []
+        self.writer.add_flush_listener(flushed.append)
+        for i in range(3):
+            self.writer.enqueue(self.user, 'user', f'message {i}')
+        self.assertEqual(len(self.writer.pending_for(self.user.id)), 3)
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual([len(batch) for batch in flushed], [2, 1])
+        self.assertEqual(list(ChatHistory.objects.order_by('id').values_list('content', flat=True)),
+                         ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(self.writer.pending_for(self.user.id), [])
+
+    def test_bad_row_is_retried_then_dead_lettered(self):
+        self.writer.enqueue(self.user, 'user', 'before')
+        self.writer.enqueue(self.user, 'user', None)  # NOT NULL violation
+        self.writer.enqueue(self.user, 'user', 'after')
+        self.writer.flush()
+        self.assertEqual(self.writer.stats["dropped"], 0)
+        # The bad row stays queued for the next flush, ahead of the rows behind it
+        self.assertEqual([row.content for row in self.writer.pending_for(self.user.id)], [None, 'after'])
+        self.writer.flush()
+        self.assertEqual(self.writer.stats["dropped"], 1)
+        self.assertEqual(len(self.writer.dead_letters), 1)
+        self.assertEqual(list(ChatHistory.objects.order_by('id').values_list('content', flat=True)), ['before', 'after'])
+
+    def test_full_buffer_drops_oldest(self):
+        for i in range(5):
+            self.writer.enqueue(self.user, 'user', f'message {i}')
+        self.assertEqual([row.content for row in self.writer.pending_for(self.user.id)],
+                         ['message 1', 'message 2', 'message 3', 'message 4'])
+        self.assertEqual(self.writer.dead_letters[0][0].content, 'message 0')
+
+
+class ResponseStreamSplitterTests(SimpleTestCase):
+    def test_drops_response_heading_split_across_deltas(self):
+        splitter = ResponseStreamSplitter()
+        deltas = ["**Resp", "onse:** Hello", " there **Sugg", "ested Products:**\n- Pen"]
+        self.assertEqual("".join(splitter.feed(delta) for delta in deltas) + splitter.flush(), "Hello there ")
+        self.assertTrue(splitter.done)
+        self.assertTrue(splitter.text.endswith("- Pen"))
+
+    def test_partial_heading_lookalike_is_released(self):
+        splitter = ResponseStreamSplitter()
+        self.assertEqual(splitter.feed("Answer with a star *"), "Answer with a star ")
+        self.assertEqual(splitter.feed("* not a heading"), "** not a heading")
+        self.assertEqual(splitter.flush(), "")
+
+
+class SentenceTTSPipelineTests(SimpleTestCase):
+    async def test_chunks_sent_in_sentence_order(self):
+        sent = []
+
+        async def synthesize(sentence):
+            # Earlier sentences finish last, so ordering can't come from completion order
+            await asyncio.sleep(0.03 if sentence.startswith("First") else 0)
+            return sentence.encode(), "audio/wav"
+
+        async def send_chunk(seq, audio, mime):
+            sent.append((seq, audio.decode()))
+
+        pipeline = SentenceTTSPipeline(synthesize, send_chunk, max_parallel=3, min_chars=5)
+        pipeline.feed("First sentence here. Sec")
+        pipeline.feed("ond one! Third")
+        self.assertEqual(await pipeline.finish(), 3)
+        self.assertEqual(sent, [(0, "First sentence here."), (1, "Second one!"), (2, "Third")])
+
+
+class _FakeRuns:
+    def __init__(self, listed=(), statuses=("completed",)):
+        self.listed = list(listed)
+        self.statuses = list(statuses)
+        self.created = 0
+        self.cancelled = []
+
+    def create(self, thread_id, assistant_id, stream=False, **kwargs):
+        self.created += 1
+        if stream:
+            raise ConnectionError("stream dropped")
+        return SimpleNamespace(id="run_new", status="queued", created_at=int(time.time()))
+
+    def list(self, thread_id, order, limit):
+        return SimpleNamespace(data=self.listed)
+
+    def retrieve(self, thread_id, run_id):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return SimpleNamespace(id=run_id, status=status, created_at=int(time.time()))
+
+    def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+        return SimpleNamespace(id=run_id, status="cancelling", created_at=int(time.time()))
+
+
+def _fake_client(runs):
+    return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs)))
+
+
+@override_settings(CHAT_ASSISTANT_POLL_INITIAL=0.001, CHAT_ASSISTANT_POLL_MAX=0.001)
+class RunWaiterTests(SimpleTestCase):
+    @override_settings(CHAT_ASSISTANT_RUN_STREAMING=True)
+    def test_failed_stream_polls_the_run_it_created(self):
+        started = SimpleNamespace(id="run_started", status="in_progress", created_at=int(time.time()))
+        runs = _FakeRuns(listed=[started], statuses=["in_progress", "completed"])
+        run = run_and_wait(_fake_client(runs), "thread", "assistant", timeout=5)
+        self.assertEqual((run.id, run.status), ("run_started", "completed"))
+        self.assertEqual(runs.created, 1)  # No second run on the thread
+
+    @override_settings(CHAT_ASSISTANT_RUN_STREAMING=True)
+    def test_failed_stream_without_run_falls_back_to_create(self):
+        old = SimpleNamespace(id="run_old", status="completed", created_at=int(time.time()) - 3600)
+        runs = _FakeRuns(listed=[old])
+        run = run_and_wait(_fake_client(runs), "thread", "assistant", timeout=5)
+        self.assertEqual((run.id, run.status, runs.created), ("run_new", "completed", 2))
+
+    @override_settings(CHAT_ASSISTANT_RUN_STREAMING=False)
+    def test_run_past_deadline_is_cancelled(self):
+        runs = _FakeRuns(statuses=["in_progress"])
+        run = run_and_wait(_fake_client(runs), "thread", "assistant", timeout=0.02)
+        self.assertEqual(runs.cancelled, ["run_new"])
+        self.assertEqual(run.status, "cancelling")
+
+
+class ThreadResolverTests(SimpleTestCase):
+    def setUp(self):
+        self.resolver = ThreadResolver(pool=None, ttl=60)
+        self.user = SimpleNamespace(pk=1, username="alice")
+        self.calls = 0
+
+    def test_concurrent_resolves_share_one_creation(self):
+        def load_or_create(user, client):
+            self.calls += 1
+            time.sleep(0.05)
+            return "thread_1"
+
+        self.resolver._load_or_create = load_or_create
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(self.resolver.resolve(self.user, None))) for _ in range(5)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual((self.calls, results), (1, ["thread_1"] * 5))
+        self.assertEqual(self.resolver._inflight, {})
+
+    def test_failure_reaches_every_waiter_and_is_not_cached(self):
+        def load_or_create(user, client):
+            self.calls += 1
+            raise RuntimeError("api down")
+
+        self.resolver._load_or_create = load_or_create
+        with self.assertRaises(RuntimeError):
+            self.resolver.resolve(self.user, None)
+        with self.assertRaises(RuntimeError):
+            self.resolver.resolve(self.user, None)
+        self.assertEqual(self.calls, 2)
+
+    async def test_async_waiter_cancellation_does_not_cancel_others(self):
+        async def aload_or_create(user, client):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return "thread_1"
+
+        self.resolver._aload_or_create = aload_or_create
+        first = asyncio.create_task(self.resolver.aresolve(self.user, None))
+        second = asyncio.create_task(self.resolver.aresolve(self.user, None))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertEqual(await second, "thread_1")
+        self.assertEqual(self.calls, 1)
+
+
+class SuggestionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='pw')
+        Product.objects.create(name='Trail Runner', category='Shoes', price=80, description='Running shoe')
+        ChatHistory.objects.create(user=cls.user, role='user', content='I like running')
+
+    def setUp(self):
+        product_catalog.invalidate()
+        product_catalog.snapshot()  # Loaded here, so async lookups hit the cache
+        self.addCleanup(product_catalog.invalidate)
+        self.cache = SuggestionCache(engine=None, max_users=10, refresh_workers=0)
+        self.calls = 0
+
+    def test_stale_key_never_replaces_newer_suggestions(self):
+        self.cache._store((1, 5, "v"), [{"name": "New"}])
+        self.cache._store((1, 3, "v"), [{"name": "Old"}])
+        self.assertEqual(self.cache._lookup((1, 5, "v")), [{"name": "New"}])
+        self.assertIsNone(self.cache._lookup((1, 3, "v")))
+
+    async def test_concurrent_misses_share_one_model_call(self):
+        async def create(**kwargs):
+            self.calls += 1
+            await asyncio.sleep(0.02)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="1. **Trail Runner**"))])
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with mock.patch("chat.suggestions.get_async_openai_client", return_value=client):
+            results = await asyncio.gather(*(self.cache.aget(self.user.id) for _ in range(3)))
+            self.assertEqual(results, [[{"name": "Trail Runner"}]] * 3)
+            self.assertEqual(await self.cache.aget(self.user.id), [{"name": "Trail Runner"}])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((self.cache.counters["coalesced"], self.cache.counters["hits"]), (2, 1))
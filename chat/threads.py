@@ -0,0 +1,351 @@
+# chat/threads.py
+import asyncio
+import contextlib
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .catalog import product_catalog
+from .models import AssistantThread, PrewarmedThread
+from .openai_clients import get_openai_client
+
+print("--- Loading chat/threads.py ---")
+
+
+def initial_context_message(available_products):
+    """
+    First message of every new Assistants thread: the persona, answer format and product list.
+    The only builder for every endpoint, so pooled threads (keyed by its version) fit them all.
+    """
+    products_formatted = "\n".join([f"- {product}" for product in available_products])
+    return f"""You are a helpful AI assistant for suggesting products. Your goal is to suggest relevant products from the following list: {', '.join(available_products)}. When the user asks for product suggestions, understand the category and suggest up to 3 products. Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. Remember the user's name if provided.\n\nAvailable Products:\n{products_formatted}"""
+
+
+def delete_thread(client, thread_id):
+    try:
+        client.beta.threads.delete(thread_id)
+    except Exception as e:
+        print(f"threads: Could not delete thread {thread_id}: {e}")
+
+
+async def adelete_thread(client, thread_id):
+    try:
+        await client.beta.threads.delete(thread_id)
+    except Exception as e:
+        print(f"threads: Could not delete thread {thread_id}: {e}")
+
+
+def context_version(context):
+    """Identifies an initial context message, so pooled threads primed with an older catalog are never handed out."""
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()[:32]
+
+
+class ThreadPool:
+    """
+    Pool of Assistants threads created ahead of time and already primed with
+    the initial context, so a first-time user claims one instead of waiting on
+    threads.create() plus the large context message.
+    Rows live in PrewarmedThread, tagged with the context_version they were
+    primed with; claims take the oldest matching row with SELECT ... FOR UPDATE
+    SKIP LOCKED so concurrent workers never get the same thread. A background
+    thread tops the pool up to size after claims, retires threads primed with
+    an outdated catalog when products change, and rechecks every
+    refill_interval seconds (catalog changes made by other processes).
+    Refills are serialized across processes with a PostgreSQL advisory lock,
+    so N workers don't fill the pool to N x size. Rows also record when their
+    catalog was read, and only rows built from an older catalog read than this
+    process's are retired; a worker whose cached catalog is older than rows it
+    finds reloads its catalog instead of fighting over the pool.
+    """
+
+    # pg_advisory_lock key for refills ("chatpool" in ASCII)
+    REFILL_LOCK_KEY = 0x63686174706F6F6C
+
+    def __init__(self, size=5, refill_interval=60):
+        self.size = size
+        self.refill_interval = refill_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.counters = {"claimed": 0, "misses": 0, "created": 0, "retired": 0, "errors": 0}
+
+    def start(self):
+        """Run the refill thread in this process (called from ChatConfig.ready for serving processes)."""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chat-thread-pool", daemon=True)
+                self._thread.start()
+                print(f"threads: Thread pool refill started (size {self.size}).")
+
+    def request_refill(self):
+        """Wake the refill thread, if this process runs one."""
+        if self._thread is not None:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"threads: Error refilling thread pool: {e}")
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+
+    def claim(self, version):
+        """thread_id of a pooled thread primed with context version, removed from the pool; None if empty."""
+        if self.size <= 0:
+            return None
+        with transaction.atomic():
+            row = (PrewarmedThread.objects.select_for_update(skip_locked=True)
+                   .filter(context_version=version).order_by("created_at").first())
+            if row is not None:
+                row.delete()
+        self.request_refill()
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["claimed"] += 1
+        return row.thread_id
+
+    async def aclaim(self, version):
+        if self.size <= 0:
+            return None
+        return await sync_to_async(self.claim, thread_sensitive=False)(version)
+
+    @contextlib.contextmanager
+    def _refill_lock(self):
+        """True if this process may refill now: it holds the advisory lock (or the DB has none)."""
+        if connection.vendor != "postgresql":
+            yield True  # No cross-process lock available; each process refills on its own
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.REFILL_LOCK_KEY])
+            acquired = cursor.fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [self.REFILL_LOCK_KEY])
+
+    def refill(self, client=None):
+        """Retire threads primed with an outdated catalog and create new ones up to size."""
+        with self._refill_lock() as acquired:
+            if not acquired:
+                return  # Another worker is refilling
+            client = client or get_openai_client()
+            snapshot = product_catalog.snapshot()
+            if PrewarmedThread.objects.filter(catalog_loaded_at__gt=snapshot.loaded_at).exclude(
+                    context_version=context_version(initial_context_message(snapshot.names))).exists():
+                # Another worker saw a newer catalog than our cached one
+                product_catalog.invalidate()
+                snapshot = product_catalog.snapshot()
+            context = initial_context_message(snapshot.names)
+            version = context_version(context)
+            self.retire(client, version, snapshot.loaded_at)
+            missing = self.size - PrewarmedThread.objects.filter(context_version=version).count()
+            for _ in range(missing):
+                thread_id = client.beta.threads.create().id
+                try:
+                    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=context)
+                    PrewarmedThread.objects.create(thread_id=thread_id, context_version=version,
+                                                   catalog_loaded_at=snapshot.loaded_at)
+                except Exception:
+                    delete_thread(client, thread_id)
+                    raise
+                self.counters["created"] += 1
+            if missing > 0:
+                print(f"threads: Added {missing} pre-warmed threads (context {version[:8]}).")
+
+    def retire(self, client, current_version, loaded_at):
+        """Drop pooled threads primed from a catalog read before loaded_at with another context, deleting them on the API side."""
+        with transaction.atomic():
+            stale = list(PrewarmedThread.objects.select_for_update(skip_locked=True)
+                         .filter(catalog_loaded_at__lt=loaded_at)
+                         .exclude(context_version=current_version).values_list("pk", "thread_id"))
+            PrewarmedThread.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+        for _, thread_id in stale:
+            delete_thread(client, thread_id)
+        if stale:
+            self.counters["retired"] += len(stale)
+            print(f"threads: Retired {len(stale)} pre-warmed threads primed with an old catalog.")
+
+    def stats(self):
+        return dict(self.counters, size=self.size)
+
+
+class ThreadResolver:
+    """
+    user -> OpenAI Assistants thread id, backed by the AssistantThread table.
+    Lookups are served from an in-process cache for ttl seconds. Creation is
+    single-flight per user: concurrent callers (several tabs, a reconnect
+    storm), sync and async alike, wait on one shared future instead of each
+    making a thread, and no lock is held across network calls.
+    A thread is only recorded once it is primed (pre-warmed from the pool, or
+    created and sent the initial context), so nobody is ever handed an
+    unprimed thread. Across processes the unique user column decides the
+    winner and the loser deletes the thread it created or claimed.
+    """
+
+    def __init__(self, pool, ttl=300):
+        self.pool = pool
+        self.ttl = ttl
+        self._cache = {}  # user_id -> (thread_id, expires_at)
+        self._inflight = {}  # user_id -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self.counters = {"cache_hits": 0, "db_hits": 0, "pooled": 0, "created": 0, "lost_races": 0}
+
+    def cached(self, user_id):
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._cache[user_id]
+                return None
+            self.counters["cache_hits"] += 1
+            return entry[0]
+
+    def _remember(self, user_id, thread_id):
+        with self._lock:
+            self._cache[user_id] = (thread_id, time.monotonic() + self.ttl)
+        return thread_id
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    def _join(self, user_id):
+        """(future, owner): owner is True if the caller must resolve user_id and complete the future."""
+        with self._lock:
+            future = self._inflight.get(user_id)
+            if future is not None:
+                return future, False
+            future = self._inflight[user_id] = Future()
+            return future, True
+
+    def _finish(self, user_id, future, thread_id=None, error=None):
+        with self._lock:
+            self._inflight.pop(user_id, None)
+        if error is None:
+            future.set_result(thread_id)
+        else:
+            future.set_exception(error)
+
+    def _found(self, user_id, thread_id):
+        self.counters["db_hits"] += 1
+        return self._remember(user_id, thread_id)
+
+    def _recorded(self, user, thread_id, record, created, primed):
+        """Bookkeeping after get_or_create. Returns (thread id to use, orphan thread id to delete or None)."""
+        if not created:
+            # Another process stored a thread for this user first; ours is an orphan
+            self.counters["lost_races"] += 1
+            print(f"threads: Lost thread creation race, deleting orphan thread {thread_id}.")
+            return self._remember(user.pk, record.thread_id), thread_id
+        self.counters["pooled" if primed else "created"] += 1
+        print(f"threads: Thread {thread_id} assigned to user {user.username} ({'pre-warmed' if primed else 'new'}).")
+        return self._remember(user.pk, thread_id), None
+
+    def resolve(self, user, client):
+        """Thread id for user, creating (and priming) the thread with a sync OpenAI client if needed."""
+        thread_id = self.cached(user.pk)
+        if thread_id:
+            return thread_id
+        future, owner = self._join(user.pk)
+        if not owner:
+            return future.result()
+        try:
+            thread_id = self._load_or_create(user, client)
+        except BaseException as e:
+            self._finish(user.pk, future, error=e)
+            raise
+        self._finish(user.pk, future, thread_id)
+        return thread_id
+
+    def _load_or_create(self, user, client):
+        existing = AssistantThread.objects.filter(user_id=user.pk).values_list("thread_id", flat=True).first()
+        if existing:
+            return self._found(user.pk, existing)
+
+        context = initial_context_message(product_catalog.snapshot().names)
+        thread_id = self.pool.claim(context_version(context))
+        primed = thread_id is not None
+        try:
+            if not primed:
+                print(f"threads: No pre-warmed thread available, creating one for user {user.username}...")
+                thread_id = client.beta.threads.create().id
+                client.beta.threads.messages.create(thread_id=thread_id, role="user", content=context)
+            record, created = AssistantThread.objects.get_or_create(user_id=user.pk, defaults={"thread_id": thread_id})
+        except BaseException:
+            if thread_id:
+                delete_thread(client, thread_id)
+            raise
+        thread_id, orphan = self._recorded(user, thread_id, record, created, primed)
+        if orphan:
+            delete_thread(client, orphan)
+        return thread_id
+
+    async def aresolve(self, user, client):
+        """Async variant of resolve() for AsyncOpenAI; shares the in-flight resolution with sync callers."""
+        thread_id = self.cached(user.pk)
+        if thread_id:
+            return thread_id
+        future, owner = self._join(user.pk)
+        if owner:
+            # A task of its own, so one caller going away doesn't cancel the resolution the others wait for
+            asyncio.get_running_loop().create_task(self._aresolve_into(user, client, future))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def _aresolve_into(self, user, client, future):
+        try:
+            thread_id = await self._aload_or_create(user, client)
+        except BaseException as e:
+            self._finish(user.pk, future, error=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self._finish(user.pk, future, thread_id)
+
+    async def _aload_or_create(self, user, client):
+        existing = await AssistantThread.objects.filter(user_id=user.pk).values_list("thread_id", flat=True).afirst()
+        if existing:
+            return self._found(user.pk, existing)
+
+        context = initial_context_message((await product_catalog.asnapshot()).names)
+        thread_id = await self.pool.aclaim(context_version(context))
+        primed = thread_id is not None
+        try:
+            if not primed:
+                print(f"threads: No pre-warmed thread available, creating one for user {user.username}...")
+                thread_id = (await client.beta.threads.create()).id
+                await client.beta.threads.messages.create(thread_id=thread_id, role="user", content=context)
+            record, created = await AssistantThread.objects.aget_or_create(user_id=user.pk, defaults={"thread_id": thread_id})
+        except BaseException:
+            if thread_id:
+                await adelete_thread(client, thread_id)
+            raise
+        thread_id, orphan = self._recorded(user, thread_id, record, created, primed)
+        if orphan:
+            await adelete_thread(client, orphan)
+        return thread_id
+
+    def stats(self):
+        return dict(self.counters, cached_users=len(self._cache))
+
+
+thread_pool = ThreadPool(size=settings.CHAT_THREAD_POOL_SIZE, refill_interval=settings.CHAT_THREAD_POOL_REFILL_INTERVAL)
+thread_resolver = ThreadResolver(thread_pool, ttl=settings.CHAT_THREAD_CACHE_TTL)
@@ -1,8 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Async-native chat endpoints (chat/async_views.py) unless CHAT_ASYNC_VIEWS is off
+if settings.CHAT_ASYNC_VIEWS:
+    suggestion_view = async_views.AsyncSuggestionView.as_view()
+    send_message_view = async_views.AsyncSendMessageView.as_view()
+else:
+    suggestion_view = views.SuggestionView.as_view()
+    send_message_view = views.SendMessageView.as_view()
 
 urlpatterns = [
     path('chat/', views.ChatView.as_view(), name='chat_view'),
-    path('api/chat/suggestions/', views.SuggestionView.as_view(), name='chat_suggestions'),
-    path('api/chat/send/', views.SendMessageView.as_view(), name='chat_send'),
+    path('api/chat/suggestions/', suggestion_view, name='chat_suggestions'),
+    path('api/chat/send/', send_message_view, name='chat_send'),
+    path('api/chat/history/', views.ChatHistoryView.as_view(), name='chat_history'),
+    path('healthz/ready', views.ReadinessView.as_view(), name='healthz_ready'),
 ]
\ No newline at end of file
@@ -0,0 +1,116 @@
+# chat/vector_index.py
+import hashlib
+
+import numpy as np
+from langchain.vectorstores import Chroma
+
+print("--- Loading chat/vector_index.py ---")
+
+
+def product_document(product):
+    """Text that gets embedded for a product (one document per product)."""
+    return f"Product Name: {product.name}\nCategory: {product.category}\nDescription: {product.description}"
+
+
+def product_metadata(product, content_hash):
+    metadata = {
+        "product_id": product.pk,
+        "name": product.name,
+        "category": product.category,
+        "content_hash": content_hash,
+    }
+    if product.price is not None:  # Chroma metadata values can't be None
+        metadata["price"] = float(product.price)
+    return metadata
+
+
+class ChromaProductIndex:
+    """
+    On-disk Chroma collection holding one vector per Product, keyed by product id.
+    Each vector stores a hash of the embedded text (and embedding model), so sync()
+    only embeds products that are new or changed since the index was written and
+    upsert()/delete() keep it current on Product save/delete.
+    """
+
+    def __init__(self, embeddings, persist_directory, collection_name="products"):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", "") or ""
+        self.store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=str(persist_directory),
+        )
+        self._vectors = None  # (matrix, ids, categories) loaded by vector_arrays()
+
+    def content_hash(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _existing_hashes(self):
+        existing = self.store.get(include=["metadatas"])
+        return {
+            doc_id: (metadata or {}).get("content_hash")
+            for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+
+    def _add(self, products):
+        if not products:
+            return
+        texts = [product_document(product) for product in products]
+        self._vectors = None
+        self.store.add_texts(
+            texts=texts,
+            metadatas=[product_metadata(product, self.content_hash(text)) for product, text in zip(products, texts)],
+            ids=[str(product.pk) for product in products],
+        )
+
+    def sync(self, products):
+        """Bring the index in line with products, embedding only new/changed ones."""
+        existing = self._existing_hashes()
+        changed = []
+        current_ids = set()
+        for product in products:
+            doc_id = str(product.pk)
+            current_ids.add(doc_id)
+            if existing.get(doc_id) != self.content_hash(product_document(product)):
+                changed.append(product)
+
+        stale_ids = [doc_id for doc_id in existing if doc_id not in current_ids]
+        if stale_ids:
+            self.store.delete(ids=stale_ids)
+            self._vectors = None
+        self._add(changed)
+        print(f"vector_index: Synced {len(current_ids)} products "
+              f"({len(changed)} embedded, {len(stale_ids)} removed, {len(current_ids) - len(changed)} reused).")
+
+    def upsert(self, product):
+        """Re-embed a single product if its indexed text changed."""
+        existing = self.store.get(ids=[str(product.pk)], include=["metadatas"])
+        stored_hash = (existing["metadatas"][0] or {}).get("content_hash") if existing["ids"] else None
+        if stored_hash != self.content_hash(product_document(product)):
+            self._add([product])
+            print(f"vector_index: Upserted product {product.pk}.")
+
+    def delete(self, product_id):
+        self.store.delete(ids=[str(product_id)])
+        self._vectors = None
+        print(f"vector_index: Deleted product {product_id}.")
+
+    def vector_arrays(self):
+        """(L2-normalized float32 matrix, product ids, categories) of every stored vector, loaded once per change."""
+        vectors = self._vectors
+        if vectors is None:
+            stored = self.store.get(include=["embeddings", "metadatas"])
+            matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+            if matrix.size:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrix = matrix / norms
+            vectors = self._vectors = (
+                matrix,
+                np.array([int(doc_id) for doc_id in stored["ids"]], dtype=np.int64),
+                np.array([(metadata or {}).get("category") for metadata in stored["metadatas"]], dtype=object),
+            )
+        return vectors
+
+    def as_retriever(self, **kwargs):
+        return self.store.as_retriever(**kwargs)
@@ -1,36 +1,42 @@
+import base64
+import binascii
 import os
-from openai import OpenAI
+from datetime import datetime
+from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated, AllowAny  # Import AllowAny
 from rest_framework.renderers import TemplateHTMLRenderer
-from .models import ChatHistory, Product
+from .models import ChatHistory
 import os
-from openai import OpenAI
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
-from .models import ChatHistory, Product
-import time
+from .models import ChatHistory
 import os
-import time
-from openai import OpenAI
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from .models import ChatHistory, Product
+from .models import ChatHistory
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
 from langchain.text_splitter import CharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
 from django.apps import apps
+from .catalog import product_catalog
+from .retrieval import retrieve_relevant_info, retrieval_mode
+from .response_cache import response_cache
+from .history import build_history_window
+from .history_writer import history_writer
+from .services.tts_cache import tts_cache
+from .openai_clients import get_openai_client
+from .assistant_runs import run_and_wait
+from .suggestions import suggestion_cache
+from .threads import thread_pool, thread_resolver
 
 class ChatView(APIView):
     renderer_classes = [TemplateHTMLRenderer]
@@ -44,6 +50,24 @@ class ChatView(APIView):
 
     def get(self, *args, **kwargs):
         return Response()
+
+
+class ReadinessView(APIView):
+    """Readiness probe: 200 once the LLM/retriever are built, 503 while warming up or after a failure."""
+
+    def get_permissions(self):
+        return [AllowAny()]
+
+    def get_authenticators(self):
+        return []
+
+    def get(self, request):
+        chat_app_config = apps.get_app_config('chat')
+        body = {"status": chat_app_config.startup_state, "response_cache": response_cache.stats(), "tts_cache": tts_cache.stats(), "threads": thread_resolver.stats(), "thread_pool": thread_pool.stats(), "suggestions": suggestion_cache.stats()}
+        if chat_app_config.startup_error:
+            body["error"] = chat_app_config.startup_error
+        ready = chat_app_config.startup_state == "ready"
+        return Response(body, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
     
 class SuggestionView(APIView):
     authentication_classes = [JWTAuthentication]
@@ -51,120 +75,79 @@ class SuggestionView(APIView):
 
     def get(self, request):
         user = request.user
-        messages = ChatHistory.objects.filter(user=user, role="user").order_by('-timestamp')[:15].values('role', 'content')
-
-        print("chat history" , messages)
-
-        if not messages:
-            return Response({"suggestions": []}, status=status.HTTP_200_OK)
+        try:
+            # Cached per (latest user message, catalog version); concurrent misses share one model call
+            suggestions = suggestion_cache.get(user.id)
+            return Response({"suggestions": suggestions}, status=status.HTTP_200_OK)
+        except Exception as e:
+            print(f"Error getting suggestions from OpenAI: {e}")
+            return Response({"suggestions": []}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        available_product_names_queryset = Product.objects.values_list('name', flat=True)
-        print("available_product_names" , available_product_names_queryset)
-        available_product_names_list = [str(name).strip().lower() for name in available_product_names_queryset]
 
-        prompt_content = f"""You are an AI assistant designed to suggest products to users based on their past chat history. Your goal is to provide up to 4 relevant product names from the following list of available products: {', '.join(available_product_names_queryset)}.
+def encode_history_cursor(timestamp, row_id):
+    """Opaque keyset cursor for a ChatHistory row: base64("<iso timestamp>|<id>")."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
 
-Consider the user's past chat history to understand their interests and preferences. If the chat history does not provide clear product interests, suggest general popular products from the available list.
 
-Chat History:
-{[msg['content'] for msg in messages]}
+def decode_history_cursor(cursor):
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(row_id)
 
-Provide your suggestions as a numbered list of product names. If you cannot find any suitable products, return an empty list.
-Product Suggestions:"""
 
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+class ChatHistoryView(APIView):
+    """
+    Keyset-paginated chat history for the current user.
+    GET ?limit=N&cursor=C  pages backwards from newest (cursor = "next_cursor" of the previous page)
+    GET ?since=C           delta mode: rows newer than cursor C, oldest first
+    Both walk the (user, timestamp, id) index instead of OFFSET scans.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
 
+    def get(self, request):
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt_content}],
-                max_tokens=150,
-                n=1,
-                stop=None,
-                temperature=0.6,
-            )
-            print(response)
-            suggestion_text = response.choices[0].message.content.strip()
-            suggested_lines = suggestion_text.split('\n')
-            suggested_product_names = []
-            for line in suggested_lines:
-                line = line.strip()
-                if line.startswith(('1.', '2.', '3.', '4.')):
-                    parts = line.split('.', 1)[1].strip()
-                    parts = parts.replace('\xa0', ' ')
-                    if ' -' in parts:
-                        product_name = parts.split(' -')[0].strip()
-                    else:
-                        product_name = parts.strip()
-
-                    # Remove markdown bold formatting
-                    if product_name.startswith('**') and product_name.endswith('**'):
-                        product_name = product_name[2:-2].strip()
-
-                    suggested_product_names.append(product_name)
-
-            print("Extracted suggested_product_names:", suggested_product_names) # Add this for debugging
-
-            valid_suggestions = []
-            for name in suggested_product_names:
-                cleaned_suggested_name = name.strip().lower()
-                if cleaned_suggested_name in available_product_names_list:
-                    valid_suggestions.append({"name": name.strip()})
-
-            print(valid_suggestions)
-            return Response({"suggestions": valid_suggestions[:4]}, status=status.HTTP_200_OK)
-        except Exception as e:
-            print(f"Error getting suggestions from OpenAI: {e}")
-            return Response({"suggestions": []}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)        
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+            cursor = request.query_params.get('cursor')
+            since = request.query_params.get('since')
+            position = decode_history_cursor(since or cursor) if (since or cursor) else None
+        except (TypeError, ValueError, UnicodeDecodeError, binascii.Error):
+            return Response({"error": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = ChatHistory.objects.filter(user=request.user, role__in=("user", "assistant"))
+        if since:
+            timestamp, row_id = position
+            rows = rows.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=row_id)).order_by('timestamp', 'id')
+        else:
+            if position:
+                timestamp, row_id = position
+                rows = rows.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=row_id))
+            rows = rows.order_by('-timestamp', '-id')
+        page = list(rows.values('id', 'role', 'content', 'timestamp')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        next_cursor = encode_history_cursor(page[-1]['timestamp'], page[-1]['id']) if page else (since or None)
+        return Response({
+            "results": page,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+        }, status=status.HTTP_200_OK)
 
 
 class SendMessageView1(APIView):
-    def retrieve_relevant_info(self, query, retriever, llm):
-        prompt_template = """Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-        Context:
-        {context}
+    retrieval_endpoint = "send_assistant"
 
-        Question: {question}"""
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        qa = RetrievalQA.from_chain_type(
-            llm=apps.get_app_config('chat').llm,
-            chain_type="stuff",
-            retriever=apps.get_app_config('chat').retriever,
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
-        result = qa({"query": query})
-        return result['result']
+    def retrieve_relevant_info(self, query):
+        # "context" mode skips the RetrievalQA summarization call (see CHAT_RETRIEVAL_MODES)
+        return retrieve_relevant_info(query, endpoint=self.retrieval_endpoint)
 
     def handle_thread(self, user, client):
-        chat_history_entry = ChatHistory.objects.filter(user=user, thread_id__isnull=False).first()
-        thread_id = chat_history_entry.thread_id if chat_history_entry else None
-        print(f"Retrieved Thread ID from DB: {thread_id}")
-
-        if not thread_id:
-            print("Creating new thread...")
-            thread = client.beta.threads.create()
-            thread_id = thread.id
-            print(f"New Thread Created: {thread_id}")
-            ChatHistory.objects.create(user=user, role="system", content="Initial context set", thread_id=thread_id)
-
-            available_products = Product.objects.values_list('name', flat=True)
-            print(f"Available Products: {list(available_products)}")
-            products_formatted = "\n".join([f"- {product}" for product in available_products])
-            initial_context_message = f"""You are a helpful AI assistant for suggesting products. Your goal is to suggest relevant products from the following list: {', '.join(available_products)}. When the user asks for product suggestions, understand the category and suggest up to 3 products. Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. Remember the user's name if provided.\n\nAvailable Products:\n{products_formatted}"""
-            print(f"Initial Context Message:\n{initial_context_message}")
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=initial_context_message,
-            )
-            print("Initial Context Sent to Assistant.")
-        else:
-            print("Using existing thread from database.")
+        thread_id = thread_resolver.resolve(user, client)
+        print(f"Using Thread ID: {thread_id}")
         return thread_id
 
     def send_message_to_assistant(self, client, thread_id, message):
@@ -177,27 +160,16 @@ class SendMessageView1(APIView):
         print("User Message Added to Thread.")
 
     def save_user_message(self, user, message, thread_id):
-        ChatHistory.objects.create(
-            user=user,
-            role="user",
-            content=message,
-            thread_id=thread_id
-        )
-        print("User message saved to database.")
+        # Through the write-behind buffer, so turns from every endpoint commit in enqueue order
+        history_writer.enqueue(user, "user", message, thread_id=thread_id)
+        print("User message queued for the database.")
 
     def run_assistant(self, client, thread_id, assistant_id):
         print("Running the Assistant...")
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-        )
+        # Streamed run events (or adaptive polling) instead of fixed one-second polls
+        run = run_and_wait(client, thread_id, assistant_id)
         print(f"Run ID: {run.id}, Status: {run.status}")
 
-        while run.status not in ["completed", "failed", "cancelled", "expired"]:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-            print(f"Run Status Updated: {run.status}")
-
         assistant_messages = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
         return assistant_messages
 
@@ -228,10 +200,7 @@ class SendMessageView1(APIView):
                 print(f"Extracted Chatbot Response: {chatbot_response}")
 
                 if suggestions_text:
-                    suggestion_lines = [line.strip().lstrip('- ').strip() for line in suggestions_text.split('\n') if line.strip().startswith('-')]
-                    print(f"Raw Suggested Product Lines: {suggestion_lines}")
-                    available_product_names = list(Product.objects.values_list('name', flat=True))
-                    suggested_products = [{"name": name, "category": Product.objects.filter(name=name).first().category if Product.objects.filter(name=name).first() else None} for name in suggestion_lines if name in available_product_names and name not in initial_suggestions][:3]
+                    suggested_products = product_catalog.snapshot().matcher.suggested_products(suggestions_text, exclude=initial_suggestions, limit=3)
                     print(f"Filtered Suggested Products: {suggested_products}")
         return {"response": chatbot_response, "suggested_products": suggested_products}
 
@@ -250,15 +219,11 @@ class SendMessageView1(APIView):
             print("Error: Message is required")
             return Response({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        client = get_openai_client()
         assistant_id = os.environ.get("OPENAI_ASSISTANT_ID")
         print(f"Assistant ID: {assistant_id}")
 
-        chat_app_config = apps.get_app_config('chat')
-        retriever = chat_app_config.retriever
-        llm = chat_app_config.llm
-
-        retrieved_info = self.retrieve_relevant_info(user_message, retriever, llm)
+        retrieved_info = self.retrieve_relevant_info(user_message)
 
         thread_id = self.handle_thread(user, client)
 
@@ -288,40 +253,13 @@ class SendMessageView2(APIView):
             print("Error: Message is required")
             return Response({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        client = get_openai_client()
         assistant_id = os.environ.get("OPENAI_ASSISTANT_ID")
         print(f"Assistant ID: {assistant_id}")
 
-        # --- Check if a thread_id exists for the user ---
-        chat_history_entry = ChatHistory.objects.filter(user=user, thread_id__isnull=False).first()
-        thread_id = chat_history_entry.thread_id if chat_history_entry else None
-        print(f"Retrieved Thread ID from DB: {thread_id}")
-
-        if not thread_id:
-            print("Creating new thread...")
-            thread = client.beta.threads.create()
-            thread_id = thread.id
-            print(f"New Thread Created: {thread_id}")
-            # --- Store the new thread_id in the database ---
-            ChatHistory.objects.create(user=user, role="system", content="Initial context set", thread_id=thread_id)
-
-            available_products = Product.objects.values_list('name', flat=True)
-            print(f"Available Products: {list(available_products)}")
-
-            products_formatted = "\n".join([f"- {product}" for product in available_products])
-
-            initial_context_message = f"""You are a helpful AI assistant for suggesting products. Your goal is to suggest relevant products from the following list: {', '.join(available_products)}. When the user asks for product suggestions, understand the category and suggest up to 3 products. Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. Remember the user's name if provided.
-
-Past Conversation History:\n\nAvailable Products:\n{products_formatted}"""
-            print(f"Initial Context Message:\n{initial_context_message}")
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=initial_context_message,
-            )
-            print("Initial Context Sent to Assistant.")
-        else:
-            print("Using existing thread from database.")
+        # --- Resolve the user's thread (cached; created and primed on first use) ---
+        thread_id = thread_resolver.resolve(user, client)
+        print(f"Using Thread ID: {thread_id}")
 
         # --- Add Current User Message ---
         print(f"Sending to Assistant: {user_message}")
@@ -331,27 +269,14 @@ Past Conversation History:\n\nAvailable Products:\n{products_formatted}"""
             role="user",
             content=new_message,
         )
-        ChatHistory.objects.create(
-            user=user,
-            role="user",
-            content=user_message,
-            thread_id=thread_id
-        )
+        history_writer.enqueue(user, "user", user_message, thread_id=thread_id)
         print("User Message Added to Thread.")
 
         # --- Run the Assistant ---
         print("Running the Assistant...")
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-        )
+        run = run_and_wait(client, thread_id, assistant_id)
         print(f"Run ID: {run.id}, Status: {run.status}")
 
-        while run.status not in ["completed", "failed", "cancelled", "expired"]:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-            print(f"Run Status Updated: {run.status}")
-
         assistant_messages = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1) 
         chatbot_response = ""
         suggested_products = []
@@ -379,10 +304,7 @@ Past Conversation History:\n\nAvailable Products:\n{products_formatted}"""
                 print(f"Extracted Chatbot Response: {chatbot_response}")
 
                 if suggestions_text:
-                    suggestion_lines = [line.strip().lstrip('- ').strip() for line in suggestions_text.split('\n') if line.strip().startswith('-')]
-                    print(f"Raw Suggested Product Lines: {suggestion_lines}")
-                    available_product_names = list(Product.objects.values_list('name', flat=True))
-                    suggested_products = [{"name": name, "category": Product.objects.filter(name=name).first().category if Product.objects.filter(name=name).first() else None} for name in suggestion_lines if name in available_product_names and name not in initial_suggestions][:3] # Increased limit to 3
+                    suggested_products = product_catalog.snapshot().matcher.suggested_products(suggestions_text, exclude=initial_suggestions, limit=3) # Increased limit to 3
                     print(f"Filtered Suggested Products: {suggested_products}")
 
         response_data = {"response": chatbot_response, "suggested_products": suggested_products}
@@ -392,26 +314,11 @@ Past Conversation History:\n\nAvailable Products:\n{products_formatted}"""
 
 # --------using completion api model ---
 class SendMessageView(APIView):
-    def retrieve_relevant_info(self, query, retriever, llm):
-        prompt_template = """Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+    retrieval_endpoint = "send"
 
-        Context:
-        {context}
-
-        Question: {question}"""
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        qa = RetrievalQA.from_chain_type(
-            llm=apps.get_app_config('chat').llm,
-            chain_type="stuff",
-            retriever=apps.get_app_config('chat').retriever,
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
-        result = qa({"query": query})
-        return result['result']
+    def retrieve_relevant_info(self, query):
+        # "context" mode skips the RetrievalQA summarization call (see CHAT_RETRIEVAL_MODES)
+        return retrieve_relevant_info(query, endpoint=self.retrieval_endpoint)
 
     def post(self, request, *args, **kwargs):
         user = request.user
@@ -424,22 +331,29 @@ class SendMessageView(APIView):
             print("Error: Message is required")
             return Response({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        llm = apps.get_app_config('chat').llm
-        retriever = apps.get_app_config('chat').retriever
+        client = get_openai_client()
+        catalog = product_catalog.snapshot()
 
-        retrieved_info = self.retrieve_relevant_info(user_message, retriever, llm)
+        # Recent turns within the token budget, older ones folded into a rolling summary
+        formatted_history = build_history_window(user)
+        # Without history the answer depends only on the query, so this user's earlier answer can be reused
+        response_user = user.id if not formatted_history else None
 
-        # Get entire conversation history
-        conversation_history = ChatHistory.objects.filter(user=user).order_by('timestamp').values_list('role', 'content')
-        formatted_history = "\n".join([f"{role.capitalize()}: {content}" for role, content in conversation_history])
+        # Near-duplicate queries reuse retrieval context (and, without history, the user's own earlier answer)
+        mode = retrieval_mode(self.retrieval_endpoint)
+        cache_hit = response_cache.lookup(user_message, catalog.version, mode, response_user)
+        if cache_hit:
+            print(f"Response cache {cache_hit.tier} hit (response cached: {bool(cache_hit.response)})")
+            retrieved_info = cache_hit.context
+        else:
+            retrieved_info = self.retrieve_relevant_info(user_message)
 
-        available_products = Product.objects.values_list('name', flat=True)
+        available_products = catalog.names
         products_formatted = "\n".join([f"- {product}" for product in available_products])
 
         prompt_content = f"""You are a helpful AI assistant for suggesting products from the following list: {', '.join(available_products)}.
 
-You will be provided with relevant product information and the user's current message, along with the entire conversation history for context. Your goal is to respond to the user's query and suggest up to 3 relevant products.
+You will be provided with relevant product information and the user's current message, along with the recent conversation history (older turns summarized) for context. Your goal is to respond to the user's query and suggest up to 3 relevant products.
 
 Format your response with "**Response:**" followed by your conversational answer, and then "**Suggested Products:**" followed by a bulleted list of product names. If no products are relevant, you can omit the "Suggested Products" section.
 
@@ -455,15 +369,21 @@ User: {user_message}
 **Response:** """
 
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt_content}],
-                max_tokens=500,
-                n=1,
-                stop=None,
-                temperature=0.7,
-            )
-            chatbot_response = response.choices[0].message.content.strip()
+            if cache_hit and cache_hit.response:
+                chatbot_response = cache_hit.response
+            else:
+                response = client.chat.completions.create(
+                    model="gpt-4-turbo",
+                    messages=[{"role": "user", "content": prompt_content}],
+                    max_tokens=500,
+                    n=1,
+                    stop=None,
+                    temperature=0.7,
+                )
+                chatbot_response = response.choices[0].message.content.strip()
+                if not cache_hit or response_user is not None:
+                    response_cache.store(user_message, catalog.version, mode, retrieved_info,
+                                         chatbot_response if response_user is not None else None, response_user)
             print(f"Chatbot Response: {chatbot_response}")
 
             suggested_products = []
@@ -471,22 +391,13 @@ User: {user_message}
                 parts = chatbot_response.split("**Suggested Products:**")
                 chatbot_response = parts[0].replace("**Response:**", "").strip()
                 suggestions_text = parts[1].strip()
-                suggestion_lines = [line.strip().lstrip('- ').strip() for line in suggestions_text.split('\n') if line.strip().startswith('-')]
-                available_product_names = list(Product.objects.values_list('name', flat=True))
-                suggested_products = [{"name": name, "category": Product.objects.filter(name=name).first().category if Product.objects.filter(name=name).first() else None} for name in suggestion_lines if name in available_product_names and name not in initial_suggestions][:3]
+                suggested_products = catalog.matcher.suggested_products(suggestions_text, exclude=initial_suggestions, limit=3)
 
             print(f"Suggested Products: {suggested_products}")
 
-            ChatHistory.objects.create(
-                user=user,
-                role="user",
-                content=user_message,
-            )
-            ChatHistory.objects.create(
-                user=user,
-                role="assistant",
-                content=chatbot_response,
-            )
+            # Persisted in the background (write-behind) so the response doesn't wait on the commit
+            history_writer.enqueue(user, "user", user_message)
+            history_writer.enqueue(user, "assistant", chatbot_response)
 
             response_data = {"response": chatbot_response, "suggested_products": suggested_products}
             return Response(response_data, status=status.HTTP_200_OK)
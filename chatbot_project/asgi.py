@@ -4,6 +4,8 @@ import django # Import django
 
 # Set the Django settings module for the application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_project.settings')
+# This process serves traffic: warm up the LLM/retriever and start background refills (chat/apps.py)
+os.environ.setdefault('CHAT_WARMUP', '1')
 
 # Configure Django settings *immediately* after setting the module path
 # This is the ONLY place django.setup() should be called in the entry point
@@ -194,4 +194,160 @@ CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
-}
\ No newline at end of file
+}
+
+# --- Chat app tuning ---
+# Seconds before the in-process product catalog cache is reloaded even without
+# a Product save/delete signal (signals only reach the current process). 0 disables.
+CHAT_CATALOG_TTL = 300
+
+# On-disk Chroma collection holding one vector per product (see chat/vector_index.py).
+CHAT_VECTOR_INDEX_DIR = BASE_DIR / 'vector_index'
+
+# How ChatConfig.ready() builds the LLM/retriever:
+#   "background" - warm up on a daemon thread, requests block only until it finishes
+#   "lazy"       - build on the first request that needs them
+#   "eager"      - build synchronously before serving (previous behaviour)
+# Readiness is reported at /healthz/ready.
+CHAT_STARTUP_MODE = 'background'
+# manage.py commands that serve traffic; every other command skips the warm-up.
+# Other servers (daphne, uvicorn, gunicorn) are detected through the CHAT_WARMUP=1
+# environment variable that chatbot_project/asgi.py and wsgi.py set; set
+# CHAT_WARMUP=0 to opt a process out.
+CHAT_SERVING_COMMANDS = ['runserver', 'runworker']
+
+# Embedding cache (chat/embeddings.py): entries kept in memory, SQLite file shared
+# by all workers (None disables the disk tier), and max texts per embedding API call.
+CHAT_EMBEDDING_CACHE_SIZE = 10000
+CHAT_EMBEDDING_CACHE_PATH = BASE_DIR / 'embedding_cache.sqlite3'
+CHAT_EMBEDDING_BATCH_SIZE = 256
+
+# Product retriever backend behind ChatConfig.retriever:
+#   "chroma" - persistent Chroma collection (see CHAT_VECTOR_INDEX_DIR)
+#   "numpy"  - exact in-memory float32 matrix, best for small/medium catalogs
+#   "hybrid" - "numpy" plus BM25 over name/description, category/price prefilters
+CHAT_RETRIEVER_BACKEND = 'chroma'
+# Weight of the vector score in the "hybrid" backend (1 - alpha goes to BM25).
+CHAT_HYBRID_ALPHA = 0.5
+
+# How product information is gathered before the main LLM call (chat/retrieval.py):
+#   "context" - retrieved product documents go straight into the prompt (one LLM call)
+#   "qa"      - a RetrievalQA chain summarizes them first (two LLM calls, previous behaviour)
+# CHAT_RETRIEVAL_MODES overrides the default per endpoint to compare latency/cost.
+CHAT_RETRIEVAL_MODE = 'context'
+CHAT_RETRIEVAL_MODES = {
+    'send': 'context',            # SendMessageView (/api/chat/send/)
+    'send_assistant': 'context',  # SendMessageView1 (Assistants API)
+    'voice': 'context',           # chatbot_logic.process_voice_transcript
+}
+
+# Two-tier response cache (chat/response_cache.py): max entries (LRU), entry
+# lifetime in seconds, and cosine similarity needed for a semantic-tier hit.
+CHAT_RESPONSE_CACHE_SIZE = 2000
+CHAT_RESPONSE_CACHE_TTL = 600
+CHAT_RESPONSE_CACHE_THRESHOLD = 0.92
+
+# Conversation history window (chat/history.py): tokens of recent turns kept
+# verbatim in prompts, max rows read per turn, and how older turns are folded
+# into each user's rolling ConversationSummary: once CHAT_HISTORY_FOLD_THRESHOLD
+# turns have fallen out of the window, oldest first, CHAT_HISTORY_FOLD_BATCH
+# turns per summarization call.
+CHAT_HISTORY_TOKEN_BUDGET = 1500
+CHAT_HISTORY_MAX_ROWS = 100
+CHAT_HISTORY_FOLD_THRESHOLD = 20
+CHAT_HISTORY_FOLD_BATCH = 40
+CHAT_HISTORY_SUMMARY_MODEL = 'gpt-4-turbo'
+CHAT_HISTORY_SUMMARY_MAX_TOKENS = 300
+
+# Write-behind ChatHistory persistence (chat/history_writer.py): rows are
+# inserted with bulk_create once this many are queued or every interval seconds.
+# A row the database rejects is retried on CHAT_HISTORY_WRITE_MAX_ATTEMPTS
+# flushes and then dropped; at most CHAT_HISTORY_WRITE_MAX_BUFFER rows wait
+# in memory (the oldest are dropped beyond that, e.g. during a DB outage).
+CHAT_HISTORY_WRITE_BATCH_SIZE = 200
+CHAT_HISTORY_WRITE_INTERVAL = 0.5
+CHAT_HISTORY_WRITE_MAX_ATTEMPTS = 3
+CHAT_HISTORY_WRITE_MAX_BUFFER = 10000
+
+# Shared OpenAI clients (chat/openai_clients.py): connection pool size, idle
+# keep-alive connections and how long they are kept, timeouts in seconds and
+# retries. HTTP/2 is used when enabled and the "h2" package is installed.
+CHAT_OPENAI_MAX_CONNECTIONS = 100
+CHAT_OPENAI_MAX_KEEPALIVE = 20
+CHAT_OPENAI_KEEPALIVE_EXPIRY = 30
+CHAT_OPENAI_TIMEOUT = 60
+CHAT_OPENAI_CONNECT_TIMEOUT = 5
+CHAT_OPENAI_MAX_RETRIES = 2
+CHAT_OPENAI_HTTP2 = True
+
+# Serve /api/chat/send/ and /api/chat/suggestions/ with the async views in
+# chat/async_views.py (AsyncOpenAI + async ORM on the ASGI event loop). False
+# falls back to the DRF views in chat/views.py.
+CHAT_ASYNC_VIEWS = True
+
+# Voice replies (chat/services/tts_pipeline.py): synthesize each sentence while
+# the reply is still streaming, with at most CHAT_TTS_MAX_PARALLEL synthesis
+# calls per reply; short sentences are merged up to CHAT_TTS_MIN_SENTENCE_CHARS.
+# False synthesizes the whole reply once it is complete.
+CHAT_TTS_PIPELINE = True
+CHAT_TTS_MAX_PARALLEL = 3
+CHAT_TTS_MIN_SENTENCE_CHARS = 20
+
+# Synthesized audio cache (chat/services/tts_cache.py): bytes kept in memory,
+# SQLite file shared by all workers (None disables the disk tier) and its size cap.
+CHAT_TTS_CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+CHAT_TTS_CACHE_PATH = BASE_DIR / 'tts_cache.sqlite3'
+CHAT_TTS_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Max audio bytes per binary WebSocket frame for clients that negotiate binary
+# audio (chat/audio_frames.py); other clients get base64 JSON tts_chunk events.
+CHAT_WS_AUDIO_CHUNK_BYTES = 32 * 1024
+
+# TTS backend (chat/services/tts_backends.py): "google" (Cloud Text-to-Speech,
+# async client) or "local" (deterministic offline WAV tones for benchmarks/CI,
+# with CHAT_TTS_LOCAL_LATENCY seconds of simulated delay). At most
+# CHAT_TTS_MAX_CONCURRENCY syntheses run at once per process; callers wait up
+# to CHAT_TTS_QUEUE_TIMEOUT seconds for a slot and each call may take
+# CHAT_TTS_REQUEST_TIMEOUT seconds.
+CHAT_TTS_BACKEND = 'google'
+CHAT_TTS_LOCAL_LATENCY = 0.0
+CHAT_TTS_MAX_CONCURRENCY = 8
+CHAT_TTS_QUEUE_TIMEOUT = 5
+CHAT_TTS_REQUEST_TIMEOUT = 15
+
+# Waiting for Assistants API runs (chat/assistant_runs.py): follow streamed run
+# events when enabled, otherwise poll starting at CHAT_ASSISTANT_POLL_INITIAL
+# seconds, backing off to CHAT_ASSISTANT_POLL_MAX. Runs still going after
+# CHAT_ASSISTANT_RUN_TIMEOUT seconds are cancelled.
+CHAT_ASSISTANT_RUN_STREAMING = True
+CHAT_ASSISTANT_POLL_INITIAL = 0.05
+CHAT_ASSISTANT_POLL_MAX = 1.0
+CHAT_ASSISTANT_RUN_TIMEOUT = 60
+
+# Assistants thread per user (chat/threads.py): the AssistantThread row is
+# cached in-process for CHAT_THREAD_CACHE_TTL seconds.
+CHAT_THREAD_CACHE_TTL = 300
+
+# Pre-warmed Assistants threads (chat/threads.py): keep CHAT_THREAD_POOL_SIZE
+# threads primed with the current catalog context ready for new users (0
+# disables the pool). The refill thread also rechecks the catalog every
+# CHAT_THREAD_POOL_REFILL_INTERVAL seconds.
+CHAT_THREAD_POOL_SIZE = 5
+CHAT_THREAD_POOL_REFILL_INTERVAL = 60
+
+# Product suggestions (chat/suggestions.py): cached per user until they send a
+# new message or the catalog changes, for up to CHAT_SUGGESTIONS_CACHE_USERS
+# users. New user turns are recomputed in the background by
+# CHAT_SUGGESTIONS_REFRESH_WORKERS threads (0 recomputes on the next request).
+CHAT_SUGGESTIONS_CACHE_USERS = 10000
+CHAT_SUGGESTIONS_REFRESH_WORKERS = 2
+# How suggestions are picked (chat/suggestion_engine.py):
+#   "embeddings" - recent messages scored against the product vectors; the LLM
+#                  is only asked when the best product beats the catalog average
+#                  cosine score by less than CHAT_SUGGESTIONS_MIN_MARGIN
+#   "llm"        - always ask gpt-4-turbo (previous behaviour)
+# CHAT_SUGGESTIONS_CATEGORY_PENALTY is subtracted per product already picked
+# from the same category, spreading suggestions across categories.
+CHAT_SUGGESTIONS_ENGINE = 'embeddings'
+CHAT_SUGGESTIONS_MIN_MARGIN = 0.05
+CHAT_SUGGESTIONS_CATEGORY_PENALTY = 0.05
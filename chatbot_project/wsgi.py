@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_project.settings')
+os.environ.setdefault('CHAT_WARMUP', '1')  # Serving process: warm up in chat/apps.py
 
 application = get_wsgi_application()